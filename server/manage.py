@@ -63,6 +63,122 @@ def create_db():
     db.create_all()
 
 
+@manager.command
+def rebuild_stats():
+    """
+    Recomputes every candidate's aggregates (candidate_stats, hunch running sums included) from scores & hunches,
+    and candidate.hunch for comparisons still averaging hunches.
+    """
+    models.CandidateStats.refresh()
+    for comparison in db.session.query(models.Comparison).all():
+        if comparison.hunch_tier(comparison.hunch_count()) == 'average':
+            comparison.publish_hunch_averages()
+    db.session.commit()
+
+
+@manager.command
+def purge_deleted():
+    """Finishes deleting tombstoned comparisons (eg after an interrupted purge), in batches."""
+    def progress(comparison_id, table, deleted):
+        print('%s: done' % comparison_id if table is None else '%s: %d %s' % (comparison_id, deleted, table))
+    models.Comparison.purge_deleted(batch_size=app.config.get('DELETION_BATCH_SIZE'), progress=progress)
+
+
+@manager.command
+def prune_tokens():
+    """Deletes blacklisted tokens which have expired."""
+    print('Pruned %d expired tokens' % models.BlacklistToken.prune())
+
+
+@manager.command
+def refit_hunches():
+    """Refits every online hunch learner from scratch, to correct drift. Run periodically (eg nightly cron)."""
+    for learner in db.session.query(models.HunchLearner).all():
+        comparison = db.session.query(models.Comparison).get(learner.comparison_id)
+        # Other tiers don't use the learner; it's refit anyway if they come back to the linear tier
+        if comparison.hunch_tier(comparison.hunch_count()) == 'linear':
+            comparison.retrain()
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='1000,10000', help='Comma-separated candidate counts')
+def bench_rankings(sizes):
+    """Times the ranking query at each comparison size, against the legacy query (checking identical output)."""
+    from project.bench import rankings
+    for r in rankings.run(sizes=[int(n) for n in sizes.split(',')]):
+        print('{candidates:>7} candidates: legacy {legacy_ms:8.1f}ms, current {current_ms:8.1f}ms'.format(**r))
+
+
+BENCH_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'tmp', 'bench')
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='small,medium',
+                help='Comma-separated sizes: small, medium, large, or candidates x features x users x hunches')
+@manager.option('-c', '--scenarios', dest='scenarios', default=None, help='Comma-separated scenarios (default all)')
+@manager.option('-r', '--repeat', dest='repeat', default=20, type=int, help='Timed runs per scenario')
+@manager.option('-o', '--output', dest='output', default=os.path.join(BENCH_DIR, 'results.json'),
+                help='Where to write results')
+@manager.option('-b', '--baseline', dest='baseline', default=os.path.join(BENCH_DIR, 'baseline.json'),
+                help='Results to compare to')
+@manager.option('-t', '--threshold', dest='threshold', default=1.2, type=float,
+                help='Median/baseline ratio counted as a regression')
+@manager.option('--save-baseline', dest='save_baseline', action='store_true', help='Make these results the baseline')
+def bench(sizes, scenarios, repeat, output, baseline, threshold, save_baseline):
+    """Times model operations on seeded comparisons & compares to a baseline. Fails if any regressed."""
+    from project.bench import micro
+
+    def progress(r):
+        print('{size:>8} {scenario:<22} median {median_ms:9.2f}ms  p95 {p95_ms:9.2f}ms'.format(**r))
+    results = micro.run(sizes=sizes.split(','), scenarios=scenarios.split(',') if scenarios else None,
+                        repeat=repeat, progress=progress)
+    micro.save(output, results)
+    print('Results written to %s' % output)
+    if save_baseline:
+        micro.save(baseline, results)
+        print('Saved as the baseline, %s' % baseline)
+        return 0
+    if not os.path.exists(baseline):
+        print('No baseline at %s; run with --save-baseline to store one' % baseline)
+        return 0
+    regressions = 0
+    for c in micro.compare(results, micro.load(baseline), threshold=threshold):
+        regressions += c['regressed']
+        print('{size:>8} {scenario:<22} {baseline_ms:9.2f}ms -> {median_ms:9.2f}ms  x{ratio:.2f}{flag}'.format(
+            flag='  REGRESSED' if c['regressed'] else '', **c))
+    return 1 if regressions else 0
+
+
+@manager.option('-u', '--url', dest='url', default='http://localhost:5000', help='Running server to load')
+@manager.option('-n', '--users', dest='users', default=20, type=int, help='Concurrent virtual users')
+@manager.option('-d', '--duration', dest='duration', default=30, type=int, help='Seconds of load, after setup')
+@manager.option('--hot-ratio', dest='hot_ratio', default=0.5, type=float,
+                help='Share of rounds spent on the one comparison everybody scores')
+@manager.option('-o', '--output', dest='output', default=os.path.join(BENCH_DIR, 'load.json'),
+                help='Where to write results')
+@manager.option('--keep', dest='keep', action='store_true', help="Don't delete the users & comparisons it creates")
+def load(url, users, duration, hot_ratio, output, keep):
+    """Drives a running server with concurrent virtual users & reports latency, errors, locks and pool use."""
+    from project.bench import load as harness, micro
+    result = harness.run(url, users=users, duration=duration, hot_ratio=hot_ratio, keep=keep)
+    print('{:<50} {:>7} {:>7} {:>8} {:>8} {:>8} {:>7}'.format('', 'reqs', 'rps', 'p50', 'p95', 'p99', 'errors'))
+    for endpoint, r in result['endpoints'].items():
+        print('{:<50} {requests:>7} {rps:>7.1f} {p50_ms:>6.0f}ms {p95_ms:>6.0f}ms {p99_ms:>6.0f}ms {:>6.1%}'.format(
+            endpoint, r['error_rate'], **r))
+    database, pool = result['database'], result['pool']
+    if database:
+        print('Postgres: up to %(max_connections)d connections, %(max_idle_in_transaction)d idle in transaction, '
+              '%(max_waiting_on_locks)d waiting on locks (mean %(mean_waiting_on_locks).1f)' % database)
+        for statement, count in database['most_blocked']:
+            print('  blocked x%d: %s' % (count, ' '.join(statement.split())))
+    if pool:
+        print('Pool: {checkouts:.0f} checkouts, {slow_checkouts:.0f} waited >100ms, '
+              'at capacity in {samples_at_capacity} samples'.format(**pool))
+    else:
+        print('Pool: no /metrics from the server (METRICS_ENABLED)')
+    micro.save(output, result)
+    print('Results written to %s' % output)
+    return 1 if result['endpoints']['total']['errors'] else 0
+
+
 @manager.command
 def drop_db():
     """Drops the db tables."""
@@ -0,0 +1,60 @@
+"""Blacklisted tokens keyed on jti, with expires_on for pruning, rather than storing whole tokens
+
+Revision ID: 2f8e6d4b1a70
+Revises: 9a0c5f3e8d21
+Create Date: 2026-10-18 08:20:00.000000
+
+"""
+import datetime
+import uuid
+
+import jwt
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8e6d4b1a70'
+down_revision = '9a0c5f3e8d21'
+branch_labels = None
+depends_on = None
+
+
+def _token_key(payload, token):
+    # As BlacklistToken.token_key: tokens issued before jti was added are keyed on a UUID derived from the token
+    return payload.get('jti') or str(uuid.uuid5(uuid.NAMESPACE_OID, token))
+
+
+def upgrade():
+    # Blacklisted tokens: rekey each on its jti, with its expiry. Ones that don't decode can't be presented anyway
+    op.add_column('blacklist_tokens', sa.Column('jti', pg.UUID()))
+    op.add_column('blacklist_tokens', sa.Column('expires_on', sa.DateTime()))
+    conn = op.get_bind()
+    for row in conn.execute(sa.text('SELECT id, token FROM blacklist_tokens')).fetchall():
+        try:
+            payload = jwt.decode(row.token, verify=False)
+            params = dict(id=row.id, jti=_token_key(payload, row.token),
+                          expires_on=datetime.datetime.utcfromtimestamp(payload['exp']))
+        except (jwt.InvalidTokenError, KeyError):
+            conn.execute(sa.text('DELETE FROM blacklist_tokens WHERE id=:id'), id=row.id)
+            continue
+        conn.execute(sa.text('UPDATE blacklist_tokens SET jti=:jti, expires_on=:expires_on WHERE id=:id'), **params)
+    op.drop_column('blacklist_tokens', 'token')
+    op.drop_column('blacklist_tokens', 'id')  # Takes the primary key with it
+    op.alter_column('blacklist_tokens', 'jti', nullable=False)
+    op.alter_column('blacklist_tokens', 'expires_on', nullable=False)
+    op.create_primary_key('blacklist_tokens_pkey', 'blacklist_tokens', ['jti'])
+    op.create_index('ix_blacklist_tokens_expires_on', 'blacklist_tokens', ['expires_on'])
+    op.create_index('ix_blacklist_tokens_blacklisted_on', 'blacklist_tokens', ['blacklisted_on'])
+
+
+def downgrade():
+    # Revoked tokens can't be recovered from their jti, so the old blacklist comes back empty
+    op.drop_table('blacklist_tokens')
+    op.create_table(
+        'blacklist_tokens',
+        sa.Column('id', pg.UUID(), primary_key=True),
+        sa.Column('token', sa.String(500), nullable=False, unique=True),
+        sa.Column('blacklisted_on', sa.DateTime(), nullable=False),
+    )
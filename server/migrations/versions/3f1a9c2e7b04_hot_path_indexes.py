@@ -0,0 +1,40 @@
+"""Indexes for the hot query paths
+
+`manage.py create_db` now creates these indexes too, so this uses IF NOT EXISTS: it's safe on databases created
+either before or after it. On a live database with big tables, consider running the statements by hand with
+CREATE INDEX CONCURRENTLY instead.
+
+Revision ID: 3f1a9c2e7b04
+Revises: e0a4c8b3d615
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2e7b04'
+down_revision = 'e0a4c8b3d615'
+branch_labels = None
+depends_on = None
+
+# name: (table, columns)
+INDEXES = {
+    'ix_scores_candidate_id_feature_id': ('scores', 'candidate_id, feature_id'),
+    'ix_hunches_candidate_id': ('hunches', 'candidate_id'),
+    'ix_hunches_user_id_candidate_id_timestamp': ('hunches', 'user_id, candidate_id, timestamp'),
+    'ix_candidates_comparison_id': ('candidates', 'comparison_id'),
+    'ix_features_comparison_id': ('features', 'comparison_id'),
+    'ix_users_comparisons_comparison_id': ('users_comparisons', 'comparison_id'),
+}
+
+
+def upgrade():
+    for name, (table, columns) in sorted(INDEXES.items()):
+        op.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(name, table, columns))
+
+
+def downgrade():
+    for name in sorted(INDEXES):
+        op.execute('DROP INDEX IF EXISTS {}'.format(name))
@@ -0,0 +1,44 @@
+"""Per-candidate aggregates, maintained on write
+
+Run `manage.py rebuild_stats` afterwards to fill it in.
+
+The first revision: it applies to a database created by `manage.py create_db` from the original models. One
+created by create_db since already matches the models, so `manage.py db stamp head` it instead of upgrading.
+
+Revision ID: 4e7b2a91c0d3
+Revises:
+Create Date: 2026-10-18 08:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7b2a91c0d3'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+fk_cascade = dict(onupdate='CASCADE', ondelete='CASCADE')
+
+
+def upgrade():
+    op.create_table(
+        'candidate_stats',
+        sa.Column('candidate_id', pg.UUID(), sa.ForeignKey('candidates.id', **fk_cascade), primary_key=True),
+        sa.Column('comparison_id', pg.UUID(), sa.ForeignKey('comparisons.id', **fk_cascade), nullable=False),
+        sa.Column('features', pg.ARRAY(sa.Text())),
+        sa.Column('score_total', sa.Float(), nullable=False),
+        sa.Column('score_count', sa.Integer(), nullable=False),
+        sa.Column('hunch_total', sa.Float(), nullable=False),
+        sa.Column('hunch_avg', sa.Float(), nullable=False),
+        sa.Column('hunch_count', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_candidate_stats_comparison_id', 'candidate_stats', ['comparison_id'])
+
+
+def downgrade():
+    op.drop_index('ix_candidate_stats_comparison_id', table_name='candidate_stats')
+    op.drop_table('candidate_stats')
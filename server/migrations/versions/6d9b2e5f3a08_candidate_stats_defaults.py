@@ -0,0 +1,27 @@
+"""Server defaults for candidate_stats' totals & counts, so rows inserted outside the ORM start at 0
+
+Revision ID: 6d9b2e5f3a08
+Revises: c47f0e5d92b1
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6d9b2e5f3a08'
+down_revision = 'c47f0e5d92b1'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['score_total', 'score_count', 'hunch_total', 'hunch_avg', 'hunch_count']
+
+
+def upgrade():
+    for column in COLUMNS:
+        op.alter_column('candidate_stats', column, server_default='0')
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.alter_column('candidate_stats', column, server_default=None)
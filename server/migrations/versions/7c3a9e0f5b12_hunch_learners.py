@@ -0,0 +1,36 @@
+"""Online linear hunch models, one per comparison
+
+Revision ID: 7c3a9e0f5b12
+Revises: 2f8e6d4b1a70
+Create Date: 2026-10-18 08:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3a9e0f5b12'
+down_revision = '2f8e6d4b1a70'
+branch_labels = None
+depends_on = None
+
+fk_cascade = dict(onupdate='CASCADE', ondelete='CASCADE')
+
+
+def upgrade():
+    op.create_table(
+        'hunch_learners',
+        sa.Column('comparison_id', pg.UUID(), sa.ForeignKey('comparisons.id', **fk_cascade), primary_key=True),
+        sa.Column('feature_ids', pg.ARRAY(sa.String()), nullable=False),
+        sa.Column('weights', pg.ARRAY(sa.Float()), nullable=False),
+        sa.Column('covariance', pg.ARRAY(sa.Float()), nullable=False),
+        sa.Column('n_samples', sa.Integer(), nullable=False),
+        sa.Column('n_updates', sa.Integer(), nullable=False),
+        sa.Column('refit_on', sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table('hunch_learners')
@@ -0,0 +1,31 @@
+"""Time-decayed hunch running sums on candidate_stats
+
+Run `manage.py rebuild_stats` afterwards to fill them in.
+
+Revision ID: 8d2e4b7c1a93
+Revises: 3f1a9c2e7b04
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b7c1a93'
+down_revision = '3f1a9c2e7b04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('candidate_stats', sa.Column('hunch_decayed_sum', sa.Float(), nullable=False, server_default='0'))
+    op.add_column('candidate_stats', sa.Column('hunch_decayed_weight', sa.Float(), nullable=False, server_default='0'))
+    op.add_column('candidate_stats', sa.Column('hunch_decayed_at', sa.DateTime(), nullable=False,
+                                               server_default=sa.func.now()))
+
+
+def downgrade():
+    op.drop_column('candidate_stats', 'hunch_decayed_at')
+    op.drop_column('candidate_stats', 'hunch_decayed_weight')
+    op.drop_column('candidate_stats', 'hunch_decayed_sum')
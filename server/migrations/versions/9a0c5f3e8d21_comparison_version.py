@@ -0,0 +1,24 @@
+"""comparisons.version, the rankings cache key
+
+Revision ID: 9a0c5f3e8d21
+Revises: 4e7b2a91c0d3
+Create Date: 2026-10-18 08:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a0c5f3e8d21'
+down_revision = '4e7b2a91c0d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comparisons', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('comparisons', 'version')
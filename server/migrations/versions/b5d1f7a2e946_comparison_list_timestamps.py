@@ -0,0 +1,28 @@
+"""Timestamps for the paginated comparison list: when each was last changed, and when each user got it
+
+Revision ID: b5d1f7a2e946
+Revises: 7c3a9e0f5b12
+Create Date: 2026-10-18 08:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d1f7a2e946'
+down_revision = '7c3a9e0f5b12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comparisons', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                           server_default=sa.func.now()))
+    op.add_column('users_comparisons', sa.Column('created_at', sa.DateTime(), nullable=False,
+                                                 server_default=sa.func.now()))
+
+
+def downgrade():
+    op.drop_column('users_comparisons', 'created_at')
+    op.drop_column('comparisons', 'updated_at')
@@ -0,0 +1,27 @@
+"""Comparison tombstones, for background deletion
+
+Revision ID: c47f0e5d92b1
+Revises: 8d2e4b7c1a93
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47f0e5d92b1'
+down_revision = '8d2e4b7c1a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comparisons', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_comparisons_deleted_at', 'comparisons', ['deleted_at'],
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_comparisons_deleted_at', table_name='comparisons')
+    op.drop_column('comparisons', 'deleted_at')
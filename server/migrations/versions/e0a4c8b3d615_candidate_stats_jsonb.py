@@ -0,0 +1,27 @@
+"""candidate_stats.features as JSONB, built by Postgres rather than concatenated into strings
+
+Breakdowns are rebuilt rather than converted: run `manage.py rebuild_stats` afterwards.
+
+Revision ID: e0a4c8b3d615
+Revises: b5d1f7a2e946
+Create Date: 2026-10-18 08:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+
+# revision identifiers, used by Alembic.
+revision = 'e0a4c8b3d615'
+down_revision = 'b5d1f7a2e946'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column('candidate_stats', 'features', type_=pg.JSONB(), postgresql_using='NULL')
+
+
+def downgrade():
+    op.alter_column('candidate_stats', 'features', type_=pg.ARRAY(sa.Text()), postgresql_using='NULL')
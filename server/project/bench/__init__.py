@@ -0,0 +1 @@
+# project/bench/__init__.py
@@ -0,0 +1,76 @@
+# project/bench/generate.py
+
+import random
+import uuid
+import datetime
+
+from sqlalchemy import text
+
+from project.server import db
+from project.server import models as m
+
+
+def seed_comparison(n_candidates, n_features=10, n_users=1, n_hunches=None, hunch_ratio=0.1, seed=0):
+    """
+    Insert a synthetic comparison owned by a fresh user and shared (score permission) with `n_users - 1` more:
+    every user scores every candidate on every feature, and `n_hunches` hunches (default `hunch_ratio` of
+    candidates) are spread over distinct users & candidates, half of them within the last hour so last_hunch is
+    exercised. Deterministic for a given seed, apart from ids. Bulk-inserted, bypassing the ORM.
+    :return: (owner, comparison); the other users are found through comparison.user_comparison
+    """
+    rand = random.Random(seed)
+    owner = m.User(email='bench-{}@example.com'.format(uuid.uuid4()), password='bench')
+    db.session.add(owner)
+    db.session.commit()
+    comparison = owner.create_comparison(title='Bench {}x{}'.format(n_candidates, n_features)).comparison
+
+    # Everyone shares the owner's password hash, rather than paying for bcrypt per user
+    users = [dict(id=str(uuid.uuid4()), email='bench-{}@example.com'.format(uuid.uuid4()), password=owner.password,
+                  registered_on=datetime.datetime.utcnow()) for _ in range(n_users - 1)]
+    user_ids = [owner.id] + [u['id'] for u in users]
+    features = [dict(id=str(uuid.uuid4()), title='Feature-%d' % i, weight=rand.randint(1, 5),
+                     comparison_id=comparison.id) for i in range(n_features)]
+    candidates = [dict(id=str(uuid.uuid4()), title='Candidate-%d' % i, comparison_id=comparison.id)
+                  for i in range(n_candidates)]
+    scores = [dict(user_id=u, candidate_id=c['id'], feature_id=f['id'], score=rand.randint(0, 5))
+              for u in user_ids for c in candidates for f in features]
+    now = datetime.datetime.utcnow()
+    if n_hunches is None:
+        n_hunches = int(n_candidates * hunch_ratio)
+    pairs = rand.sample([(u, c['id']) for u in user_ids for c in candidates], n_hunches)
+    hunches = [dict(user_id=u, candidate_id=c, comparison_id=comparison.id, score=rand.randint(0, 5),
+                    timestamp=now - datetime.timedelta(hours=rand.choice([0, 2])))
+               for u, c in pairs]
+
+    if users:
+        db.session.execute(text("INSERT INTO users (id, email, password, registered_on) "
+                                "VALUES (:id, :email, :password, :registered_on)"), users)
+        db.session.execute(text("INSERT INTO users_comparisons (user_id, comparison_id, permission) "
+                                "VALUES (:user_id, :comparison_id, 'score')"),
+                           [dict(user_id=u['id'], comparison_id=comparison.id) for u in users])
+    db.session.execute(text("INSERT INTO features (id, title, weight, comparison_id) "
+                            "VALUES (:id, :title, :weight, :comparison_id)"), features)
+    db.session.execute(text("INSERT INTO candidates (id, title, comparison_id) "
+                            "VALUES (:id, :title, :comparison_id)"), candidates)
+    db.session.execute(text("INSERT INTO scores (user_id, candidate_id, feature_id, score) "
+                            "VALUES (:user_id, :candidate_id, :feature_id, :score)"), scores)
+    if hunches:
+        db.session.execute(text("INSERT INTO hunches (user_id, candidate_id, comparison_id, score, timestamp) "
+                                "VALUES (:user_id, :candidate_id, :comparison_id, :score, :timestamp)"), hunches)
+    m.CandidateStats.refresh(comparison_id=comparison.id)
+    m.Comparison.bump_version(comparison.id)
+    db.session.commit()
+    return owner, comparison
+
+
+def drop_seeded(user):
+    """Delete a seeded owner, the users it was shared with, and (via cascades) the comparison & everything in it"""
+    params = dict(user_id=user.id)
+    db.session.execute(text("DELETE FROM users WHERE email LIKE 'bench-%' AND id IN ("
+                            "SELECT uc.user_id FROM users_comparisons uc JOIN users_comparisons mine "
+                            "ON mine.comparison_id=uc.comparison_id AND mine.user_id=:user_id "
+                            "WHERE uc.user_id<>:user_id)"), params)
+    db.session.execute(text("DELETE FROM comparisons WHERE id IN "
+                            "(SELECT comparison_id FROM users_comparisons WHERE user_id=:user_id)"), params)
+    db.session.delete(user)
+    db.session.commit()
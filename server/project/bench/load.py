@@ -0,0 +1,312 @@
+# project/bench/load.py
+
+import json
+import time
+import uuid
+import random
+import socket
+import threading
+import traceback
+import urllib.error
+import urllib.request
+from collections import Counter, OrderedDict
+
+from sqlalchemy import text
+
+from project.server import app, db
+from project.server import models as m
+
+# Who's waiting on whom, from Postgres' side. pg_blocking_pids needs 9.6+
+ACTIVITY_QUERY = """
+SELECT a.state, a.wait_event_type, LEFT(a.query, 200) query, CARDINALITY(pg_blocking_pids(a.pid)) > 0 blocked
+FROM pg_stat_activity a
+WHERE a.datname=current_database() AND a.pid <> pg_backend_pid()
+"""
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already-sorted list"""
+    if not ordered: return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100. * len(ordered))) - 1))]
+
+
+class Recorder(object):
+    """Latency & outcome of every request, by endpoint (method + route, so ids don't split them up)"""
+
+    def __init__(self):
+        self.latencies = {}  # endpoint -> [ms]
+        self.errors = {}  # endpoint -> Counter(status code or exception name)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, ms, error=None):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(ms)
+            errors = self.errors.setdefault(endpoint, Counter())
+            if error is not None:
+                errors[error] += 1
+
+    def report(self, seconds):
+        with self._lock:
+            endpoints = {k: sorted(v) for k, v in self.latencies.items()}
+            errors = {k: Counter(v) for k, v in self.errors.items()}
+        endpoints['total'] = sorted(ms for v in endpoints.values() for ms in v)
+        errors['total'] = sum(errors.values(), Counter())
+        report = OrderedDict()
+        for endpoint in sorted(endpoints, key=lambda k: (k == 'total', k)):
+            times, failed = endpoints[endpoint], errors.get(endpoint, Counter())
+            report[endpoint] = dict(
+                requests=len(times),
+                rps=len(times) / seconds if seconds else None,
+                p50_ms=percentile(times, 50),
+                p95_ms=percentile(times, 95),
+                p99_ms=percentile(times, 99),
+                max_ms=times[-1] if times else None,
+                errors=sum(failed.values()),
+                error_rate=sum(failed.values()) / len(times) if times else 0,
+                error_kinds=dict(failed)
+            )
+        return report
+
+
+class Client(object):
+    """JSON over HTTP with the standard library; every call is timed into the recorder"""
+
+    def __init__(self, base_url, recorder, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+
+    def call(self, endpoint, method, path, data=None, token=None):
+        """:return: (status, parsed body); status is None if the request didn't complete"""
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        except (urllib.error.URLError, socket.timeout, ConnectionError) as e:
+            reason = getattr(e, 'reason', e)
+            self.recorder.record(endpoint, (time.perf_counter() - start) * 1000, type(reason).__name__)
+            return None, None
+        self.recorder.record(endpoint, (time.perf_counter() - start) * 1000, status if status >= 400 else None)
+        try:
+            return status, json.loads(payload.decode()) if payload else None
+        except ValueError:
+            return status, None
+
+
+class VirtualUser(object):
+    """
+    One simulated person: registers & logs in, sets up a comparison of their own, then until the deadline lists
+    their comparisons, opens one (often the shared "hot" one everybody scores), and fires bursts of scores and
+    hunches at it, sometimes sharing their own with others. Pauses up to `think` seconds between rounds.
+    """
+
+    def __init__(self, client, email, options, seed):
+        self.client = client
+        self.email = email
+        self.options = options
+        self.rand = random.Random(seed)
+        self.token = None
+        self.own_id = None
+
+    def call(self, endpoint, method, path, data=None):
+        return self.client.call(endpoint, method, path, data=data, token=self.token)
+
+    def setup(self):
+        password = 'load-test'
+        self.call('POST /auth/register', 'POST', '/auth/register', dict(email=self.email, password=password))
+        status, body = self.call('POST /auth/login', 'POST', '/auth/login', dict(email=self.email, password=password))
+        if status != 200: return False
+        self.token = body['auth_token']
+        status, body = self.call('POST /comparisons/', 'POST', '/comparisons/', dict(title='Load ' + self.email))
+        if status != 200: return False
+        self.own_id = body['data']['id']
+        for i in range(self.options['features']):
+            self.call('POST /comparisons/<cid>/features/', 'POST', '/comparisons/%s/features/' % self.own_id,
+                      dict(title='Feature %d' % i))
+        for i in range(self.options['candidates']):
+            self.call('POST /comparisons/<cid>/candidates/', 'POST', '/comparisons/%s/candidates/' % self.own_id,
+                      dict(title='Candidate %d' % i))
+        return True
+
+    def round(self, hot_id, emails):
+        o = self.options
+        self.call('GET /comparisons/', 'GET', '/comparisons/')
+        cid = hot_id if hot_id and self.rand.random() < o['hot_ratio'] else self.own_id
+        status, body = self.call('GET /comparisons/<id>', 'GET', '/comparisons/%s' % cid)
+        if status != 200: return
+        candidates = [c['id'] for c in body['data']['candidates']]
+        features = [f['id'] for f in body['data']['features']]
+        self.call('GET /comparisons/<cid>/candidates/', 'GET', '/comparisons/%s/candidates/' % cid)
+        if not candidates: return
+        for _ in range(self.rand.randint(1, o['burst']) if features else 0):
+            self.call('POST /score/<candidate_id>/<feature_id>/<score>', 'POST', '/score/%s/%s/%d' % (
+                self.rand.choice(candidates), self.rand.choice(features), self.rand.randint(0, 5)))
+        for _ in range(self.rand.randint(1, o['burst'])):
+            self.call('POST /hunch/<candidate_id>/<score>', 'POST', '/hunch/%s/%d' % (
+                self.rand.choice(candidates), self.rand.randint(0, 5)))
+        if self.rand.random() < o['share_ratio']:
+            friends = self.rand.sample(emails, min(3, len(emails)))
+            self.call('POST /comparisons/<cid>/shares', 'POST', '/comparisons/%s/shares' % self.own_id,
+                      dict(emails=friends, permission='score'))
+
+    def run(self, deadline, hot, emails):
+        while time.time() < deadline:
+            self.round(hot.get('id'), emails)
+            time.sleep(self.rand.uniform(0, self.options['think']))
+
+
+class Monitor(object):
+    """
+    Samples, every `interval` seconds while the load runs: Postgres backends (how many are waiting on locks, and
+    on which statements) and, if the server has METRICS_ENABLED, its connection pool from /metrics.
+    """
+
+    def __init__(self, client, interval=0.5):
+        self.client = client
+        self.interval = interval
+        self.samples = []
+        self.blocked = Counter()  # statement -> times seen waiting on a lock
+        self.pool = []  # (checked_out, size, overflow)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.metrics_before = self.scrape()
+        self._thread = threading.Thread(target=self._run, name='load-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.metrics_after = self.scrape()
+
+    def scrape(self):
+        """:return: {series: value} from the server's /metrics, or None if it isn't serving them"""
+        try:
+            with urllib.request.urlopen(self.client.base_url + '/metrics', timeout=self.client.timeout) as response:
+                lines = response.read().decode().splitlines()
+        except (urllib.error.URLError, socket.timeout, ConnectionError):
+            return None
+        series = {}
+        for line in lines:
+            if line and not line.startswith('#'):
+                name, _, value = line.rpartition(' ')
+                series[name] = float(value)
+        return series
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rows = db.engine.execute(text(ACTIVITY_QUERY)).fetchall()
+            waiting = [r for r in rows if r.wait_event_type == 'Lock' or r.blocked]
+            self.samples.append(dict(
+                connections=len(rows),
+                active=sum(1 for r in rows if r.state == 'active'),
+                idle_in_transaction=sum(1 for r in rows if r.state == 'idle in transaction'),
+                waiting_on_locks=len(waiting)
+            ))
+            self.blocked.update(r.query for r in waiting)
+            metrics = self.scrape()
+            if metrics and 'decisions_db_pool_checked_out' in metrics:
+                self.pool.append(tuple(
+                    metrics.get('decisions_db_pool_' + k) for k in ('checked_out', 'size', 'overflow')))
+
+    def report(self):
+        report = dict(database=None, pool=None)
+        if self.samples:
+            report['database'] = dict(
+                samples=len(self.samples),
+                max_connections=max(s['connections'] for s in self.samples),
+                max_idle_in_transaction=max(s['idle_in_transaction'] for s in self.samples),
+                max_waiting_on_locks=max(s['waiting_on_locks'] for s in self.samples),
+                mean_waiting_on_locks=sum(s['waiting_on_locks'] for s in self.samples) / len(self.samples),
+                most_blocked=self.blocked.most_common(5)
+            )
+        before, after = self.metrics_before, self.metrics_after
+        if before is not None and after is not None:
+            def delta(series):
+                return after.get(series, 0) - before.get(series, 0)
+            wait = 'decisions_db_pool_checkout_wait_seconds'
+            checkouts = delta(wait + '_count')
+            report['pool'] = dict(
+                checkouts=checkouts,
+                mean_checkout_wait_ms=delta(wait + '_sum') / checkouts * 1000 if checkouts else None,
+                # Waits of over 100ms mean every connection was in use
+                slow_checkouts=checkouts - delta(wait + '_bucket{le="0.1"}'),
+                max_checked_out=max((p[0] for p in self.pool), default=None),
+                size=self.pool[-1][1] if self.pool else None,
+                samples_at_capacity=sum(1 for checked_out, size, _ in self.pool if checked_out >= size)
+            )
+        return report
+
+
+def run(base_url, users=20, duration=30, candidates=20, features=5, burst=5, hot_ratio=0.5, share_ratio=0.05,
+        think=0.5, seed=0, timeout=30, keep=False):
+    """
+    Drive a running server with `users` concurrent virtual users for `duration` seconds, after they've all set
+    up. Users (and comparisons) it registers are deleted afterwards unless `keep`.
+    :return: dict(meta, endpoints, database, pool); endpoints' figures cover setup too
+    """
+    recorder = Recorder()
+    client = Client(base_url, recorder, timeout=timeout)
+    options = dict(candidates=candidates, features=features, burst=burst, hot_ratio=hot_ratio,
+                   share_ratio=share_ratio, think=think)
+    prefix = 'load-{}-'.format(uuid.uuid4().hex[:8])
+    emails = ['{}{}@example.com'.format(prefix, i) for i in range(users)]
+    vus = [VirtualUser(client, email, options, seed=seed + i) for i, email in enumerate(emails)]
+    hot = {}  # The first user's comparison, shared with everyone so they contend on its rows
+    ready = threading.Barrier(users)
+    monitor = Monitor(client)
+    timing = {}
+
+    def drive(vu):
+        try:
+            ok = vu.setup()
+        except Exception:
+            traceback.print_exc()
+            ok = False
+        if ready.wait() == 0:  # Exactly one thread does this, while the rest wait at the next barrier
+            hot_user = vus[0]
+            if hot_user.own_id:
+                hot_user.call('POST /comparisons/<cid>/shares', 'POST', '/comparisons/%s/shares' % hot_user.own_id,
+                              dict(emails=emails[1:], permission='score'))
+                hot['id'] = hot_user.own_id
+            monitor.start()
+            timing['started'] = time.time()
+        ready.wait()
+        if ok:
+            vu.run(timing['started'] + duration, hot, emails)
+
+    threads = [threading.Thread(target=drive, args=(vu,), name='vu-%d' % i, daemon=True)
+               for i, vu in enumerate(vus)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        if 'started' in timing:
+            monitor.stop()
+        if not keep:
+            cleanup(prefix)
+    elapsed = time.time() - timing.get('started', time.time())
+    result = dict(
+        meta=dict(url=base_url, users=users, duration=duration, elapsed=elapsed, **options),
+        endpoints=recorder.report(elapsed)
+    )
+    result.update(monitor.report() if 'started' in timing else dict(database=None, pool=None))
+    return result
+
+
+def cleanup(prefix):
+    """Delete the users a run registered, and their comparisons"""
+    # Purged here rather than by purge_worker, which would race this purge_deleted over the same rows
+    for user in db.session.query(m.User).filter(m.User.email.like(prefix + '%')).all():
+        user.destroy(purge=False)
+    m.Comparison.purge_deleted(batch_size=app.config.get('DELETION_BATCH_SIZE'))
@@ -0,0 +1,246 @@
+# project/bench/micro.py
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import datetime
+import platform
+import statistics
+import subprocess
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+from project.server import app, db
+from project.server import models as m
+from project.server.auth.views import login_required
+from project.bench.generate import seed_comparison, drop_seeded
+
+# Comparison sizes by name; any other size can be given as "candidates x features x users x hunches", eg 500x8x3x200
+SIZES = OrderedDict([
+    ('small', dict(n_candidates=100, n_features=5, n_users=5, n_hunches=100)),
+    ('medium', dict(n_candidates=1000, n_features=10, n_users=10, n_hunches=2000)),
+    ('large', dict(n_candidates=10000, n_features=10, n_users=10, n_hunches=20000)),
+])
+DIMENSIONS = ('n_candidates', 'n_features', 'n_users', 'n_hunches')
+
+
+def parse_size(size):
+    if size in SIZES:
+        return SIZES[size]
+    try:
+        values = [int(n) for n in size.lower().split('x')]
+    except ValueError:
+        values = []
+    if len(values) != len(DIMENSIONS):
+        raise ValueError('Size must be one of {} or candidates x features x users x hunches, not {!r}'.format(
+            ', '.join(SIZES), size))
+    dimensions = dict(zip(DIMENSIONS, values))
+    # Each hunch is by a distinct user & candidate pair
+    if dimensions['n_hunches'] > dimensions['n_users'] * dimensions['n_candidates']:
+        raise ValueError('Size {!r} has more hunches than users x candidates ({})'.format(
+            size, dimensions['n_users'] * dimensions['n_candidates']))
+    return dimensions
+
+
+class Fixture(object):
+    """A seeded comparison, and what scenarios need to drive it"""
+
+    def __init__(self, owner, comparison, seed=0):
+        self.owner = owner
+        self.comparison = comparison
+        self.rand = random.Random(seed)
+        self.candidate_ids = [c.id for c in db.session.query(m.Candidate.id).filter_by(comparison_id=comparison.id)]
+        self.feature_ids = [f.id for f in db.session.query(m.Feature.id).filter_by(comparison_id=comparison.id)]
+        self.token = owner.encode_auth_token(owner.id).decode()
+
+    def candidate(self):
+        return self.rand.choice(self.candidate_ids)
+
+    def feature(self):
+        return self.rand.choice(self.feature_ids)
+
+    def score(self):
+        return self.rand.randint(0, 5)
+
+
+# name -> setup(fixture) returning the function to time. In order: reads, then writes (which change what reads see)
+SCENARIOS = OrderedDict()
+
+
+def scenario(name):
+    def register(setup):
+        SCENARIOS[name] = setup
+        return setup
+    return register
+
+
+@scenario('get_candidates')
+def _get_candidates(fx):
+    """Rankings with the cache cleared first, ie the query & post-processing"""
+    def run():
+        m.rankings_cache.clear()
+        fx.comparison.get_candidates(fx.owner.id)
+    return run
+
+
+@scenario('get_candidates_cached')
+def _get_candidates_cached(fx):
+    fx.comparison.get_candidates(fx.owner.id)
+    return lambda: fx.comparison.get_candidates(fx.owner.id)
+
+
+@scenario('to_json')
+def _to_json(fx):
+    """As GET /comparisons/<id>: eager-load the comparison's features & candidates, then serialize it"""
+    def run():
+        db.session.expire_all()
+        fx.owner.get_comparison(fx.comparison.id, eager=True).to_json()
+    return run
+
+
+def _authenticate(fx):
+    view = login_required(lambda: None)
+    headers = dict(Authorization='Bearer ' + fx.token)
+
+    def run():
+        with app.test_request_context(headers=headers):
+            assert view() is None, 'Bench token was rejected'
+    return run
+
+
+@scenario('login_required')
+def _login_required(fx):
+    """Token verification from scratch: signature, blacklist & user lookups"""
+    authenticate = _authenticate(fx)
+
+    def run():
+        m.token_cache.clear()
+        authenticate()
+    return run
+
+
+@scenario('login_required_cached')
+def _login_required_cached(fx):
+    return _authenticate(fx)
+
+
+@scenario('score')
+def _score(fx):
+    return lambda: fx.owner.score(fx.candidate(), fx.feature(), fx.score())
+
+
+@scenario('hunch')
+def _hunch(fx):
+    """User.hunch, which with HUNCH_DURABILITY='sync' includes Hunch.record_many & update_hunches"""
+    return lambda: fx.owner.hunch(fx.candidate(), fx.score())
+
+
+@scenario('update_hunches')
+def _update_hunches(fx):
+    """
+    One hunch's model update in whatever tier the comparison's in. Passed as revising a hunch to the same score, so
+    the hunch count (and so the tier) doesn't change between runs. Queued retraining isn't included
+    """
+    def run():
+        score = fx.score()
+        fx.comparison.update_hunches([(fx.candidate(), score, score)])
+    return run
+
+
+def summarize(times):
+    times = sorted(times)
+    return dict(
+        n=len(times),
+        min_ms=times[0],
+        median_ms=statistics.median(times),
+        p95_ms=times[max(0, int(math.ceil(len(times) * 0.95)) - 1)],
+        mean_ms=statistics.mean(times)
+    )
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(__file__)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=('small',), scenarios=None, repeat=20, warmup=2, seed=0, progress=None):
+    """
+    Seed a comparison per size, then time each scenario against it: `warmup` untimed runs, then `repeat` timed.
+    Runs against the configured database (a local Postgres), deleting what it seeded afterwards.
+    :param progress: progress(result) after each scenario, eg to print as it goes
+    :return: dict(meta, results); results are dict(scenario, size, dimensions..., n, min/median/p95/mean_ms)
+    """
+    scenarios = list(scenarios or SCENARIOS)
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        raise ValueError('Unknown scenarios {}; choose from {}'.format(', '.join(unknown), ', '.join(SCENARIOS)))
+    results = []
+    for size in sizes:
+        dimensions = parse_size(size)
+        owner, comparison = seed_comparison(seed=seed, **dimensions)
+        try:
+            fixture = Fixture(owner, comparison, seed=seed)
+            for name in scenarios:
+                fn = SCENARIOS[name](fixture)
+                for _ in range(warmup):
+                    fn()
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    fn()
+                    times.append((time.perf_counter() - start) * 1000)
+                result = dict(scenario=name, size=size, **dimensions)
+                result.update(summarize(times))
+                results.append(result)
+                if progress: progress(result)
+        finally:
+            m.hunch_buffer.flush()
+            db.session.rollback()
+            drop_seeded(owner)
+    meta = dict(
+        at=datetime.datetime.utcnow().isoformat(),
+        revision=_git_revision(),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        postgres=db.session.execute(text('SHOW server_version')).scalar(),
+        hunch_durability=app.config.get('HUNCH_DURABILITY'),
+        repeat=repeat
+    )
+    return dict(meta=meta, results=results)
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    Median times against a baseline run's, for scenarios & sizes in both.
+    :param threshold: a median this many times the baseline's counts as a regression
+    :return: [dict(scenario, size, baseline_ms, median_ms, ratio, regressed)]
+    """
+    before = {(r['scenario'], r['size']): r['median_ms'] for r in baseline['results']}
+    comparisons = []
+    for r in results['results']:
+        baseline_ms = before.get((r['scenario'], r['size']))
+        if baseline_ms is None: continue
+        ratio = r['median_ms'] / baseline_ms if baseline_ms else float('inf')
+        comparisons.append(dict(
+            scenario=r['scenario'], size=r['size'], baseline_ms=baseline_ms, median_ms=r['median_ms'],
+            ratio=ratio, regressed=ratio > threshold
+        ))
+    return comparisons
+
+
+def save(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -19,6 +19,11 @@ app.config.from_object(app_settings)
 bcrypt = Bcrypt(app)
 db = SQLAlchemy(app)
 
+from project.server.metrics import metrics
+from project.server.tracing import tracer
+metrics.init_app(app, db)
+tracer.init_app(app, metrics)
+
 from project.server.auth.views import auth_blueprint
 app.register_blueprint(auth_blueprint)
 import project.server.views # register the main routes
\ No newline at end of file
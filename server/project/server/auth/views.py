@@ -7,7 +7,8 @@ from flask.views import MethodView
 from functools import wraps
 
 from project.server import bcrypt, db
-from project.server.models import User, BlacklistToken
+from project.server.tracing import tracer
+from project.server.models import User, BlacklistToken, token_cache, revocation_filter
 
 auth_blueprint = Blueprint('auth', __name__)
 
@@ -15,29 +16,45 @@ auth_blueprint = Blueprint('auth', __name__)
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # get the auth token
-        auth_header = request.headers.get('Authorization')
-        auth_token = auth_token = auth_header.split(" ")[1] if auth_header else ''
-        if auth_token:
-            resp = User.decode_auth_token(auth_token)
-            if bool(validators.uuid(resp)):
-                g.auth_token = auth_token
-                g.user = User.query.filter_by(id=resp).first()
-                return f(*args, **kwargs)
-            response_object = {
-                'status': 'fail',
-                'message': resp
-            }
-            return make_response(jsonify(response_object)), 401
-        else:
-            response_object = {
-                'status': 'fail',
-                'message': 'Provide a valid auth token.'
-            }
-            return make_response(jsonify(response_object)), 401
+        with tracer.span('auth'):
+            error = authenticate()
+        if error: return error
+        return f(*args, **kwargs)
     return decorated_function
 
 
+def authenticate():
+    """Set g.user from the request's auth token. :return: None if authenticated, else a 401 response"""
+    # get the auth token
+    auth_header = request.headers.get('Authorization')
+    auth_token = auth_token = auth_header.split(" ")[1] if auth_header else ''
+    if auth_token:
+        # Recently verified? Then skip the signature, blacklist & user lookups
+        user = token_cache.get(auth_token)
+        if user is not None:
+            g.auth_token = auth_token
+            g.user = db.session.merge(user, load=False)
+            return None
+        resp = User.verify_auth_token(auth_token)
+        if isinstance(resp, dict) and bool(validators.uuid(resp['sub'])):
+            g.auth_token = auth_token
+            g.user = User.query.filter_by(id=resp['sub']).first()
+            if g.user:
+                token_cache.set(auth_token, g.user.snapshot(), expires_at=resp['exp'])
+            return None
+        response_object = {
+            'status': 'fail',
+            'message': resp
+        }
+        return make_response(jsonify(response_object)), 401
+    else:
+        response_object = {
+            'status': 'fail',
+            'message': 'Provide a valid auth token.'
+        }
+        return make_response(jsonify(response_object)), 401
+
+
 class RegisterAPI(MethodView):
     """
     User Registration Resource
@@ -144,6 +161,9 @@ class LogoutAPI(MethodView):
             # insert the token
             db.session.add(blacklist_token)
             db.session.commit()
+            token_cache.pop(g.auth_token)
+            if revocation_filter:
+                revocation_filter.add(blacklist_token.jti)
             response_object = {
                 'status': 'success',
                 'message': 'Successfully logged out.'
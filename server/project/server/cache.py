@@ -0,0 +1,182 @@
+# project/server/cache.py
+
+import sys
+import math
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def approx_sizeof(obj):
+    """Rough deep size of plain data (dicts, lists, strings, numbers) in bytes, for cache memory caps"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_sizeof(k) + approx_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approx_sizeof(v) for v in obj)
+    return size
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-process LRU cache, bounded by entry count and (approximate) bytes. Keep keys versioned
+    (eg (comparison_id, version)) rather than invalidating; stale versions just age out.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None, sizeof=approx_sizeof):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key][0]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return  # Would evict everything else and still not fit
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, size = self._data.pop(key)
+            self._bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._data),
+                bytes=self._bytes,
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes
+            )
+
+
+class TTLCache(object):
+    """
+    Thread-safe in-process cache whose entries expire after `ttl` seconds, or sooner if given an explicit
+    `expires_at` (epoch seconds) on set. Oldest entries are evicted past `max_entries`.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at=None):
+        expires_at = min(time.time() + self.ttl, expires_at or float('inf'))
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires_at)
+            if len(self._data) > self.max_entries:
+                self._purge_expired()
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def discard_where(self, predicate):
+        """Drop every entry whose value matches predicate(value), eg all of a user's tokens"""
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if predicate(v)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _purge_expired(self):
+        now = time.time()
+        for key in [k for k, (_, expires_at) in self._data.items() if expires_at <= now]:
+            del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._data),
+                max_entries=self.max_entries,
+                ttl=self.ttl
+            )
+
+
+class BloomFilter(object):
+    """
+    Set membership with no false negatives and ~`error_rate` false positives at `capacity` items. Used to
+    answer "definitely not in the set" without a database lookup.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        # Double hashing (Kirsch-Mitzenmacher) off one digest, rather than num_hashes separate hashes
+        digest = hashlib.sha256(key.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        # Locked because setting a bit is a byte read-modify-write; a lost bit would be a false negative
+        with self._lock:
+            for p in positions:
+                self.bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
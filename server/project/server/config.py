@@ -12,6 +12,54 @@ class BaseConfig:
     DEBUG = False
     BCRYPT_LOG_ROUNDS = 13
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    RANKINGS_CACHE_MAX_ENTRIES = 1000
+    RANKINGS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    # Verified tokens are trusted for this long (or until they expire) without re-checking the blacklist, so
+    # a logout on another worker process takes up to this long to apply there
+    TOKEN_CACHE_TTL = 60
+    TOKEN_CACHE_MAX_ENTRIES = 10000
+    # Resolved comparison permissions (see User._resolve_permissions). Sharing clears this worker's entries for
+    # the comparison at once; other workers' within the TTL
+    PERMISSION_CACHE_TTL = 10
+    PERMISSION_CACHE_MAX_ENTRIES = 10000
+    # Optional Bloom filter in front of the token blacklist; other workers' logouts apply after SYNC_INTERVAL
+    REVOCATION_FILTER = False
+    REVOCATION_FILTER_CAPACITY = 100000
+    REVOCATION_FILTER_ERROR_RATE = 0.01
+    REVOCATION_FILTER_SYNC_INTERVAL = 5
+    # Hunch model training worker processes (see jobs.TrainingQueue)
+    HUNCH_WORKERS = 2
+    HUNCH_JOB_TIMEOUT = 300
+    HUNCH_JOB_MEMORY_MB = 2048  # Address space (RLIMIT_AS) per worker; not applied with the tensorflow backend
+    HUNCH_JOBS_INLINE = False
+    HUNCH_MODEL_BACKEND = 'numpy'  # or 'tensorflow' (see project.server.ml)
+    # Learn the linear tier per hunch (Comparison.learn_hunches) rather than queueing a full retrain
+    HUNCH_ONLINE_LEARNER = True
+    # How hunches are written (see ingest.HunchBuffer): 'sync' applies each before responding; 'journal' and
+    # 'memory' batch them, every MAX_DELAY seconds or MAX_BATCH hunches. A crash loses nothing with 'journal'
+    # (fsync'd per hunch), up to MAX_DELAY seconds of hunches with 'memory'. Either way rankings read right after a
+    # hunch (as the client does) can be up to MAX_DELAY stale, so keep 'sync' unless write load calls for batching
+    HUNCH_DURABILITY = 'sync'
+    HUNCH_BUFFER_MAX_BATCH = 500
+    HUNCH_BUFFER_MAX_DELAY = 1.0
+    HUNCH_JOURNAL_DIR = os.getenv('HUNCH_JOURNAL_DIR', os.path.join(basedir, '..', '..', 'tmp', 'hunches'))
+    # Below the linear tier, candidate.hunch is the average hunch. Set a half-life (seconds) to weight recent hunches
+    # more, exponentially; None for a plain average
+    HUNCH_HALF_LIFE = None
+    # Deleted comparisons are tombstoned, then their rows deleted this many per transaction (see jobs.PurgeWorker)
+    DELETION_BATCH_SIZE = 1000
+    DELETIONS_INLINE = False
+    # Request, SQL & training timings on /metrics (see metrics.Metrics); off makes /metrics a 404
+    METRICS_ENABLED = True
+    # Span traces of a SAMPLE_RATE fraction of requests, as JSON lines (see tracing.Tracer). Statements over
+    # SLOW_QUERY_MS are logged regardless, and an EXPLAIN_RATE fraction of them (at most one per EXPLAIN_INTERVAL
+    # seconds) EXPLAIN ANALYZEd, which runs them again
+    TRACING_ENABLED = False
+    TRACE_SAMPLE_RATE = 0.05
+    TRACE_FILE = os.getenv('TRACE_FILE', os.path.join(basedir, '..', '..', 'tmp', 'traces.jsonl'))
+    SLOW_QUERY_MS = 250
+    SLOW_QUERY_EXPLAIN_RATE = 0.1
+    SLOW_QUERY_EXPLAIN_INTERVAL = 10
 
 
 class DevelopmentConfig(BaseConfig):
@@ -28,6 +76,8 @@ class TestingConfig(BaseConfig):
     BCRYPT_LOG_ROUNDS = 4
     SQLALCHEMY_DATABASE_URI = postgres_local_base + database_name + '_test'
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    HUNCH_JOBS_INLINE = True
+    DELETIONS_INLINE = True
 
 
 class ProductionConfig(BaseConfig):
@@ -0,0 +1,48 @@
+# project/server/cursors.py
+"""
+Opaque keyset-pagination cursors: the sort key of the last row on a page, which the next page starts after.
+"""
+
+import json
+import uuid
+import base64
+import datetime
+import numbers
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+# Parsers for decode_cursor's `types`, each raising ValueError for a value that can't be one
+
+def timestamp(value):
+    if not isinstance(value, str): raise ValueError('Not a timestamp')
+    # As isoformat() writes them, which leaves out microseconds when they're 0
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+
+
+def uuid_string(value):
+    if not isinstance(value, str): raise ValueError('Not a UUID')
+    return str(uuid.UUID(value))
+
+
+def number(value):
+    if not isinstance(value, numbers.Real) or isinstance(value, bool): raise ValueError('Not a number')
+    return value
+
+
+def decode_cursor(cursor, types):
+    """
+    :param types: a parser per value the cursor should hold, eg (timestamp, uuid_string), so a tampered cursor is
+        rejected here rather than by the database
+    :raises ValueError: if the cursor wasn't one of ours
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('Invalid cursor')
+    return [parse(v) for parse, v in zip(types, values)]
@@ -0,0 +1,214 @@
+# project/server/ingest.py
+
+import os
+import glob
+import json
+import uuid
+import fcntl
+import atexit
+import datetime
+import threading
+import traceback
+from contextlib import contextmanager
+
+DURABILITY = ('sync', 'journal', 'memory')
+
+
+def _encode(hunch):
+    return json.dumps(dict(hunch, timestamp=hunch['timestamp'].isoformat()))
+
+
+def _decode(line):
+    hunch = json.loads(line)
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in hunch['timestamp'] else '%Y-%m-%dT%H:%M:%S'
+    hunch['timestamp'] = datetime.datetime.strptime(hunch['timestamp'], fmt)
+    return hunch
+
+
+@contextmanager
+def _no_context():
+    yield
+
+
+def _linked(f, path):
+    """Whether open file f is still the file at path (a recover() may have replayed & removed it first)"""
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+class HunchBuffer(object):
+    """
+    Accepts hunches immediately and hands them to `apply` in batches: every `max_delay` seconds, or as soon as
+    `max_batch` are waiting. `apply([hunch])` does the real write (Hunch.record_many), so a burst of slider taps
+    costs one statement and one re-aggregation per comparison rather than one each. Hunches are dicts of
+    user_id, candidate_id, comparison_id, score & timestamp (when accepted, which the "last hour" rule goes by).
+
+    `durability` is what a crash can lose:
+      'sync'    nothing; no buffering, each hunch is applied before add() returns
+      'journal' nothing acknowledged; each hunch is appended & fsync'd to a journal file before add() returns,
+                and journals left by dead buffers are replayed on startup. A buffer holds an
+                flock on each of its segments until they're applied, which is how recover() tells live from dead
+      'memory'  up to `max_delay` seconds of hunches
+    """
+
+    def __init__(self, apply, durability='sync', max_batch=500, max_delay=1.0, journal_dir=None,
+                 context=None):
+        assert durability in DURABILITY, 'durability must be one of {}'.format(DURABILITY)
+        assert durability != 'journal' or journal_dir, 'journal durability needs a journal_dir'
+        self.apply = apply
+        self.durability = durability
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.journal_dir = journal_dir
+        # Wraps flushes off the request path (eg in an app context); sync applies run in the caller's
+        self.context = context or _no_context
+        self.accepted = self.flushed = self.batches = self.failed = self.recovered = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One batch at a time, so they apply in order
+        self._wake = threading.Event()
+        self._flusher = None
+        self._journal = None
+        self._id = uuid.uuid4().hex  # Names this buffer's segments; pids get reused, this doesn't
+        self._segment = 0
+        self._sealed = []  # (path, file) of journal segments whose hunches are in a batch not yet applied
+        if durability == 'journal':
+            os.makedirs(journal_dir, exist_ok=True)
+
+    def add(self, hunch):
+        if self.durability == 'sync':
+            self.apply([hunch])
+            self.accepted += 1
+            self.flushed += 1
+            return
+        with self._lock:
+            if self.durability == 'journal':
+                if self._journal is None:
+                    self._journal = self._open_segment()
+                self._journal.write(_encode(hunch) + '\n')
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            self._pending.append(hunch)
+            self.accepted += 1
+            full = len(self._pending) >= self.max_batch
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='hunch-buffer', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Apply everything accepted so far. :return: number of hunches applied"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if self._journal is not None:
+                    # New hunches go to a new segment; this one (still locked) goes once its batch is applied
+                    self._sealed.append((self._segment_path(), self._journal))
+                    self._journal = None
+                    self._segment += 1
+                sealed = list(self._sealed)
+            if not batch:
+                return 0
+            try:
+                with self.context():
+                    self.apply(batch)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = batch  # Retried next flush, ahead of anything newer
+                    self.failed += 1
+                raise
+            for path, f in sealed:
+                os.remove(path)
+                f.close()
+            with self._lock:
+                self._sealed = [p for p in self._sealed if p not in sealed]
+                self.flushed += len(batch)
+                self.batches += 1
+            return len(batch)
+
+    def recover(self):
+        """Apply hunches journaled by buffers which died before flushing them. :return: number recovered"""
+        if self.durability != 'journal':
+            return 0
+        journals = []
+        try:
+            for path in glob.glob(os.path.join(self.journal_dir, 'hunches-*.jsonl')):
+                try:
+                    f = open(path)
+                except FileNotFoundError:
+                    continue  # Applied or recovered meanwhile
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    f.close()  # Its buffer is alive (maybe this one)
+                    continue
+                if not _linked(f, path):
+                    f.close()
+                    continue
+                journals.append((path, f))  # Held locked until removed, so no one else replays it
+            hunches = []
+            for path, f in sorted(journals, key=lambda j: os.fstat(j[1].fileno()).st_mtime):
+                # A torn last line is a hunch whose add() never returned
+                for line in f:
+                    try:
+                        hunches.append(_decode(line))
+                    except ValueError:
+                        pass
+            if hunches:
+                with self.context():
+                    self.apply(hunches)
+            for path, f in journals:
+                os.remove(path)
+        finally:
+            for path, f in journals:
+                f.close()
+        self.recovered += len(hunches)
+        return len(hunches)
+
+    def _open_segment(self):
+        path = self._segment_path()
+        while True:
+            f = open(path, 'a')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if _linked(f, path):
+                # So the segment itself survives a power loss, not just what's written to it
+                dir_fd = os.open(self.journal_dir, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+                return f
+            f.close()  # A recover() took it for a dead buffer's before we locked it
+
+    def _segment_path(self):
+        return os.path.join(self.journal_dir, 'hunches-{}-{}.jsonl'.format(self._id, self._segment))
+
+    def _run(self):
+        self._safely(self.recover)
+        while True:
+            self._wake.wait(timeout=self.max_delay)
+            self._wake.clear()
+            self._safely(self.flush)
+
+    def _safely(self, fn):
+        # Keep the flusher alive; failed batches stay pending (and journaled) and are retried
+        try:
+            fn()
+        except Exception:
+            traceback.print_exc()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                durability=self.durability,
+                pending=len(self._pending),
+                accepted=self.accepted,
+                flushed=self.flushed,
+                batches=self.batches,
+                failed=self.failed,
+                recovered=self.recovered
+            )
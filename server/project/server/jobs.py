@@ -0,0 +1,205 @@
+# project/server/jobs.py
+
+import time
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Unavailable on Windows, where memory limits just aren't enforced
+    resource = None
+
+
+def retrain(comparison_id, deep=False):
+    """Retrain a comparison's hunch model & publish its predictions. Runs in a worker (or inline in tests)"""
+    from project.server import db
+    from project.server.models import Comparison
+    comparison = db.session.query(Comparison).get(comparison_id)
+    if comparison:  # Could have been deleted while queued
+        comparison.retrain(deep=deep)
+
+
+def purge_deleted(batch_size=1000, progress=None):
+    """Delete every tombstoned comparison's rows, batch by batch (see Comparison.purge)"""
+    from project.server.models import Comparison
+    return Comparison.purge_deleted(batch_size=batch_size, progress=progress)
+
+
+def _retrain_job(comparison_id, deep):
+    from project.server import app, db
+    from project.server.tracing import tracer
+    with app.app_context(), tracer.trace('retrain', comparison_id=comparison_id, deep=deep):
+        retrain(comparison_id, deep=deep)
+        db.session.remove()
+
+
+def _worker(job, comparison_id, deep, memory_limit_mb):
+    if resource and memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    job(comparison_id, deep)
+
+
+class TrainingQueue(object):
+    """
+    Runs hunch-model retraining (Comparison.retrain) in local worker processes, off the request path.
+
+    At most one job per comparison is pending and one running: submitting a comparison that's already pending
+    just updates that job, and one that's running is queued to run again once it finishes (so the newest hunches
+    are always trained on). Jobs are killed after `timeout` seconds, and each worker's address space is capped at
+    `memory_limit_mb`. Workers commit predictions in one transaction at the end, so readers keep seeing the
+    last-published candidate.hunch until a newer model is done.
+
+    The cap is on virtual memory (RLIMIT_AS), so it counts what a library maps as well as what it uses. Importing
+    TensorFlow reserves far more address space than a retrain needs, so leave the cap off with that backend.
+    """
+
+    def __init__(self, workers=2, timeout=300, memory_limit_mb=None, inline=False, on_done=None, job=_retrain_job):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.job = job  # job(comparison_id, deep), run in a worker; must be picklable, ie module-level
+        self.inline = inline  # Run jobs synchronously in-process, for tests
+        self.on_done = on_done  # on_done(outcome, seconds, deep) as each job is reaped, eg for metrics
+        self.pending = OrderedDict()  # comparison_id -> job kwargs
+        self.running = {}  # comparison_id -> (process, started_at, deep)
+        self.submitted = self.coalesced = self.completed = self.failed = self.timed_out = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dispatcher = None
+        # spawn rather than fork: the parent has threads & pooled DB connections that mustn't be shared
+        self._context = multiprocessing.get_context('spawn')
+
+    def submit(self, comparison_id, deep=False):
+        if self.inline:
+            retrain(comparison_id, deep=deep)
+            return
+        with self._lock:
+            self.submitted += 1
+            if comparison_id in self.pending:
+                self.coalesced += 1
+            self.pending[comparison_id] = dict(deep=deep)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='training-queue', daemon=True)
+                self._dispatcher.start()
+        self._wake.set()
+
+    def _dispatch(self):
+        while True:
+            self._wake.wait(timeout=1)
+            self._wake.clear()
+            with self._lock:
+                self._reap()
+                self._start_pending()
+
+    def _reap(self):
+        now = time.time()
+        for comparison_id, (process, started_at, deep) in list(self.running.items()):
+            if process.is_alive():
+                if now - started_at < self.timeout:
+                    continue
+                process.terminate()
+                self.timed_out += 1
+                outcome = 'timed_out'
+            elif process.exitcode == 0:
+                self.completed += 1
+                outcome = 'completed'
+            else:
+                self.failed += 1
+                outcome = 'failed'
+            process.join()
+            del self.running[comparison_id]
+            if self.on_done:
+                self.on_done(outcome, now - started_at, deep)
+
+    def _start_pending(self):
+        for comparison_id in list(self.pending.keys()):
+            if len(self.running) >= self.workers:
+                return
+            if comparison_id in self.running:
+                continue  # Stays pending until the current run finishes
+            job = self.pending.pop(comparison_id)
+            process = self._context.Process(
+                target=_worker,
+                args=(self.job, comparison_id, job['deep'], self.memory_limit_mb),
+                daemon=True
+            )
+            process.start()
+            self.running[comparison_id] = (process, time.time(), job['deep'])
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                pending=len(self.pending),
+                running=len(self.running),
+                submitted=self.submitted,
+                coalesced=self.coalesced,
+                completed=self.completed,
+                failed=self.failed,
+                timed_out=self.timed_out
+            )
+
+
+class PurgeWorker(object):
+    """
+    Deletes tombstoned comparisons (see Comparison.destroy) on a background thread, one bounded batch per
+    transaction, so a big deletion never holds locks for long. Work is found from the tombstones themselves, so
+    if the process dies part way the next run (or `manage.py purge_deleted`) carries on where it stopped.
+    """
+
+    def __init__(self, batch_size=1000, inline=False):
+        self.batch_size = batch_size
+        self.inline = inline  # Purge synchronously in-process, for tests
+        self.purged = self.rows_deleted = self.failed = 0
+        self.progress = {}  # comparison_id -> {table: rows deleted so far}, while in progress
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def submit(self):
+        if self.inline:
+            self._purge()
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='purge-worker', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _report(self, comparison_id, table, deleted):
+        with self._lock:
+            if table is None:  # Done
+                self.progress.pop(comparison_id, None)
+                self.purged += 1
+                return
+            tables = self.progress.setdefault(comparison_id, {})
+            self.rows_deleted += deleted - tables.get(table, 0)
+            tables[table] = deleted
+
+    def _purge(self):
+        purge_deleted(batch_size=self.batch_size, progress=self._report)
+
+    def _run(self):
+        from project.server import app, db
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    self._purge()
+                except Exception:
+                    self.failed += 1  # Tombstones remain, so it's retried on the next submit or purge_deleted
+                    traceback.print_exc()
+                finally:
+                    db.session.remove()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                purged=self.purged,
+                rows_deleted=self.rows_deleted,
+                failed=self.failed,
+                in_progress={k: dict(v) for k, v in self.progress.items()}
+            )
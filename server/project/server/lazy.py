@@ -0,0 +1,25 @@
+# project/server/lazy.py
+
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that's only imported when one of its attributes is first used. Keeps the ML stack
+    (numpy, scikit-learn, model backends) out of web workers & manage.py commands that never touch it.
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self._module = None
+
+    def __getattr__(self, attr):
+        # Only called for attributes not found normally, ie everything of the real module's
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return getattr(self._module, attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
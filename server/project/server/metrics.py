@@ -0,0 +1,276 @@
+# project/server/metrics.py
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds / statements); each histogram also has +Inf
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels: return ''
+    escaped = (
+        (k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in escaped) + '}'
+
+
+class Histogram(object):
+    """Cumulative-bucket histogram per label set, rendered in Prometheus' text format"""
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # sorted label items -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0., 0]
+            series[i] += 1  # Non-cumulative here; summed on render
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = labels + (('le', _format_value(bound)),)
+                lines.append('{}_bucket{} {}'.format(self.name, _format_labels(le), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _format_labels(labels), _format_value(counts[-2])))
+            lines.append('{}_count{} {}'.format(self.name, _format_labels(labels), counts[-1]))
+        return lines
+
+
+class Metrics(object):
+    """
+    Request, SQL & training instrumentation for one worker process, served as text on /metrics (see init_app).
+
+    Requests are labelled by route (the url rule, not the path, so ids don't multiply series). Statements run
+    outside a request, eg by the hunch buffer's or purge worker's threads, count towards the SQL totals only.
+    Each process keeps its own numbers, so scrape every worker. Set METRICS_ENABLED = False to turn it all off.
+
+    Its request & statement hooks are the only ones registered; other instrumentation (the tracer) subscribes to
+    them rather than timing every statement again.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.request_seconds = Histogram(
+            'decisions_http_request_duration_seconds', 'Request latency, including any streamed body')
+        self.request_statements = Histogram(
+            'decisions_http_request_statements', 'SQL statements run per request', buckets=STATEMENT_BUCKETS)
+        self.request_db_seconds = Histogram(
+            'decisions_http_request_db_seconds', 'Time per request spent executing SQL statements')
+        self.statement_seconds = Histogram(
+            'decisions_sql_statement_duration_seconds', 'SQL statement latency, in or out of a request')
+        self.checkout_seconds = Histogram(
+            'decisions_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled database connection')
+        self.training_seconds = Histogram(
+            'decisions_training_duration_seconds', 'Hunch model work (update_hunches, _train) by the route it ran in')
+        self.job_seconds = Histogram(
+            'decisions_training_job_duration_seconds', 'Training queue jobs, by kind & outcome, from start to reaped')
+        self.histograms = [
+            self.request_seconds, self.request_statements, self.request_db_seconds,
+            self.statement_seconds, self.checkout_seconds, self.training_seconds, self.job_seconds
+        ]
+        self.collectors = []  # (prefix, fn) where fn() returns a dict of numbers, eg cache.stats
+        self.subscribers = []
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return bool(self.app and self.app.config.get('METRICS_ENABLED'))
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        # On the Engine class rather than db.engine, which is replaced if the database URI changes (eg in tests)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+        app.add_url_rule('/metrics', 'metrics', self.serve)
+
+    def collect(self, prefix, fn):
+        """Export fn()'s numeric values as gauges named decisions_<prefix>_<key> on each scrape"""
+        self.collectors.append((prefix, fn))
+
+    def subscribe(self, subscriber):
+        """
+        Pass requests & SQL statements on to subscriber, whether or not metrics are enabled, as:
+          request_started(), at the start of each request
+          request_finished(status, route, exc), once its response (including any streamed body) is done
+          statement(conn, cursor, statement, parameters, executemany, started, elapsed), after each statement,
+            with its perf_counter start & seconds taken. Statements are only timed while metrics or some
+            subscriber is enabled (subscriber.enabled)
+        """
+        self.subscribers.append(subscriber)
+
+    def route(self):
+        """The current request's route label: its url rule, 'unmatched', or 'background' outside a request"""
+        if not has_request_context(): return 'background'
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+
+    # Requests
+
+    def _before_request(self):
+        if self.enabled:
+            self._instrument_pool(self.db.engine.pool)
+        # Kept for subscribers even with metrics off, for the status
+        self._local.request = dict(
+            started=time.perf_counter(), statements=0, db_seconds=0., status=500, observed=self.enabled)
+        for subscriber in self.subscribers:
+            subscriber.request_started()
+
+    def _after_request(self, response):
+        state = getattr(self._local, 'request', None)
+        if state is not None:
+            state['status'] = response.status_code
+        return response
+
+    def _teardown_request(self, exc=None):
+        # Runs once a streamed body is done, so the whole response is timed
+        state = getattr(self._local, 'request', None)
+        if state is None: return
+        self._local.request = None
+        route = self.route()
+        if state['observed']:
+            self.request_seconds.observe(
+                time.perf_counter() - state['started'], method=request.method, route=route, status=state['status'])
+            self.request_statements.observe(state['statements'], route=route)
+            self.request_db_seconds.observe(state['db_seconds'], route=route)
+        for subscriber in self.subscribers:
+            subscriber.request_finished(state['status'], route, exc)
+
+    # SQL
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not (self.enabled or any(s.enabled for s in self.subscribers)): return
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('statement_started')
+        if not started: return
+        started = started.pop()
+        elapsed = time.perf_counter() - started
+        if self.enabled:
+            self.statement_seconds.observe(elapsed)
+            state = getattr(self._local, 'request', None)
+            if state is not None and state['observed']:
+                state['statements'] += 1
+                state['db_seconds'] += elapsed
+        for subscriber in self.subscribers:
+            if subscriber.enabled:
+                subscriber.statement(conn, cursor, statement, parameters, executemany, started, elapsed)
+
+    def _handle_error(self, context):
+        # A failed statement gets no after_cursor_execute; don't leave its start time on the stack
+        started = context.connection.info.get('statement_started') if context.connection is not None else None
+        if started and context.cursor is not None:
+            started.pop()
+
+    def _instrument_pool(self, pool):
+        # SQLAlchemy has no event before a checkout starts waiting, so time the pool's own get. Both
+        # Engine.connect & raw_connection check out through _do_get
+        if getattr(pool, '_metrics_instrumented', False): return
+        do_get = pool._do_get
+
+        @wraps(do_get)
+        def timed_do_get():
+            started = time.perf_counter()
+            try:
+                return do_get()
+            finally:
+                self.checkout_seconds.observe(time.perf_counter() - started)
+
+        pool._do_get = timed_do_get
+        pool._metrics_instrumented = True
+
+    # Training
+
+    @contextmanager
+    def timer(self, step):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.training_seconds.observe(time.perf_counter() - started, step=step, route=self.route())
+
+    def timed(self, step):
+        """Decorator form of timer()"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(step):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def job_finished(self, outcome, seconds, deep):
+        """TrainingQueue's on_done hook: its jobs run in other processes, so are timed from here"""
+        if not self.enabled: return
+        self.job_seconds.observe(seconds, kind='deep' if deep else 'linear', outcome=outcome)
+
+    # Exposition
+
+    def _gauges(self):
+        lines = []
+        pool = self.db.engine.pool
+        for name, attr in [('size', 'size'), ('checked_out', 'checkedout'), ('overflow', 'overflow')]:
+            if hasattr(pool, attr):  # QueuePool; other pools don't track these
+                lines += ['# TYPE decisions_db_pool_{} gauge'.format(name),
+                          'decisions_db_pool_{} {}'.format(name, getattr(pool, attr)())]
+        for prefix, fn in self.collectors:
+            for key, value in sorted(fn().items()):
+                if isinstance(value, dict):
+                    value = len(value)
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue  # Settings like durability='journal', or unset limits
+                name = 'decisions_{}_{}'.format(prefix, key)
+                lines += ['# TYPE {} gauge'.format(name), '{} {}'.format(name, _format_value(value))]
+        return lines
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms:
+            lines += histogram.render()
+        lines += self._gauges()
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        if not self.enabled:
+            return Response('Not Found\n', status=404, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
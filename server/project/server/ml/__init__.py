@@ -0,0 +1,21 @@
+# project/server/ml/__init__.py
+"""
+Pluggable model backends for hunch learning (Comparison._train / _predict). A backend is a module exposing
+`linear(n_features)` and `deep(n_features)`, each returning an unfitted model with `fit(X, y)` and `predict(X)`
+over NumPy arrays, X being (n_samples, n_features) with columns in feature_id order.
+"""
+
+import importlib
+
+from project.server import app
+
+BACKENDS = {
+    'numpy': 'project.server.ml.numpy_backend',
+    'tensorflow': 'project.server.ml.tensorflow_backend',
+}
+
+
+def get_backend(name=None):
+    """Imported on first use, so the web process never loads a backend it isn't training with"""
+    name = name or app.config.get('HUNCH_MODEL_BACKEND')
+    return importlib.import_module(BACKENDS[name])
@@ -0,0 +1,88 @@
+# project/server/ml/numpy_backend.py
+"""
+Pure-NumPy hunch models: closed-form ridge regression, and a one-hidden-layer MLP for the "deep" tier. Our
+matrices are tens of features by hundreds of hunches, so both fit in milliseconds.
+"""
+
+import numpy as np
+
+
+class RidgeRegressor(object):
+    """Least squares with an L2 penalty on the (non-intercept) weights, solved in closed form"""
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.coef = None
+        self.intercept = 0.
+
+    def fit(self, X, y):
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        x_mean, y_mean = X.mean(axis=0), y.mean()
+        Xc = X - x_mean
+        A = Xc.T.dot(Xc) + self.alpha * np.eye(X.shape[1])
+        self.coef = np.linalg.solve(A, Xc.T.dot(y - y_mean))
+        self.intercept = y_mean - x_mean.dot(self.coef)
+        return self
+
+    def predict(self, X):
+        return np.asarray(X, dtype=float).dot(self.coef) + self.intercept
+
+
+class MLPRegressor(object):
+    """One ReLU hidden layer, trained full-batch with Adam on standardized inputs & targets"""
+
+    def __init__(self, hidden_units, alpha=1e-3, learning_rate=0.01, steps=200, seed=0):
+        self.hidden_units = hidden_units
+        self.alpha = alpha
+        self.learning_rate = learning_rate
+        self.steps = steps
+        self.seed = seed
+
+    def _forward(self, X):
+        H = np.maximum(X.dot(self.W1) + self.b1, 0)
+        return H, H.dot(self.W2) + self.b2
+
+    def fit(self, X, y):
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        self.x_mean, self.x_std = X.mean(axis=0), X.std(axis=0)
+        self.x_std[self.x_std == 0] = 1
+        self.y_mean, self.y_std = y.mean(), y.std() or 1.
+        X, y = (X - self.x_mean) / self.x_std, (y - self.y_mean) / self.y_std
+
+        n, h = X.shape[1], self.hidden_units
+        rng = np.random.RandomState(self.seed)
+        self.W1, self.b1 = rng.randn(n, h) * np.sqrt(2. / n), np.zeros(h)
+        self.W2, self.b2 = rng.randn(h) * np.sqrt(1. / h), 0.
+        params = ['W1', 'b1', 'W2', 'b2']
+        m = {p: np.zeros_like(getattr(self, p)) for p in params}
+        v = {p: np.zeros_like(getattr(self, p)) for p in params}
+        beta1, beta2, eps = .9, .999, 1e-8
+
+        for t in range(1, self.steps + 1):
+            H, pred = self._forward(X)
+            d = (pred - y) / len(y)
+            dH = np.outer(d, self.W2) * (H > 0)
+            grads = dict(
+                W1=X.T.dot(dH) + self.alpha * self.W1,
+                b1=dH.sum(axis=0),
+                W2=H.T.dot(d) + self.alpha * self.W2,
+                b2=d.sum()
+            )
+            for p in params:
+                m[p] = beta1 * m[p] + (1 - beta1) * grads[p]
+                v[p] = beta2 * v[p] + (1 - beta2) * grads[p] ** 2
+                step = self.learning_rate * (m[p] / (1 - beta1 ** t)) / (np.sqrt(v[p] / (1 - beta2 ** t)) + eps)
+                setattr(self, p, getattr(self, p) - step)
+        return self
+
+    def predict(self, X):
+        X = (np.asarray(X, dtype=float) - self.x_mean) / self.x_std
+        return self._forward(X)[1] * self.y_std + self.y_mean
+
+
+def linear(n_features):
+    return RidgeRegressor()
+
+
+def deep(n_features):
+    return MLPRegressor(hidden_units=max(1, n_features // 2))  # TODO experiment
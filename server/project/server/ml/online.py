@@ -0,0 +1,56 @@
+# project/server/ml/online.py
+"""
+Recursive least squares: an online linear regressor whose state (weights & inverse covariance) is updated per
+sample in O(features^2), rather than refitting on every sample. Exactly equivalent to ridge regression on all
+samples seen so far (with the intercept penalized too, negligibly), so a full `fit` can be swapped in at any time.
+"""
+
+import numpy as np
+
+
+class RecursiveLeastSquares(object):
+
+    def __init__(self, n_features, alpha=1.0, weights=None, covariance=None):
+        n = n_features + 1  # +1 for the intercept, which is the last weight
+        self.alpha = alpha
+        self.weights = np.zeros(n) if weights is None else np.asarray(weights, dtype=float)
+        self.covariance = np.eye(n) / alpha if covariance is None else np.asarray(covariance, dtype=float).reshape(n, n)
+
+    @staticmethod
+    def _augment(X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return np.hstack([X, np.ones((X.shape[0], 1))])
+
+    def fit(self, X, y):
+        """Full refit from scratch on every sample"""
+        X, y = self._augment(X), np.asarray(y, dtype=float)
+        self.covariance = np.linalg.inv(X.T.dot(X) + self.alpha * np.eye(X.shape[1]))
+        self.weights = self.covariance.dot(X.T.dot(y))
+        return self
+
+    def update(self, x, y):
+        """Add one sample"""
+        x = self._augment(x)[0]
+        Px = self.covariance.dot(x)
+        gain = Px / (1 + x.dot(Px))
+        self.weights = self.weights + gain * (y - x.dot(self.weights))
+        self.covariance = self.covariance - np.outer(gain, Px)
+        return self
+
+    def downdate(self, x, y):
+        """
+        Remove a previously-added sample, eg when a hunch is revised. Returns False (leaving the model as is) when
+        that's numerically unsafe, in which case only a full refit can forget it.
+        """
+        x = self._augment(x)[0]
+        Px = self.covariance.dot(x)
+        denominator = 1 - x.dot(Px)
+        if denominator < 1e-8:
+            return False
+        gain = Px / denominator
+        self.weights = self.weights - gain * (y - x.dot(self.weights))
+        self.covariance = self.covariance + np.outer(gain, Px)
+        return True
+
+    def predict(self, X):
+        return self._augment(X).dot(self.weights)
@@ -0,0 +1,52 @@
+# project/server/ml/tensorflow_backend.py
+"""
+TensorFlow hunch models (tf.contrib.learn). Heavy to import and to train; select with
+HUNCH_MODEL_BACKEND = 'tensorflow'.
+"""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.contrib.learn import LinearRegressor, DNNRegressor
+
+
+def input_fn(X, y=None):
+    """Input builder function. See https://www.tensorflow.org/tutorials/wide"""
+    feature_cols = {str(k): tf.constant(X[:, k]) for k in range(X.shape[1])}
+    if y is None:
+        return feature_cols
+    label = tf.constant(y)
+    return feature_cols, label
+
+
+def feature_columns(n_features):
+    # https://github.com/tensorflow/tensorflow/blob/r1.2/tensorflow/examples/learn/wide_n_deep_tutorial.py
+    # TODO how to get feature.name in here? Ie tf.contrib.layers.real_valued_column("education_num")
+    return [tf.contrib.layers.real_valued_column(str(k)) for k in range(n_features)]
+
+
+class Estimator(object):
+    """Adapts a tf.contrib.learn estimator to fit(X, y) / predict(X) over NumPy arrays"""
+
+    def __init__(self, estimator, steps=200):
+        self.estimator = estimator
+        self.steps = steps
+
+    def fit(self, X, y):
+        X, y = np.asarray(X, dtype=np.float32), np.asarray(y, dtype=np.float32)
+        self.estimator.fit(input_fn=lambda: input_fn(X, y), steps=self.steps)
+        return self
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        return np.array(list(self.estimator.predict(input_fn=lambda: input_fn(X))), dtype=float)
+
+
+def linear(n_features):
+    return Estimator(LinearRegressor(feature_columns=feature_columns(n_features)))
+
+
+def deep(n_features):
+    return Estimator(DNNRegressor(
+        hidden_units=[max(1, n_features // 2)],  # TODO experiment
+        feature_columns=feature_columns(n_features)
+    ))
@@ -1,25 +1,30 @@
 # project/server/models.py
 
-import pdb
-from pprint import pprint
-
 import jwt
 import datetime
 import enum
+import threading
 import uuid
-import json
-import tempfile
-import pandas as pd
-import numpy as np
-import tensorflow as tf
-from sklearn import preprocessing
-from tensorflow.contrib.learn import LinearRegressor, DNNRegressor
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context
 from sqlalchemy.dialects import postgresql as pg
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, make_transient_to_detached, subqueryload
 from sqlalchemy import text
 from sqlalchemy.sql import func
 
 from project.server import app, db, bcrypt
+from project.server.cache import LRUCache, TTLCache, BloomFilter
+from project.server.jobs import TrainingQueue, PurgeWorker
+from project.server.ingest import HunchBuffer
+from project.server.metrics import metrics
+from project.server.tracing import tracer
+from project.server.ml import get_backend
+from project.server.lazy import lazy_import
+
+# The ML stack takes seconds to import, and only training needs it
+np = lazy_import('numpy')
+online = lazy_import('project.server.ml.online')
 
 
 def uuid_default():
@@ -29,6 +34,42 @@ def uuid_default():
 orm_cascade = {'cascade': "all, delete-orphan"}
 fk_cascade = {'onupdate': 'CASCADE', 'ondelete': 'CASCADE'}
 
+# Scores run from 0 to 5
+SCORE_RANGE = range(0, 6)
+
+# Post-processed Comparison.get_candidates() results, keyed on (comparison_id, comparison.version). Rows are shared
+# across users, so they carry no last_hunch; that expires with the clock rather than a version bump, so it's joined
+# in per request.
+rankings_cache = LRUCache(
+    max_entries=app.config.get('RANKINGS_CACHE_MAX_ENTRIES'),
+    max_bytes=app.config.get('RANKINGS_CACHE_MAX_BYTES')
+)
+# Retrains hunch models in worker processes (see Comparison.update_hunches)
+training_queue = TrainingQueue(
+    workers=app.config.get('HUNCH_WORKERS'),
+    timeout=app.config.get('HUNCH_JOB_TIMEOUT'),
+    # No cap for TensorFlow, whose import alone maps more address space than the cap (see TrainingQueue)
+    memory_limit_mb=None if app.config.get('HUNCH_MODEL_BACKEND') == 'tensorflow'
+        else app.config.get('HUNCH_JOB_MEMORY_MB'),
+    inline=app.config.get('HUNCH_JOBS_INLINE'),
+    on_done=metrics.job_finished
+)
+# Deletes tombstoned comparisons in the background (see Comparison.destroy)
+purge_worker = PurgeWorker(
+    batch_size=app.config.get('DELETION_BATCH_SIZE'),
+    inline=app.config.get('DELETIONS_INLINE')
+)
+# (user_id, 'candidate'|'comparison', id) -> (comparison_id, permission); see User._resolve_permissions
+permission_cache = TTLCache(
+    ttl=app.config.get('PERMISSION_CACHE_TTL'),
+    max_entries=app.config.get('PERMISSION_CACHE_MAX_ENTRIES')
+)
+# Verified auth token -> User.snapshot(), so login_required skips the blacklist & user queries
+token_cache = TTLCache(
+    ttl=app.config.get('TOKEN_CACHE_TTL'),
+    max_entries=app.config.get('TOKEN_CACHE_MAX_ENTRIES')
+)
+
 
 class PermissionEnum(enum.Enum):
     """
@@ -69,7 +110,8 @@ class User(db.Model):
                 # 'exp': datetime.datetime.utcnow() + datetime.timedelta(days=0, seconds=5),
                 'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7, seconds=0),
                 'iat': datetime.datetime.utcnow(),
-                'sub': user_id
+                'sub': user_id,
+                'jti': uuid_default()  # what gets blacklisted on logout, rather than the whole token
             }
             return jwt.encode(
                 payload,
@@ -86,18 +128,39 @@ class User(db.Model):
         :param auth_token:
         :return: integer|string
         """
+        payload = User.verify_auth_token(auth_token)
+        return payload['sub'] if isinstance(payload, dict) else payload
+
+    @staticmethod
+    def verify_auth_token(auth_token):
+        """
+        Validates the auth token
+        :param auth_token:
+        :return: dict (the token's payload)|string (error message)
+        """
         try:
             payload = jwt.decode(auth_token, app.config.get('SECRET_KEY'))
-            is_blacklisted_token = BlacklistToken.check_blacklist(auth_token)
+            is_blacklisted_token = BlacklistToken.check_blacklist(BlacklistToken.token_key(payload, auth_token))
             if is_blacklisted_token:
                 return 'Token blacklisted. Please log in again.'
             else:
-                return payload['sub']
+                return payload
         except jwt.ExpiredSignatureError:
             return 'Signature expired. Please log in again.'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please log in again.'
 
+    def snapshot(self):
+        """
+        Detached copy of this user's columns. `db.session.merge(snapshot, load=False)` puts it back in a session
+        without querying, which is how token_cache hands users to requests.
+        """
+        copy = User.__mapper__.class_manager.new_instance()
+        for attr in User.__mapper__.column_attrs:
+            setattr(copy, attr.key, getattr(self, attr.key))
+        make_transient_to_detached(copy)
+        return copy
+
     def create_comparison(self, **kwargs):
         self.comparisons.append(UserComparison(
             permission=PermissionEnum.owner,
@@ -108,8 +171,7 @@ class User(db.Model):
 
     def share_comparison(self, comparison_id, friend_id=None, friend_email=None, permission=PermissionEnum.add_feature):
         assert permission != PermissionEnum.owner, 'There can only be one owner.'
-        assert comparison_id in map(lambda c: c.comparison.id, self.comparisons), \
-            "Only the owner of a comparison can share it."
+        assert self.permission_on(comparison_id) == PermissionEnum.owner, 'Only the owner of a comparison can share it.'
         assert friend_id or friend_email, "Either email or id should be provided."
         if friend_email:
             friend_id = db.session.query(User).filter_by(email=friend_email).first().id
@@ -123,98 +185,352 @@ class User(db.Model):
         )
         db.session.add(user_comparison)
         db.session.commit()
+        User._forget_permissions(comparison_id)
         return user_comparison
 
-    def get_comparison(self, comparison_id):
-        join = db.session.query(UserComparison) \
-            .filter_by(user_id=self.id, comparison_id=comparison_id).first()
-        return join and join.comparison
+    def share_comparison_many(self, comparison_id, emails, permission=PermissionEnum.add_feature):
+        """
+        Share a comparison with everyone in `emails` in one statement & one commit, skipping anyone who already
+        has access.
+        :return: dict of emails: shared (newly), already_shared, unknown (no such user)
+        """
+        assert permission != PermissionEnum.owner, 'There can only be one owner.'
+        assert self.permission_on(comparison_id) == PermissionEnum.owner, 'Only the owner of a comparison can share it.'
+        query = """
+WITH emails AS (SELECT DISTINCT unnest(CAST(:emails AS TEXT[])) email),
+found AS (
+  SELECT u.id, u.email FROM users u INNER JOIN emails e ON e.email=u.email
+),
+inserted AS (
+  INSERT INTO users_comparisons (user_id, comparison_id, permission, created_at)
+  SELECT f.id, :comparison_id, :permission, now() at time zone 'utc'
+  FROM found f
+  ON CONFLICT DO NOTHING
+  RETURNING user_id
+)
+SELECT e.email, f.id IS NOT NULL found, i.user_id IS NOT NULL shared
+FROM emails e
+LEFT JOIN found f ON f.email=e.email
+LEFT JOIN inserted i ON i.user_id=f.id
+        """
+        rows = db.session.execute(text(query), dict(
+            emails=list(emails), comparison_id=comparison_id, permission=permission.name
+        )).fetchall()
+        db.session.commit()
+        User._forget_permissions(comparison_id)
+        return dict(
+            shared=sorted(r.email for r in rows if r.shared),
+            already_shared=sorted(r.email for r in rows if r.found and not r.shared),
+            unknown=sorted(r.email for r in rows if not r.found)
+        )
 
-    def _assert_candidate_permission(self, candidate_id):
-        # Find the UserComparison, compare permission
-        candidate = db.session.query(Candidate).filter_by(id=candidate_id).first()
-        user_comparison = db.session.query(UserComparison) \
-            .filter_by(user_id=self.id, comparison_id=candidate.comparison_id).first()
-        assert user_comparison and user_comparison.permission.value >= PermissionEnum.score.value, \
-            "You don't have permission to score this candidate"
-        return candidate
+    def _comparisons_query(self, eager=False):
+        query = db.session.query(Comparison) \
+            .join(UserComparison, UserComparison.comparison_id == Comparison.id) \
+            .filter(UserComparison.user_id == self.id, Comparison.deleted_at.is_(None))
+        if eager:
+            # One query per relationship for the whole result, rather than two per comparison in to_json()
+            query = query.options(subqueryload(Comparison.features), subqueryload(Comparison.candidates))
+        return query
 
-    def score(self, candidate_id, feature_id, score):
-        self._assert_candidate_permission(candidate_id)
+    def permission_on(self, comparison_id):
+        """:return: this user's PermissionEnum on the comparison, or None if they've none (or it doesn't exist)"""
+        return self._resolve_permissions('comparison', [comparison_id]).get(comparison_id, (None, None))[1]
 
-        # Is there an existing score to update? (Fix this later)
-        score_rec = db.session.query(Score)\
-            .filter_by(user_id=self.id, candidate_id=candidate_id, feature_id=feature_id).first()
-        if score_rec:
-            score_rec.score = score
-        else:
-            score_rec = Score(user_id=self.id, candidate_id=candidate_id, feature_id=feature_id, score=score)
-            db.session.add(score_rec)
-        db.session.commit()
-        return score_rec
+    def get_comparison(self, comparison_id, eager=False):
+        """
+        :param eager: also load features & candidates (ie, about to call to_json())
+        """
+        return self._comparisons_query(eager=eager).filter(Comparison.id == comparison_id).first()
 
-    def hunch(self, candidate_id, score):
-        """Either add a new hunch, or update the last hunch (if their most recent hunch
-        is less than 1h ago)
+    def list_comparisons(self):
+        """This user's comparisons, ready for to_json() in a constant number of queries"""
+        return self._comparisons_query(eager=True).all()
+
+    def comparison_summaries(self, limit=50, after=None):
         """
+        A page of this user's comparisons, newest first, as lightweight summaries (no features/candidates).
+        :param after: (created_at, comparison_id) of the last summary on the previous page
+        :return: (summaries, key of the last summary if there may be more, else None)
+        """
+        query = """
+SELECT c.id, c.title, c.description, c.updated_at, uc.created_at, uc.permission,
+  (SELECT COUNT(*) FROM features f WHERE f.comparison_id=c.id) feature_count,
+  (SELECT COUNT(*) FROM candidates ca WHERE ca.comparison_id=c.id) candidate_count,
+  top.id top_candidate_id,
+  top.title top_candidate_title
+FROM users_comparisons uc
+INNER JOIN comparisons c ON c.id=uc.comparison_id
+LEFT JOIN LATERAL (
+  SELECT ca.id, ca.title
+  FROM candidates ca
+  INNER JOIN candidate_stats cs ON cs.candidate_id=ca.id
+  WHERE ca.comparison_id=c.id
+  ORDER BY cs.score_total + cs.hunch_total DESC, ca.id
+  LIMIT 1
+) top ON TRUE
+WHERE uc.user_id=:user_id AND c.deleted_at IS NULL {and_after}
+ORDER BY uc.created_at DESC, uc.comparison_id DESC
+LIMIT :limit
+        """.format(and_after='AND (uc.created_at, uc.comparison_id) < (:after_created_at, :after_id)' if after else '')
+        params = dict(user_id=self.id, limit=limit + 1)
+        if after:
+            params['after_created_at'], params['after_id'] = after
+        rows = db.session.execute(text(query), params).fetchall()
+
+        summaries = [dict(
+            id=r.id,
+            title=r.title,
+            description=r.description,
+            permission=r.permission,
+            feature_count=r.feature_count,
+            candidate_count=r.candidate_count,
+            top_candidate=dict(id=r.top_candidate_id, title=r.top_candidate_title) if r.top_candidate_id else None,
+            updated_at=r.updated_at.isoformat()
+        ) for r in rows[:limit]]
+        more = len(rows) > limit
+        return summaries, (rows[limit - 1].created_at, rows[limit - 1].id) if more else None
+
+    def _resolve_permissions(self, kind, ids):
+        """
+        This user's permission on each comparison (kind='comparison'), or on each candidate's comparison
+        (kind='candidate'), in one indexed join for whatever isn't already memoized for this request (flask.g) or
+        in permission_cache. share_comparison() forgets a comparison's entries.
+        :return: {id: (comparison_id, PermissionEnum or None)}, leaving out ids which don't exist
+        """
+        memo = g.setdefault('permissions', {}) if has_app_context() else {}
+        resolved, missing = {}, []
+        for id in ids:
+            key = (self.id, kind, id)
+            found = memo.get(key) or permission_cache.get(key)
+            if found:
+                resolved[id] = memo[key] = found
+            else:
+                missing.append(id)
+        if missing:
+            query = """
+                SELECT x.id, x.comparison_id, uc.permission
+                FROM {source} x
+                LEFT JOIN users_comparisons uc ON uc.comparison_id=x.comparison_id AND uc.user_id=:user_id
+                WHERE x.id IN :ids
+            """.format(source=self.PERMISSION_SOURCES[kind])
+            for r in db.session.execute(text(query), dict(user_id=self.id, ids=tuple(missing))):
+                key = (self.id, kind, r.id)
+                resolved[r.id] = memo[key] = (r.comparison_id, r.permission)
+                permission_cache.set(key, memo[key])
+        return {id: (comparison_id, permission and PermissionEnum[permission])
+                for id, (comparison_id, permission) in resolved.items()}
+
+    # What _resolve_permissions looks ids up in; deleted comparisons (and their candidates) don't exist
+    PERMISSION_SOURCES = dict(
+        candidate="""(SELECT ca.id, ca.comparison_id FROM candidates ca
+          INNER JOIN comparisons c ON c.id=ca.comparison_id WHERE c.deleted_at IS NULL)""",
+        comparison="(SELECT id, id comparison_id FROM comparisons WHERE deleted_at IS NULL)"
+    )
 
-        # If they've already hunched recently, just update that
-        one_hour_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
-        recent_hunch = db.session.query(Hunch)\
-            .filter_by(user_id=self.id, candidate_id=candidate_id)\
-            .filter(Hunch.timestamp > one_hour_ago).first()
-        if recent_hunch:
-            recent_hunch.score = score
-            db.session.commit()
-            return recent_hunch
+    @staticmethod
+    def _forget_permissions(comparison_id):
+        permission_cache.discard_where(lambda resolved: resolved[0] == comparison_id)
+        if has_app_context() and 'permissions' in g:
+            g.permissions = {k: v for k, v in g.permissions.items() if v[0] != comparison_id}
 
-        # Else add a new hunch
-        candidate = self._assert_candidate_permission(candidate_id)
-        hunch = Hunch(user_id=self.id, comparison_id=candidate.comparison_id, candidate_id=candidate_id, score=score)
-        db.session.add(hunch)
+    def _assert_candidate_permission(self, candidate_id):
+        """:return: the candidate's comparison_id"""
+        return self._assert_candidates_permission({candidate_id}).pop()
+
+    def _assert_candidates_permission(self, candidate_ids, permission=PermissionEnum.score):
+        """
+        Check this user may score (or `permission`) every candidate, once per comparison rather than per score.
+        :return: set of comparison_ids touched
+        """
+        resolved = self._resolve_permissions('candidate', set(candidate_ids))
+        assert len(resolved) == len(set(candidate_ids)), "Candidate not found"
+        for _, granted in resolved.values():
+            assert granted and granted.value >= permission.value, \
+                "You don't have permission to score this candidate"
+        return {comparison_id for comparison_id, _ in resolved.values()}
+
+    def score_many(self, scores):
+        """
+        Upsert many scores in one transaction.
+        :param scores: iterable of (candidate_id, feature_id, score)
+        :return: number of scores written
+        :raises ValueError: for a score out of SCORE_RANGE, or a feature that isn't in its candidate's comparison
+        """
+        # Last write wins for duplicate (candidate, feature) pairs, else ON CONFLICT would touch a row twice
+        values = {(c, f): dict(user_id=self.id, candidate_id=c, feature_id=f, score=int(s)) for c, f, s in scores}
+        if not values: return 0
+        if any(v['score'] not in SCORE_RANGE for v in values.values()):
+            raise ValueError('Scores must be from {} to {}'.format(SCORE_RANGE[0], SCORE_RANGE[-1]))
+        candidate_ids = {c for c, _ in values.keys()}
+        comparison_ids = self._assert_candidates_permission(candidate_ids)
+        # Else a feature from another comparison would be folded into these candidates' aggregates. Candidates'
+        # comparisons are memoized by the permission check
+        candidate_comparisons = self._resolve_permissions('candidate', candidate_ids)
+        feature_comparisons = dict(db.session.execute(
+            text("SELECT id, comparison_id FROM features WHERE id IN :ids"),
+            dict(ids=tuple({f for _, f in values.keys()}))
+        ).fetchall())
+        for c, f in values.keys():
+            if feature_comparisons.get(f) != candidate_comparisons[c][0]:
+                raise ValueError("Feature {} isn't in candidate {}'s comparison".format(f, c))
+
+        stmt = pg.insert(Score.__table__).values(list(values.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'candidate_id', 'feature_id'],
+            set_=dict(score=stmt.excluded.score)
+        )
+        db.session.execute(stmt)
+        CandidateStats.refresh(candidate_ids={c for c, _ in values.keys()})
+        Comparison.bump_version(*comparison_ids)
         db.session.commit()
-        candidate.comparison.update_hunches()
-        return hunch
+        return len(values)
 
-    def destroy(self):
+    def score(self, candidate_id, feature_id, score):
+        # Upsert rather than SELECT-then-INSERT/UPDATE, so concurrent scores can't race into a PK violation
+        self.score_many([(candidate_id, feature_id, score)])
+        return db.session.query(Score).get((self.id, candidate_id, feature_id))
+
+    def hunch(self, candidate_id, score):
+        """Either add a new hunch, or update the last hunch (if their most recent hunch
+        is less than 1h ago). Goes through hunch_buffer, so depending on HUNCH_DURABILITY it may be applied a
+        moment later, batched with others (see Hunch.record_many)
+        """
+        comparison_id = self._assert_candidate_permission(candidate_id)
+        hunch_buffer.add(dict(
+            user_id=self.id,
+            candidate_id=candidate_id,
+            comparison_id=comparison_id,
+            score=int(score),
+            timestamp=datetime.datetime.utcnow()
+        ))
+
+    def destroy(self, purge=True):
         """
         Call this instead of deleting users directly; it removes orphaned comparisons where self is owner, etc
+        :param purge: start the background purge of their comparisons; False if the caller purges them itself
         :return: None
         """
-        query = """
-            DELETE FROM comparisons WHERE id IN 
-              (SELECT comparison_id FROM users_comparisons WHERE user_id=:uid AND permission=:perm);
-            DELETE FROM users WHERE id=:uid; 
-        """
-        db.engine.execute(text(query), uid=self.id, perm=PermissionEnum.owner.name)
+        owned = [r.comparison_id for r in db.session.execute(
+            text("SELECT comparison_id FROM users_comparisons WHERE user_id=:uid AND permission=:perm"),
+            dict(uid=self.id, perm=PermissionEnum.owner.name)
+        )]
+        # Owned comparisons are tombstoned & purged in the background; deleting the user then only cascades
+        # into their own scores, hunches & shares
+        if owned:
+            Comparison.tombstone(*owned, purge=purge)
+        db.engine.execute(text("DELETE FROM users WHERE id=:uid"), uid=self.id)
+        token_cache.discard_where(lambda user: user.id == self.id)
 
 
 class BlacklistToken(db.Model):
     """
-    Token Model for storing JWT tokens
+    Revoked JWTs, stored by jti (see BlacklistToken.token_key) until they'd have expired anyway. Expired rows
+    are removed by BlacklistToken.prune() (`manage.py prune_tokens`).
     """
     __tablename__ = 'blacklist_tokens'
 
-    id = db.Column(pg.UUID, primary_key=True, default=uuid_default)
-    token = db.Column(db.String(500), unique=True, nullable=False)
-    blacklisted_on = db.Column(db.DateTime, nullable=False)
+    jti = db.Column(pg.UUID, primary_key=True)
+    expires_on = db.Column(db.DateTime, nullable=False, index=True)
+    blacklisted_on = db.Column(db.DateTime, nullable=False, index=True)
 
     def __init__(self, token):
-        self.token = token
-        self.blacklisted_on = datetime.datetime.now()
+        # Signature was already verified by login_required; we just need the claims
+        payload = jwt.decode(token, verify=False)
+        self.jti = BlacklistToken.token_key(payload, token)
+        self.expires_on = datetime.datetime.utcfromtimestamp(payload['exp'])
+        self.blacklisted_on = datetime.datetime.utcnow()
 
     def __repr__(self):
-        return '<id: token: {}'.format(self.token)
+        return '<jti: {}'.format(self.jti)
 
     @staticmethod
-    def check_blacklist(auth_token):
+    def token_key(payload, auth_token):
+        """The token's jti, or for tokens issued before we added jti, a UUID derived from the token itself"""
+        if payload.get('jti'):
+            return payload['jti']
+        if isinstance(auth_token, bytes):
+            auth_token = auth_token.decode()
+        return str(uuid.uuid5(uuid.NAMESPACE_OID, auth_token))
+
+    @staticmethod
+    def check_blacklist(jti):
         # check whether auth token has been blacklisted
-        res = BlacklistToken.query.filter_by(token=str(auth_token)).first()
+        if revocation_filter and not revocation_filter.might_be_revoked(jti):
+            return False
+        res = db.session.query(BlacklistToken.jti).filter_by(jti=jti).first()
         if res:
             return True
         else:
             return False
 
+    @staticmethod
+    def prune():
+        """Delete revocations of tokens which have since expired (they fail verification regardless)"""
+        count = db.session.query(BlacklistToken) \
+            .filter(BlacklistToken.expires_on < datetime.datetime.utcnow()) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+
+class RevocationFilter(object):
+    """
+    In-memory Bloom filter of revoked jtis in front of BlacklistToken.check_blacklist, so the common "not
+    revoked" case skips the database. Revocations from this process are added immediately; those from other
+    processes are picked up every `sync_interval` seconds, and the filter is rebuilt hourly (or when over
+    capacity) to forget pruned tokens.
+    """
+    REBUILD_INTERVAL = 60 * 60
+    # Overlap incremental syncs by this much, in case workers' clocks disagree on blacklisted_on
+    CLOCK_SKEW = datetime.timedelta(minutes=1)
+
+    def __init__(self, capacity, error_rate, sync_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.bloom = None
+        self.synced_at = self.rebuilt_at = 0
+        self.synced_since = None
+        self._lock = threading.Lock()
+
+    def add(self, jti):
+        if self.bloom is not None:
+            self.bloom.add(jti)
+
+    def might_be_revoked(self, jti):
+        self._maybe_sync()
+        return jti in self.bloom
+
+    def _maybe_sync(self):
+        if self.bloom is not None and time.time() - self.synced_at < self.sync_interval:
+            return
+        with self._lock:
+            now, utcnow = time.time(), datetime.datetime.utcnow()
+            if self.bloom is not None and now - self.synced_at < self.sync_interval:
+                return  # Another thread synced while we waited
+            query = db.session.query(BlacklistToken.jti).filter(BlacklistToken.expires_on > utcnow)
+            rebuild = self.bloom is None or self.bloom.count > self.bloom.capacity \
+                or now - self.rebuilt_at > self.REBUILD_INTERVAL
+            if rebuild:
+                jtis = [r.jti for r in query]
+                bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+                self.rebuilt_at = now
+            else:
+                jtis = [r.jti for r in query.filter(BlacklistToken.blacklisted_on > self.synced_since)]
+                bloom = self.bloom
+            for jti in jtis:
+                bloom.add(jti)
+            self.bloom = bloom
+            self.synced_at, self.synced_since = now, utcnow - self.CLOCK_SKEW
+
+
+revocation_filter = RevocationFilter(
+    capacity=app.config.get('REVOCATION_FILTER_CAPACITY'),
+    error_rate=app.config.get('REVOCATION_FILTER_ERROR_RATE'),
+    sync_interval=app.config.get('REVOCATION_FILTER_SYNC_INTERVAL')
+) if app.config.get('REVOCATION_FILTER') else None
+
 
 class UserComparison(db.Model):
     """
@@ -223,11 +539,14 @@ class UserComparison(db.Model):
     __tablename__ = 'users_comparisons'
 
     user_id = db.Column(pg.UUID, db.ForeignKey('users.id', **fk_cascade), primary_key=True)
-    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), primary_key=True)
+    # Own index since it's second in the primary key (who has access to this comparison?)
+    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), primary_key=True, index=True)
     comparison = relationship('Comparison', backref='user_comparison')
 
     permission = db.Column(db.Enum(PermissionEnum), default=PermissionEnum.owner)
     weight = db.Column(db.Float)  # how much this user's vote counts (keep?)
+    # When this user got the comparison; the comparison list's sort (& keyset pagination) key
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, server_default=func.now())
 
 
 class Comparison(db.Model):
@@ -239,195 +558,401 @@ class Comparison(db.Model):
     id = db.Column(pg.UUID, primary_key=True, default=uuid_default)
     title = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
+    # Incremented by any write which changes get_candidates() output; keys the rankings cache
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Last ranking-affecting write (bumped along with version)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, server_default=func.now())
+    # Tombstone: set when deleted, which hides it at once; the rows go later (see destroy())
+    deleted_at = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_comparisons_deleted_at', 'deleted_at', postgresql_where=text('deleted_at IS NOT NULL')),
+    )
     features = relationship('Feature')
     candidates = relationship('Candidate', backref='comparison')
     hunches = relationship('Hunch', backref='comparison')
 
     def destroy(self):
         """
-        FIXME this method should be unecessary. Instead we should be able to use `db.session.delete(comparison)`,
-        however that approach attempts to nullify the features/candidates FKs instead of respecting ondelete='CASCADE',
-        am I doing something wrong?
+        Hide this comparison at once with a tombstone, then delete its rows in bounded batches in the background
+        (purge_worker), rather than one cascading DELETE holding locks across every table for seconds.
         """
-        db.engine.execute(text('DELETE FROM comparisons WHERE id=:id'), id=self.id)
+        Comparison.tombstone(self.id)
 
-    def get_candidates(self, user_id=None):
+    @staticmethod
+    def tombstone(*comparison_ids, purge=True):
+        """:param purge: wake purge_worker; False to leave the rows to a synchronous purge_deleted()"""
+        db.session.execute(
+            text("UPDATE comparisons SET deleted_at=now() at time zone 'utc' WHERE id IN :ids AND deleted_at IS NULL"),
+            dict(ids=tuple(comparison_ids))
+        )
+        db.session.commit()
+        for comparison_id in comparison_ids:
+            User._forget_permissions(comparison_id)
+        if purge:
+            purge_worker.submit()
+
+    # Children first, so no delete cascades into more than its own batch
+    PURGE_ORDER = [
+        ('hunches', 'comparison_id=:id'),
+        ('scores', 'candidate_id IN (SELECT id FROM candidates WHERE comparison_id=:id)'),
+        ('candidate_stats', 'comparison_id=:id'),
+        ('hunch_learners', 'comparison_id=:id'),
+        ('candidates', 'comparison_id=:id'),
+        ('features', 'comparison_id=:id'),
+        ('users_comparisons', 'comparison_id=:id'),
+    ]
+
+    @staticmethod
+    def purge(comparison_id, batch_size=1000, progress=None):
         """
-        Gets a sorted list of candidates w/i a comparison, ordered by score average across voters
+        Delete a tombstoned comparison's rows, at most `batch_size` per transaction. Safe to interrupt & re-run.
+        :param progress: called with (comparison_id, table, rows deleted from it so far), then table=None when done
         """
-        query = """
-SELECT c.id, c.title, c.description, c.links, c.hunch,
-  s.features, 
-  COALESCE(s.score_total, 0) score_total, 
-  COALESCE(s.score_norm, 0) score_norm,
-  COALESCE(h.hunch_norm::FLOAT, 0) hunch_norm, 
-  COALESCE(h.hunch_total, 0) hunch_total,
-  (SELECT h.score
-    FROM hunches h
-    WHERE h.candidate_id=c.id
-      AND h.user_id=:user_id
-      AND h.timestamp > now() at time zone 'utc' - interval '1 hours' --either that or save Hunch.timestamp as non-utc 
-    LIMIT 1
-  ) last_hunch
-FROM candidates c
-
-LEFT JOIN (
-  SELECT s.candidate_id,
-    ARRAY_AGG(
-        '{"feature_id":"'||s.feature_id||'", "score_weighted":'||s.score_weighted||', "score":'||s.score||'}'
-    ) features,
-    SUM(s.score_weighted) score_total,
-    0 as score_norm
+        for table, where in Comparison.PURGE_ORDER:
+            query = """
+                DELETE FROM {table} WHERE ctid = ANY(ARRAY(
+                  SELECT ctid FROM {table} WHERE {where} LIMIT :limit
+                ))
+            """.format(table=table, where=where)
+            deleted = 0
+            while True:
+                with db.engine.begin() as conn:
+                    n = conn.execute(text(query), id=comparison_id, limit=batch_size).rowcount
+                deleted += n
+                if progress: progress(comparison_id, table, deleted)
+                if n < batch_size: break
+        with db.engine.begin() as conn:
+            conn.execute(text("DELETE FROM comparisons WHERE id=:id AND deleted_at IS NOT NULL"), id=comparison_id)
+        if progress: progress(comparison_id, None, 0)
 
-  FROM (
-    SELECT s.feature_id, s.candidate_id, s.score,
-      AVG(s.score) * (SELECT weight FROM features f WHERE s.feature_id=f.id) score_weighted
-    FROM scores s
-    GROUP BY s.feature_id, s.candidate_id, s.score
-  ) s
+    @staticmethod
+    def purge_deleted(batch_size=1000, progress=None):
+        """Purge every tombstoned comparison, oldest first. :return: number purged"""
+        comparison_ids = [r.id for r in db.engine.execute(
+            text("SELECT id FROM comparisons WHERE deleted_at IS NOT NULL ORDER BY deleted_at")
+        )]
+        for comparison_id in comparison_ids:
+            Comparison.purge(comparison_id, batch_size=batch_size, progress=progress)
+        return len(comparison_ids)
 
-  GROUP BY s.candidate_id
-) s ON s.candidate_id=c.id
+    @staticmethod
+    def bump_version(*comparison_ids):
+        """Invalidate cached rankings. Runs on the session, so call before committing the write it describes"""
+        if not comparison_ids: return
+        db.session.execute(
+            text("UPDATE comparisons SET version=version+1, updated_at=now() at time zone 'utc' WHERE id IN :ids"),
+            dict(ids=tuple(comparison_ids))
+        )
 
--- candidate.hunch already exists, should I just add these two columns to candidate instead of calc'ing here?
+    def get_candidates(self, user_id=None):
+        """
+        Gets a sorted list of candidates w/i a comparison, ordered by score average across voters.
+        Results are cached per comparison version; don't mutate them.
+        """
+        version = db.session.query(Comparison.version).filter_by(id=self.id).scalar()
+        key = (self.id, version)
+        rows = rankings_cache.get(key)
+        if rows is None:
+            rows = self._get_candidates()
+            rankings_cache.set(key, rows)
+        last_hunches = self._last_hunches(user_id) if user_id else {}
+        if not last_hunches:
+            return rows
+        return [dict(r, last_hunch=last_hunches[r['id']]) if r['id'] in last_hunches else r for r in rows]
+
+    def _last_hunches(self, user_id):
+        """This user's latest hunch per candidate in the last hour, {candidate_id: score}"""
+        return dict(db.session.execute(text("""
+            SELECT DISTINCT ON (h.candidate_id) h.candidate_id, h.score
+            FROM hunches h
+            WHERE h.user_id=:user_id AND h.comparison_id=:comparison_id
+              AND h.timestamp > now() at time zone 'utc' - interval '1 hours'
+            ORDER BY h.candidate_id, h.timestamp DESC
+        """), dict(user_id=user_id, comparison_id=self.id)).fetchall())
+
+    # Normalizing, combining & rounding all happen here, so rows need no per-row work in Python. Trailing
+    # placeholders are for iter_candidates' keyset pagination & ordering, which run after the window functions so
+    # a page is still normalized against the whole comparison.
+    RANKINGS_QUERY = """
+WITH totals AS (
+  SELECT c.id, c.title, c.description, c.links, c.hunch,
+    cs.features,
+    COALESCE(cs.score_total, 0) score_total,
+    COALESCE(cs.hunch_avg, 0) hunch_norm,
+    COALESCE(cs.hunch_total, 0) hunch_total
+  FROM candidates c
+  -- Aggregates are maintained on write (see CandidateStats.refresh), so this is a straight read
+  LEFT JOIN candidate_stats cs ON cs.candidate_id=c.id
+  WHERE c.comparison_id=:comparison_id
+), normed AS (
+  -- Min-max normalize score_total to 0-5 across all candidates; 0 for all if they're equal
+  SELECT t.*,
+    COALESCE(
+      (t.score_total - MIN(t.score_total) OVER ())
+        / NULLIF(MAX(t.score_total) OVER () - MIN(t.score_total) OVER (), 0),
+      0
+    ) * 5 score_norm
+  FROM totals t
+)
+SELECT n.id, n.title, n.description, n.links, n.hunch,
+  COALESCE(n.features, '[]'::jsonb) features,
+  -- Calculate combined from unrounded values so we don't propagate rounding error
+  ROUND(((n.score_total + n.hunch_total) / 2)::numeric, 1)::float combined_total,
+  ROUND(((n.score_norm + n.hunch_norm) / 2)::numeric, 1)::float combined_norm,
+  ROUND(n.score_norm::numeric, 1)::float score_norm,
+  ROUND(n.score_total::numeric, 1)::float score_total,
+  ROUND(n.hunch_total::numeric, 1)::float hunch_total,
+  ROUND(n.hunch_norm::numeric, 1)::float hunch_norm,
+  lh.score last_hunch,
+  n.score_total + n.hunch_total rank_total
+FROM normed n
+-- This user's latest hunch per candidate in the last hour, gathered once rather than probed per candidate
 LEFT JOIN (
-  SELECT h.candidate_id,
-    AVG(h.score) hunch_norm,
-    SUM(h.score) hunch_total
+  SELECT DISTINCT ON (h.candidate_id) h.candidate_id, h.score
   FROM hunches h
-  GROUP BY h.candidate_id
-) h ON h.candidate_id=c.id
-
-WHERE c.comparison_id=:comparison_id
-
-GROUP BY c.id, s.features, s.score_total, s.score_norm, h.hunch_total, h.hunch_norm;
-        """
-        rows = db.engine.execute(text(query), comparison_id=self.id, user_id=user_id).fetchall()
-        if len(rows) == 0: return []
-        rows = [dict(r) for r in rows]
-
-        # Normalize candidate.score_weighted to candidate.score_norm across all candidates
-        scaler = preprocessing.MinMaxScaler()
-        scaled = scaler.fit_transform([r['score_total'] for r in rows])
-        for i, r in enumerate(rows):
-            score_norm = scaled[i] * 5
-            # Calculate combined first so we don't propagate rounding error
-            r['combined_total'] = round((r['score_total'] + r['hunch_total']) / 2, 1)
-            r['combined_norm'] = round((score_norm + r['hunch_norm']) / 2, 1)
-
-            # Then round the rest
-            r['score_norm'] = round(score_norm, 1)
-            r['score_total'] = round(r['score_total'], 1)
-            r['hunch_total'] = round(r['hunch_total'], 1)
-            r['hunch_norm'] = round(r['hunch_norm'], 1)
-
-            r['features'] = [json.loads(f) for f in r['features']] if r['features'] else []
+  WHERE h.user_id=:user_id
+    AND h.timestamp > now() at time zone 'utc' - interval '1 hours' --either that or save Hunch.timestamp as non-utc
+  ORDER BY h.candidate_id, h.timestamp DESC
+) lh ON lh.candidate_id=n.id
+{where_after}
+{order_by}
+    """
 
+    def _get_candidates(self, user_id=None):
+        query = self.RANKINGS_QUERY.format(where_after='', order_by='')
+        result = db.engine.execute(text(query), comparison_id=self.id, user_id=user_id)
+        with tracer.span('get_candidates.postprocess') as span:
+            rows = [dict(r) for r in result]
+            for r in rows:
+                del r['rank_total']  # Only needed by iter_candidates
+            span['rows'] = len(rows)
         return rows
 
-    @staticmethod
-    def input_fn(features, labels=None):
-        """Input builder function. See https://www.tensorflow.org/tutorials/wide"""
-        feature_cols = {str(k): tf.constant(features[k].values) for k in features.keys()}
-        if labels is None:
-            return feature_cols
-        label = tf.constant(labels.values)
-        return feature_cols, label
-
-    @staticmethod
-    def series_to_df(series):
-        return pd.DataFrame([row for row in series])
+    def iter_candidates(self, user_id=None, limit=None, after=None, batch_size=500):
+        """
+        Stream the same rows as get_candidates() from a server-side cursor, best first (ties broken by id), for
+        comparisons too big to hold in memory. Order is stable, so pages can be resumed from a row's key.
+        :param after: key of the last row already seen
+        :return: generator of (key, row)
+        """
+        query = self.RANKINGS_QUERY.format(
+            where_after='WHERE (n.score_total + n.hunch_total, n.id) < (:after_total, :after_id)' if after else '',
+            order_by='ORDER BY rank_total DESC, n.id DESC {}'.format('LIMIT :limit' if limit else '')
+        )
+        params = dict(comparison_id=self.id, user_id=user_id, limit=limit)
+        if after:
+            params['after_total'], params['after_id'] = after
 
-    def _train(self, deep=False):
-        """Train our linear regression classifier (TODO make this a stochastic bg job)"""
-        print("Training....")
+        conn = db.engine.connect().execution_options(stream_results=True)
+        try:
+            result = conn.execute(text(query), **params)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows: break
+                for r in rows:
+                    r = dict(r)
+                    yield (r.pop('rank_total'), r['id']), r
+        finally:
+            conn.close()
+
+    def _feature_ids(self):
+        """Feature ids in the order of _feature_matrix() columns"""
+        return [f.id for f in db.session.query(Feature.id).filter_by(comparison_id=self.id).order_by(Feature.id)]
+
+    def _feature_matrix(self, candidate_id=None):
+        """
+        Each scored candidate's average score per feature, as a (candidates x features) matrix. Columns are in
+        feature_id order (ARRAY_AGG(... ORDER BY feature_id)), which every model relies on; unscored features are 0.
+        :param candidate_id: just this candidate's row
+        :return: (candidate_ids, features)
+        """
         query = """
-            SELECT h.timestamp, h.score, -- timestamp discarded, needed for unique grouping  
+            SELECT c.id,
               -- Collect features, ensure same feature-order for ML matrix
-              ARRAY_AGG(s.score ORDER BY s.feature_id) features
+              ARRAY_AGG(COALESCE(s.score, 0) ORDER BY f.id) features
             FROM candidates c
-            INNER JOIN hunches h ON h.candidate_id=c.id
-            INNER JOIN scores s ON s.candidate_id=c.id
-            WHERE c.comparison_id=%(comparison_id)s
-            GROUP BY h.timestamp, h.score
-        """
-        df = pd.read_sql(query, db.engine, params={'comparison_id': self.id})
-        # Can't pull features straight from sql_df, it's squashed as [list(1,2,3), list(3,4,5)]; ie one-item rows
-        labels, features = df['score'], self.series_to_df(df['features'])
-
-        # https://github.com/tensorflow/tensorflow/blob/r1.2/tensorflow/examples/learn/wide_n_deep_tutorial.py
-        # TODO how to get feature.name in here? Ie tf.contrib.layers.real_valued_column("education_num")
-        feature_columns = [tf.contrib.layers.real_valued_column(str(k)) for k in features.keys()]
-        if deep:
-            m = DNNRegressor(
-                hidden_units=[len(feature_columns)/2],  # TODO experiment
-                feature_columns=feature_columns
-            )
+            INNER JOIN features f ON f.comparison_id=c.comparison_id
+            LEFT JOIN (
+              SELECT s.candidate_id, s.feature_id, AVG(s.score) score
+              FROM scores s
+              WHERE s.candidate_id IN (SELECT id FROM candidates WHERE comparison_id=:comparison_id {and_candidate})
+              GROUP BY s.candidate_id, s.feature_id
+            ) s ON s.candidate_id=c.id AND s.feature_id=f.id
+            WHERE c.comparison_id=:comparison_id {and_c_candidate}
+            GROUP BY c.id
+            HAVING COUNT(s.score) > 0
+        """.format(
+            and_candidate='AND id=:candidate_id' if candidate_id else '',
+            and_c_candidate='AND c.id=:candidate_id' if candidate_id else ''
+        )
+        rows = db.session.execute(text(query), dict(comparison_id=self.id, candidate_id=candidate_id)).fetchall()
+        return [r.id for r in rows], np.array([r.features for r in rows], dtype=float)
+
+    def _training_data(self):
+        """Every hunch as a training row: (its candidate's features, hunch score). None if nothing to learn"""
+        candidate_ids, features = self._feature_matrix()
+        rows = {cid: i for i, cid in enumerate(candidate_ids)}
+        hunches = db.session.query(Hunch.candidate_id, Hunch.score).filter_by(comparison_id=self.id).all()
+        hunches = [h for h in hunches if h.candidate_id in rows]  # Unscored candidates have nothing to learn from
+        if not hunches: return None
+        X = features[[rows[h.candidate_id] for h in hunches]]
+        y = np.array([h.score for h in hunches], dtype=float)
+        return X, y
+
+    @metrics.timed('train')
+    @tracer.traced('train')
+    def _train(self, deep=False):
+        """Train our linear regression classifier, using the configured ml backend"""
+        print("Training....")
+        data = self._training_data()
+        if data is None: return None
+        X, y = data
+        backend = get_backend()
+        m = backend.deep(X.shape[1]) if deep else backend.linear(X.shape[1])
+        return m.fit(X, y)
+
+    @tracer.traced('refit_learner')
+    def refit_learner(self, n_hunches=None):
+        """
+        Refit the online learner (HunchLearner) on every hunch, from scratch. Corrects drift from incremental
+        updates, eg hunches learned before their candidate's scores changed.
+        :return: the refit model, or None if there's nothing to learn
+        """
+        learner = db.session.query(HunchLearner).get(self.id) or HunchLearner(comparison_id=self.id)
+        feature_ids = self._feature_ids()
+        data = self._training_data()
+        if data is None: return None
+        model = online.RecursiveLeastSquares(len(feature_ids)).fit(*data)
+        n_hunches = self.hunch_count() if n_hunches is None else n_hunches
+        learner.store(model, feature_ids, n_samples=n_hunches)
+        db.session.add(learner)
+        return model
+
+    @tracer.traced('learn_hunches')
+    def learn_hunches(self, hunches, n_hunches):
+        """
+        Update the online learner with each hunch in O(features^2), no retraining, then publish predictions once.
+        :param hunches: [(candidate_id, score, old_score)]; old_score is the candidate's previous score if the
+            hunch revises one (it's un-learned first), else None
+        :param n_hunches: hunches in the comparison, including these
+        """
+        learner = db.session.query(HunchLearner).get(self.id)
+        feature_ids = self._feature_ids()
+        # Learned from every hunch but these new ones? Else it missed some (eg while below the linear tier)
+        expected_samples = n_hunches - sum(1 for _, _, old_score in hunches if old_score is None)
+        if learner is None or learner.feature_ids != feature_ids or learner.n_samples != expected_samples:
+            # First time, or features were added/removed so the learned weights don't line up
+            model = self.refit_learner(n_hunches)
         else:
-            m = LinearRegressor(
-                feature_columns=feature_columns
-            )
-        m.fit(input_fn=lambda: self.input_fn(features, labels), steps=200)
-        return m
+            model = learner.model()
+            # One candidate's row is a cheaper query than the whole matrix
+            candidate_ids, X = self._feature_matrix(candidate_id=hunches[0][0] if len(hunches) == 1 else None)
+            rows = dict(zip(candidate_ids, X))
+            for candidate_id, score, old_score in hunches:
+                x = rows.get(candidate_id)
+                if x is None: continue  # Unscored candidates have nothing to learn from
+                if old_score is not None and not model.downdate(x, float(old_score)):
+                    model = self.refit_learner(n_hunches)  # Can't safely forget the old score, start over
+                    break
+                model.update(x, float(score))
+            else:
+                learner.store(model, feature_ids, n_samples=n_hunches, refit=False)
+        if model is not None:
+            self._predict(model)
+        Comparison.bump_version(self.id)  # Even without a model, the hunches themselves are new
+        db.session.commit()
 
     def _evaluate(self):
         """TODO"""
         pass
 
     def _predict(self, m):
-        # Make candidate prediction from our linear regression model"""
+        """
+        Make candidate predictions from our model & write them all to candidate.hunch in one statement
+        :return: [(candidate_id, prediction)], best first
+        """
         print("Predicting...")
+        candidate_ids, features = self._feature_matrix()
+        if not candidate_ids: return []
+        predictions = np.asarray(m.predict(features), dtype=float)
+
+        # Two array parameters, so it's the same statement (and bind count) whatever the comparison's size
         query = """
-            SELECT c.id,  
-              ARRAY_AGG(s.score ORDER BY s.feature_id) features
-            FROM candidates c
-            INNER JOIN scores s ON s.candidate_id=c.id
-            WHERE c.comparison_id=%(comparison_id)s
-            GROUP BY c.id
+            UPDATE candidates SET hunch=v.hunch
+            FROM unnest(CAST(:ids AS UUID[]), CAST(:hunches AS FLOAT[])) v(id, hunch)
+            WHERE candidates.id=v.id
         """
-        df = pd.read_sql(query, db.engine, params={'comparison_id': self.id})
-        ids, features = df['id'], self.series_to_df(df['features'])
+        db.session.execute(text(query), dict(ids=list(candidate_ids), hunches=predictions.tolist()))
 
-        predictions = m.predict(input_fn=lambda: self.input_fn(features))
-        df = pd.DataFrame([p for p in predictions])
-        df['ids'] = ids
-        results = []
-        for row in df.values:
-            candidate = db.session.query(Candidate).filter_by(id=str(row[1])).first()
-            candidate.score = row[0]
-            results.append(candidate)
-        results.sort(key=lambda x: x.score, reverse=True)
-        return results
+        order = np.argsort(-predictions, kind='mergesort')  # stable, so ties keep feature-matrix order
+        return [(candidate_ids[i], float(predictions[i])) for i in order]
 
-    def update_hunches(self):
+    def retrain(self, deep=False):
+        """
+        Train a model on all hunches & publish its predictions to candidate.hunch. Slow; runs in a
+        training_queue worker, and commits once at the end so readers see the previous values until then.
+        """
+        if deep or not app.config.get('HUNCH_ONLINE_LEARNER'):
+            model = self._train(deep=deep)
+        else:
+            model = self.refit_learner()
+        if model is None: return
+        self._predict(model)
+        Comparison.bump_version(self.id)
+        db.session.commit()
+
+    def publish_hunch_averages(self, candidate_ids=None):
+        """Set candidate.hunch from candidate_stats (just for candidate_ids, if given); runs on the session"""
+        average = "cs.hunch_avg"
+        if app.config.get('HUNCH_HALF_LIFE'):
+            # Old hunches can decay to nothing; fall back to the plain average then
+            average = "COALESCE(cs.hunch_decayed_sum / NULLIF(cs.hunch_decayed_weight, 0), cs.hunch_avg)"
+        query = """
+            UPDATE candidates c SET hunch=CASE WHEN cs.hunch_count > 0 THEN {average} END
+            FROM candidate_stats cs
+            WHERE cs.candidate_id=c.id AND c.comparison_id=:comparison_id {and_ids}
+        """.format(average=average, and_ids='AND c.id IN :candidate_ids' if candidate_ids else '')
+        params = dict(comparison_id=self.id)
+        if candidate_ids:
+            params['candidate_ids'] = tuple(candidate_ids)
+        db.session.execute(text(query), params)
+
+    def hunch_count(self):
+        return db.session.query(func.count(Hunch.score)).filter_by(comparison_id=self.id).scalar()
+
+    @staticmethod
+    def hunch_tier(n_hunches):
+        """Which model sets candidate.hunch: average (first 20), linear (20-100), then deep"""
+        return 'average' if n_hunches < 20 else 'linear' if n_hunches < 100 else 'deep'
+
+    @metrics.timed('update_hunches')
+    @tracer.traced('update_hunches')
+    def update_hunches(self, hunches=()):
         """
         Gets a sorted list of candidates w/i a comparison, ordered by score average across voters.
         Hunches learn features.weight, not scores.score
+        :param hunches: [(candidate_id, score, old_score)] that triggered this, for incremental learning
         """
 
-        hunches = self.hunches
-        if True or len(hunches) < 20:
-            # 1. set each candidate.hunch to its average from hunches
-            query = """
-                UPDATE candidates SET hunch=(
-                  SELECT AVG(score) 
-                  FROM hunches 
-                  WHERE hunches.candidate_id=candidates.id
-                  GROUP BY candidates.id 
-                ) 
-                WHERE candidates.comparison_id=:comparison_id
-            """
-            db.engine.execute(text(query), comparison_id=self.id)
-        elif 100 > len(hunches) > 20:
+        n_hunches = self.hunch_count()
+        tier = self.hunch_tier(n_hunches)
+        if tier == 'average':
+            # 1. set each candidate.hunch to its (maybe time-decayed) average, from candidate_stats' running sums
+            if not hunches:
+                CandidateStats.refresh(comparison_id=self.id)  # Not told what changed, so re-aggregate all
+            self.publish_hunch_averages([candidate_id for candidate_id, _, _ in hunches] or None)
+            Comparison.bump_version(self.id)
+            db.session.commit()
+        elif tier == 'linear' and hunches and app.config.get('HUNCH_ONLINE_LEARNER'):
             # 2. calculate SVM, SGD, and grid-search average. Set candidate[].hunch
-            # if len(hunches) % 3 != 0: return  # every 3rd hunch (save compute)
-            model = self._train()
-            self._predict(model)
+            self.learn_hunches(hunches, n_hunches=n_hunches)
         else:
-            # 3. Else if len(hunches)>100, every 3rd do DNN, set candidate[].hunch
-            # if len(hunches) % 3 != 0: return  # every 3rd hunch (save compute)
-            model = self._train(deep=True)
-            self._predict(model)
+            # 2/3. Queued rather than trained here; rapid hunches coalesce into one pending job. DNN past 100
+            if hunches:
+                # Readers see the hunches themselves (last_hunch, totals) now, predictions once trained
+                Comparison.bump_version(self.id)
+                db.session.commit()
+            training_queue.submit(self.id, deep=tier == 'deep')
 
         # TODO here just grab the candidate.hunch[] out of database, since it's calculated in user.hunch()
 
@@ -442,6 +967,35 @@ GROUP BY c.id, s.features, s.score_total, s.score_norm, h.hunch_total, h.hunch_n
         )
 
 
+class HunchLearner(db.Model):
+    """
+    A comparison's online linear hunch model (ml.online.RecursiveLeastSquares), updated per hunch by
+    Comparison.learn_hunches and refit from scratch by Comparison.refit_learner (`manage.py refit_hunches`).
+    """
+    __tablename__ = 'hunch_learners'
+
+    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), primary_key=True)
+    feature_ids = db.Column(pg.ARRAY(db.String), nullable=False)  # Weights' column order; any change forces a refit
+    weights = db.Column(pg.ARRAY(db.Float), nullable=False)
+    covariance = db.Column(pg.ARRAY(db.Float), nullable=False)  # Flattened (features+1)^2 inverse covariance
+    n_samples = db.Column(db.Integer, nullable=False, default=0)  # Hunches accounted for (unscored ones are skipped)
+    n_updates = db.Column(db.Integer, nullable=False, default=0)  # Incremental updates since the last refit
+    refit_on = db.Column(db.DateTime)
+
+    def model(self):
+        return online.RecursiveLeastSquares(len(self.feature_ids), weights=self.weights, covariance=self.covariance)
+
+    def store(self, model, feature_ids, n_samples, refit=True):
+        self.feature_ids = feature_ids
+        self.weights = model.weights.tolist()
+        self.covariance = model.covariance.ravel().tolist()
+        self.n_samples = n_samples
+        if refit:
+            self.n_updates, self.refit_on = 0, datetime.datetime.utcnow()
+        else:
+            self.n_updates = (self.n_updates or 0) + 1
+
+
 class Feature(db.Model):
     """
     Feature for comparison (ie, a column in the training data matrix)
@@ -453,7 +1007,7 @@ class Feature(db.Model):
     description = db.Column(db.Text)
     weight = db.Column(db.Float, nullable=False, default=5)  # min=0, max=5
     # lower_is_better=False
-    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), nullable=False)
+    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), nullable=False, index=True)
 
     def to_json(self):
         return dict(id=self.id, title=self.title, description=self.description, weight=self.weight)
@@ -469,7 +1023,7 @@ class Candidate(db.Model):
     title = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
     links = db.Column(pg.ARRAY(db.String))
-    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), nullable=False)
+    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), nullable=False, index=True)
     # Running hunch for this candidate. Starts as AVG (first 50) then LinReg (50-100) then DNN (100+)
     hunch = db.Column(db.Float)
 
@@ -477,11 +1031,173 @@ class Candidate(db.Model):
         return dict(id=self.id, title=self.title, description=self.description, links=self.links)
 
 
+class CandidateStats(db.Model):
+    """
+    Per-candidate aggregates of scores & hunches, maintained on write so listing a comparison's candidates
+    doesn't re-aggregate every score and hunch on each read. Call `refresh()` in the same transaction as any
+    write which affects them (scores, hunches, feature weights), or for new hunches the cheaper `add_hunches()`.
+    """
+    __tablename__ = 'candidate_stats'
+
+    candidate_id = db.Column(pg.UUID, db.ForeignKey('candidates.id', **fk_cascade), primary_key=True)
+    comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), nullable=False, index=True)
+    # [{feature_id, score_weighted, score}], one per scored feature, in feature_id order
+    features = db.Column(pg.JSONB)
+    # SUM(AVG(score) * feature.weight) over features
+    score_total = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    score_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    hunch_total = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    hunch_avg = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    hunch_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Exponentially time-decayed SUM(score) & COUNT(*) of hunches, as of hunch_decayed_at (see HUNCH_HALF_LIFE).
+    # Both decay at the same rate, so their ratio (the decayed average) stays put between hunches
+    hunch_decayed_sum = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    hunch_decayed_weight = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    hunch_decayed_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow,
+                                 server_default=func.now())
+
+    @staticmethod
+    def hunch_decay():
+        """Per-second decay exponent: a hunch's weight is 0.5 ** (age * hunch_decay()). 0 if decay is off"""
+        half_life = app.config.get('HUNCH_HALF_LIFE')
+        return 1. / half_life if half_life else 0.
+
+    @staticmethod
+    def add_hunches(changes):
+        """
+        Fold newly-written hunches into their candidates' running sums: O(1) per candidate, where refresh()
+        re-aggregates all of its hunches. Runs on the session, like refresh().
+        :param changes: [(comparison_id, candidate_id, score, old_score, timestamp)]; old_score is set if the
+            hunch revised an earlier one (from `timestamp`) rather than being added
+        """
+        if not changes: return
+        decay = CandidateStats.hunch_decay()
+        at = max(timestamp for _, _, _, _, timestamp in changes)
+        deltas = {}  # candidate_id -> [comparison_id, total, count, decayed_sum, decayed_weight]
+        for comparison_id, candidate_id, score, old_score, timestamp in changes:
+            weight = 0.5 ** ((at - timestamp).total_seconds() * decay)
+            d = deltas.setdefault(candidate_id, [comparison_id, 0., 0, 0., 0.])
+            d[1] += score - (old_score or 0)
+            d[2] += old_score is None
+            d[3] += (score - (old_score or 0)) * weight
+            d[4] += weight if old_score is None else 0
+
+        params = dict(at=at, decay=decay)
+        for i, (candidate_id, d) in enumerate(deltas.items()):
+            for k, v in zip(('candidate_id', 'comparison_id', 'total', 'count', 'decayed_sum', 'decayed_weight'),
+                            [candidate_id] + d):
+                params['%s%d' % (k, i)] = v
+        values = ', '.join(
+            '(CAST(:candidate_id{0} AS UUID), CAST(:comparison_id{0} AS UUID), CAST(:total{0} AS FLOAT), '
+            'CAST(:count{0} AS INTEGER), CAST(:decayed_sum{0} AS FLOAT), CAST(:decayed_weight{0} AS FLOAT))'
+            .format(i) for i in range(len(deltas))
+        )
+        query = """
+INSERT INTO candidate_stats AS cs (candidate_id, comparison_id, score_total, score_count,
+  hunch_total, hunch_count, hunch_avg, hunch_decayed_sum, hunch_decayed_weight, hunch_decayed_at)
+SELECT d.candidate_id, d.comparison_id, 0, 0,
+  d.total, d.count, COALESCE(d.total / NULLIF(d.count, 0), 0), d.decayed_sum, d.decayed_weight, :at
+FROM (VALUES {values}) d(candidate_id, comparison_id, total, count, decayed_sum, decayed_weight)
+ON CONFLICT (candidate_id) DO UPDATE SET
+  hunch_total=cs.hunch_total + EXCLUDED.hunch_total,
+  hunch_count=cs.hunch_count + EXCLUDED.hunch_count,
+  hunch_avg=COALESCE((cs.hunch_total + EXCLUDED.hunch_total) / NULLIF(cs.hunch_count + EXCLUDED.hunch_count, 0), 0),
+  -- Decay what's there up to now, then add the batch (already decayed to now)
+  hunch_decayed_sum=cs.hunch_decayed_sum
+    * POWER(0.5, EXTRACT(EPOCH FROM EXCLUDED.hunch_decayed_at - cs.hunch_decayed_at) * :decay)
+    + EXCLUDED.hunch_decayed_sum,
+  hunch_decayed_weight=cs.hunch_decayed_weight
+    * POWER(0.5, EXTRACT(EPOCH FROM EXCLUDED.hunch_decayed_at - cs.hunch_decayed_at) * :decay)
+    + EXCLUDED.hunch_decayed_weight,
+  hunch_decayed_at=EXCLUDED.hunch_decayed_at;
+        """.format(values=values)
+        db.session.execute(text(query), params)
+
+    @staticmethod
+    def refresh(candidate_ids=None, comparison_id=None):
+        """
+        Recompute aggregates for the given candidates (or all of a comparison's candidates, or everything if
+        neither is given). Runs on the session, so it commits/rolls back along with the write that triggered it.
+        """
+        if candidate_ids is not None:
+            if not candidate_ids: return
+            where, params = "id IN :candidate_ids", dict(candidate_ids=tuple(candidate_ids))
+        elif comparison_id is not None:
+            where, params = "comparison_id=:comparison_id", dict(comparison_id=comparison_id)
+        else:
+            where, params = "TRUE", {}
+        query = """
+WITH cands AS (SELECT id, comparison_id FROM candidates WHERE {where})
+INSERT INTO candidate_stats (candidate_id, comparison_id, features, score_total, score_count,
+  hunch_total, hunch_avg, hunch_count, hunch_decayed_sum, hunch_decayed_weight, hunch_decayed_at)
+SELECT c.id, c.comparison_id,
+  s.features,
+  COALESCE(s.score_total, 0),
+  COALESCE(s.score_count, 0),
+  COALESCE(h.hunch_total, 0),
+  COALESCE(h.hunch_avg, 0),
+  COALESCE(h.hunch_count, 0),
+  COALESCE(h.hunch_decayed_sum, 0),
+  COALESCE(h.hunch_decayed_weight, 0),
+  now() at time zone 'utc'
+FROM cands c
+
+LEFT JOIN (
+  SELECT s.candidate_id,
+    JSONB_AGG(
+      JSONB_BUILD_OBJECT('feature_id', s.feature_id, 'score_weighted', s.score_weighted, 'score', s.score)
+      ORDER BY s.feature_id
+    ) features,
+    SUM(s.score_weighted) score_total,
+    SUM(s.score_count) score_count
+
+  FROM (
+    SELECT s.feature_id, s.candidate_id, AVG(s.score) score, COUNT(*) score_count,
+      AVG(s.score) * f.weight score_weighted
+    FROM scores s
+    INNER JOIN features f ON f.id=s.feature_id
+    WHERE s.candidate_id IN (SELECT id FROM cands)
+    GROUP BY s.feature_id, s.candidate_id, f.weight
+  ) s
+
+  GROUP BY s.candidate_id
+) s ON s.candidate_id=c.id
+
+LEFT JOIN (
+  SELECT h.candidate_id,
+    AVG(h.score) hunch_avg,
+    SUM(h.score) hunch_total,
+    COUNT(*) hunch_count,
+    SUM(h.score * POWER(0.5, EXTRACT(EPOCH FROM now() at time zone 'utc' - h.timestamp) * :decay)) hunch_decayed_sum,
+    SUM(POWER(0.5, EXTRACT(EPOCH FROM now() at time zone 'utc' - h.timestamp) * :decay)) hunch_decayed_weight
+  FROM hunches h
+  WHERE h.candidate_id IN (SELECT id FROM cands)
+  GROUP BY h.candidate_id
+) h ON h.candidate_id=c.id
+
+ON CONFLICT (candidate_id) DO UPDATE SET
+  features=EXCLUDED.features,
+  score_total=EXCLUDED.score_total,
+  score_count=EXCLUDED.score_count,
+  hunch_total=EXCLUDED.hunch_total,
+  hunch_avg=EXCLUDED.hunch_avg,
+  hunch_count=EXCLUDED.hunch_count,
+  hunch_decayed_sum=EXCLUDED.hunch_decayed_sum,
+  hunch_decayed_weight=EXCLUDED.hunch_decayed_weight,
+  hunch_decayed_at=EXCLUDED.hunch_decayed_at;
+        """.format(where=where)
+        params['decay'] = CandidateStats.hunch_decay()
+        db.session.flush()
+        db.session.execute(text(query), params)
+
+
 class Score(db.Model):
     """
     A user's score on a candidate.feature
     """
     __tablename__ = 'scores'
+    # The primary key leads with user_id; aggregates & permission checks go by candidate (and feature)
+    __table_args__ = (db.Index('ix_scores_candidate_id_feature_id', 'candidate_id', 'feature_id'),)
 
     user_id = db.Column(pg.UUID, db.ForeignKey('users.id', **fk_cascade), primary_key=True)
     candidate_id = db.Column(pg.UUID, db.ForeignKey('candidates.id', **fk_cascade), primary_key=True)
@@ -495,11 +1211,159 @@ class Hunch(db.Model):
     Hunches are used in a machine-learning algo to _learn_ the feature weights of the user
     """
     __tablename__ = 'hunches'
+    # The primary key puts comparison_id before timestamp, so the "recent hunch" lookups get their own
+    __table_args__ = (db.Index('ix_hunches_user_id_candidate_id_timestamp', 'user_id', 'candidate_id', 'timestamp'),)
 
     # id = db.Column(pg.UUID, primary_key=True, default=uuid_default)
     user_id = db.Column(pg.UUID, db.ForeignKey('users.id', **fk_cascade), primary_key=True)
-    candidate_id = db.Column(pg.UUID, db.ForeignKey('candidates.id', **fk_cascade), primary_key=True)
+    candidate_id = db.Column(pg.UUID, db.ForeignKey('candidates.id', **fk_cascade), primary_key=True, index=True)
     comparison_id = db.Column(pg.UUID, db.ForeignKey('comparisons.id', **fk_cascade), primary_key=True)
 
     score = db.Column(db.Integer, nullable=False)  # TODO min: 0, max: 5
     timestamp = db.Column(db.DateTime, nullable=False, primary_key=True, default=datetime.datetime.utcnow)
+
+    # A hunch revises the user's hunch on that candidate from this long before it, rather than adding another
+    REVISION_WINDOW = datetime.timedelta(hours=1)
+
+    @staticmethod
+    def record_many(hunches):
+        """
+        Write a batch of hunches (see HunchBuffer), in one statement unless a user hunched a candidate more than an
+        hour apart: each revises the user's hunch on that candidate from the hour before it, else is added. Then
+        aggregates are refreshed & models updated once per comparison. Permissions were checked when the hunches were
+        accepted (User.hunch).
+        :param hunches: [dict(user_id, candidate_id, comparison_id, score, timestamp)]
+        :return: number of hunches written
+        """
+        rows = []
+        for batch in Hunch._revision_rounds(hunches):
+            rows += Hunch._record_round(batch)
+
+        changes = [(str(r.comparison_id), str(r.candidate_id), r.score, r.old_score, r.timestamp) for r in rows]
+        CandidateStats.add_hunches(changes)
+        by_comparison = {}
+        for comparison_id, candidate_id, score, old_score, _ in changes:
+            by_comparison.setdefault(comparison_id, []).append((candidate_id, score, old_score))
+        db.session.commit()
+        # update_hunches bumps each comparison's version, once, after publishing whatever the hunches changed
+        for comparison_id, changes in by_comparison.items():
+            comparison = db.session.query(Comparison).get(comparison_id)
+            if comparison:  # Could have been deleted since the hunch was accepted
+                comparison.update_hunches(changes)
+        return len(rows)
+
+    @staticmethod
+    def _revision_rounds(hunches):
+        """
+        Fold each user's hunches on a candidate into the rows they'd leave behind had they been written one at a
+        time: a run of hunches revising the same row becomes one, with the run's latest score under its first
+        timestamp (which is what decides revise vs add). A user & candidate gets one per round, since a round is one
+        statement and has to see the rows added by the round before.
+        :return: [[hunch]], in the order they're to be written
+        """
+        runs = {}
+        for h in sorted(hunches, key=lambda h: h['timestamp']):
+            runs.setdefault((h['user_id'], h['candidate_id']), []).append(h)
+        # The row a run's first hunch would revise; only runs of several have anything to fold into it
+        several = [k for k, hs in runs.items() if len(hs) > 1]
+        existing = {}
+        if several:
+            existing = {(str(r.user_id), str(r.candidate_id)): r.timestamp for r in db.session.execute(text("""
+                SELECT DISTINCT ON (h.user_id, h.candidate_id) h.user_id, h.candidate_id, h.timestamp
+                FROM hunches h
+                INNER JOIN unnest(CAST(:user_ids AS UUID[]), CAST(:candidate_ids AS UUID[])) k(user_id, candidate_id)
+                  ON h.user_id=k.user_id AND h.candidate_id=k.candidate_id
+                WHERE h.timestamp > :since
+                ORDER BY h.user_id, h.candidate_id, h.timestamp DESC
+            """), dict(
+                user_ids=[str(k[0]) for k in several],
+                candidate_ids=[str(k[1]) for k in several],
+                since=min(runs[k][0]['timestamp'] for k in several) - Hunch.REVISION_WINDOW
+            ))}
+
+        rounds = []
+        for (user_id, candidate_id), hs in runs.items():
+            row, last, folded = existing.get((str(user_id), str(candidate_id))), None, []
+            for h in hs:
+                if row is not None and row <= h['timestamp'] < row + Hunch.REVISION_WINDOW:
+                    if last is not None:
+                        last['score'] = h['score']  # Revises the row this run already wrote or revised
+                        continue
+                else:
+                    row = h['timestamp']  # Adds a row
+                last = dict(h)
+                folded.append(last)
+            for i, h in enumerate(folded):
+                if i == len(rounds):
+                    rounds.append([])
+                rounds[i].append(h)
+        return rounds
+
+    @staticmethod
+    def _record_round(batch):
+        """Write hunches, at most one per user & candidate, in one statement. :return: the rows written"""
+        params = {}
+        for i, h in enumerate(batch):
+            for k in ('user_id', 'candidate_id', 'comparison_id', 'score', 'timestamp'):
+                params['%s%d' % (k, i)] = h[k]
+        values = ', '.join(
+            '(CAST(:user_id{0} AS UUID), CAST(:candidate_id{0} AS UUID), CAST(:comparison_id{0} AS UUID), '
+            'CAST(:score{0} AS INTEGER), CAST(:timestamp{0} AS TIMESTAMP))'.format(i) for i in range(len(batch))
+        )
+        query = """
+WITH batch(user_id, candidate_id, comparison_id, score, timestamp) AS (VALUES {values}),
+updated AS (
+  -- Joining hunches to itself gives the pre-update score, for the online learner to un-learn
+  UPDATE hunches h SET score=b.score
+  FROM batch b, hunches old
+  WHERE h.user_id=b.user_id AND h.candidate_id=b.candidate_id
+    AND h.timestamp > b.timestamp - interval '1 hours' AND h.timestamp <= b.timestamp
+    AND old.user_id=h.user_id AND old.candidate_id=h.candidate_id
+    AND old.comparison_id=h.comparison_id AND old.timestamp=h.timestamp
+  RETURNING h.user_id, h.candidate_id, old.score old_score, old.timestamp
+), inserted AS (
+  INSERT INTO hunches (user_id, candidate_id, comparison_id, score, timestamp)
+  SELECT b.user_id, b.candidate_id, b.comparison_id, b.score, b.timestamp
+  FROM batch b
+  -- Skip hunches on candidates or comparisons deleted since they were accepted
+  INNER JOIN candidates ca ON ca.id=b.candidate_id
+  INNER JOIN comparisons c ON c.id=b.comparison_id AND c.deleted_at IS NULL
+  WHERE NOT EXISTS (SELECT 1 FROM updated u WHERE u.user_id=b.user_id AND u.candidate_id=b.candidate_id)
+  ON CONFLICT DO NOTHING  -- A replayed journal can hold hunches which were already written
+  RETURNING user_id, candidate_id
+)
+-- Just what was written, so skipped hunches aren't counted
+SELECT b.comparison_id, b.candidate_id, b.score, u.old_score, COALESCE(u.timestamp, b.timestamp) AS timestamp
+FROM batch b
+LEFT JOIN updated u ON u.user_id=b.user_id AND u.candidate_id=b.candidate_id
+LEFT JOIN inserted i ON i.user_id=b.user_id AND i.candidate_id=b.candidate_id
+WHERE u.user_id IS NOT NULL OR i.user_id IS NOT NULL
+        """.format(values=values)
+        return db.session.execute(text(query), params).fetchall()
+
+
+@contextmanager
+def _hunch_flush_context():
+    # Buffered hunches are flushed off the request path, on the buffer's thread (or at exit)
+    with app.app_context(), tracer.trace('hunch_flush'):
+        try:
+            yield
+        finally:
+            db.session.remove()
+
+
+# Accepts hunches & writes them in batches (see ingest.HunchBuffer)
+hunch_buffer = HunchBuffer(
+    apply=Hunch.record_many,
+    durability=app.config.get('HUNCH_DURABILITY'),
+    max_batch=app.config.get('HUNCH_BUFFER_MAX_BATCH'),
+    max_delay=app.config.get('HUNCH_BUFFER_MAX_DELAY'),
+    journal_dir=app.config.get('HUNCH_JOURNAL_DIR'),
+    context=_hunch_flush_context
+)
+
+for prefix, component in [
+    ('rankings_cache', rankings_cache), ('token_cache', token_cache), ('permission_cache', permission_cache),
+    ('training_queue', training_queue), ('hunch_buffer', hunch_buffer), ('purge_worker', purge_worker)
+]:
+    metrics.collect(prefix, component.stats)
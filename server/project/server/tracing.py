@@ -0,0 +1,212 @@
+# project/server/tracing.py
+
+import os
+import json
+import time
+import uuid
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import request
+
+# Only these are re-run for a plan, inside a savepoint that's rolled back so writes are undone
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+MAX_STATEMENT_LENGTH = 2000
+
+
+class Trace(object):
+    """One traced unit of work (a request, a hunch flush, a training job) and its nested spans"""
+
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.spans = []
+        self.stack = []  # Open spans' ids, innermost last
+
+    def offset_ms(self, at=None):
+        return round(((at or time.perf_counter()) - self._started) * 1000, 3)
+
+    def to_json(self):
+        return dict(
+            type='trace', id=self.id, name=self.name, pid=os.getpid(), started_at=self.started_at,
+            duration_ms=self.offset_ms(), attrs=self.attrs, spans=self.spans
+        )
+
+
+class Tracer(object):
+    """
+    Optional span tracing, written as JSON lines to TRACE_FILE (see init_app), for seeing why one request was slow.
+
+    A TRACE_SAMPLE_RATE fraction of requests is traced, with spans for the auth check, each SQL statement,
+    serialization, rankings post-processing & model training. Statements slower than SLOW_QUERY_MS are logged
+    whether or not their request is traced, and a SLOW_QUERY_EXPLAIN_RATE fraction of those (at most one per
+    SLOW_QUERY_EXPLAIN_INTERVAL seconds per process) get an EXPLAIN (ANALYZE, BUFFERS) plan. That re-runs the
+    statement on the same connection, so costs its time again. Statement parameters are never recorded.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.metrics = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_explain = 0
+
+    @property
+    def enabled(self):
+        return bool(self.app and self.app.config.get('TRACING_ENABLED'))
+
+    def config(self, key):
+        return self.app.config.get(key)
+
+    def init_app(self, app, metrics):
+        """Requests & statements come through metrics' hooks (Metrics.subscribe), so each is timed once for both"""
+        self.app = app
+        self.metrics = metrics
+        metrics.subscribe(self)
+
+    @property
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    # Traces & spans
+
+    def start(self, name, **attrs):
+        """Begin a trace on this thread, if tracing's on and it's sampled. :return: the Trace or None"""
+        if not self.enabled or self.current is not None: return None
+        if random.random() >= self.config('TRACE_SAMPLE_RATE'): return None
+        self._local.trace = Trace(name, **attrs)
+        return self._local.trace
+
+    def finish(self, trace):
+        if trace is None or self.current is not trace: return
+        self._local.trace = None
+        self.write(trace.to_json())
+
+    @contextmanager
+    def trace(self, name, **attrs):
+        """Trace the block as a unit of work of its own, eg a background job"""
+        trace = self.start(name, **attrs)
+        try:
+            yield trace
+        finally:
+            self.finish(trace)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Record the block as a span of the current trace, if any. :return: the span's attrs, for adding to"""
+        trace = self.current
+        if trace is None:
+            yield attrs
+            return
+        span = self._open(trace, name, attrs)
+        try:
+            yield attrs
+        finally:
+            self._close(trace, span)
+
+    def traced(self, name):
+        """Decorator form of span()"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _open(self, trace, name, attrs, at=None):
+        span = dict(
+            id=len(trace.spans), parent=trace.stack[-1] if trace.stack else None, name=name,
+            start_ms=trace.offset_ms(at), attrs=attrs
+        )
+        trace.spans.append(span)
+        trace.stack.append(span['id'])
+        return span
+
+    def _close(self, trace, span, duration_ms=None):
+        if duration_ms is None:
+            duration_ms = trace.offset_ms() - span['start_ms']
+        span['duration_ms'] = round(duration_ms, 3)
+        if trace.stack and trace.stack[-1] == span['id']:
+            trace.stack.pop()
+
+    # Requests
+
+    def request_started(self):
+        self.start('request', method=request.method, path=request.path)
+
+    def request_finished(self, status, route, exc=None):
+        # Once a streamed body is done, so its statements are included
+        trace = self.current
+        if trace is None: return
+        trace.attrs.update(status=status, route=route)
+        if exc is not None:
+            trace.attrs['error'] = repr(exc)
+        self.finish(trace)
+
+    # SQL
+
+    def statement(self, conn, cursor, statement, parameters, executemany, started, elapsed):
+        elapsed_ms = elapsed * 1000
+        attrs = dict(statement=statement[:MAX_STATEMENT_LENGTH], rows=cursor.rowcount)
+        if elapsed_ms >= self.config('SLOW_QUERY_MS'):
+            attrs['slow'] = True
+            if not executemany and self._should_explain(statement):
+                attrs['plan'] = self._explain(conn, statement, parameters)
+        trace = self.current
+        if trace is not None:
+            # Its own time, not counting any EXPLAIN
+            self._close(trace, self._open(trace, 'sql', attrs, at=started), duration_ms=elapsed_ms)
+        elif attrs.get('slow'):
+            self.write(dict(
+                type='slow_query', pid=os.getpid(), at=time.time(), duration_ms=round(elapsed_ms, 3),
+                route=self.metrics.route(), **attrs
+            ))
+
+    def _should_explain(self, statement):
+        if (statement.split(None, 1) or [''])[0].upper() not in EXPLAINABLE: return False
+        if random.random() >= self.config('SLOW_QUERY_EXPLAIN_RATE'): return False
+        with self._lock:
+            now = time.time()
+            if now - self._last_explain < self.config('SLOW_QUERY_EXPLAIN_INTERVAL'): return False
+            self._last_explain = now
+        return True
+
+    def _explain(self, conn, statement, parameters):
+        # A plain DBAPI cursor, so this isn't itself traced or counted, and works beside a streaming (named) cursor
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute('SAVEPOINT trace_explain')
+            try:
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement, parameters)
+                return cursor.fetchone()[0]
+            except Exception as e:
+                return dict(error=repr(e))
+            finally:
+                cursor.execute('ROLLBACK TO SAVEPOINT trace_explain')
+        except Exception as e:  # Eg no transaction to hold a savepoint
+            return dict(error=repr(e))
+        finally:
+            cursor.close()
+
+    # Output
+
+    def write(self, record):
+        path = os.path.abspath(self.config('TRACE_FILE'))
+        line = (json.dumps(record, default=str) + '\n').encode()
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # One O_APPEND write per record, so lines from several worker processes don't interleave
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+
+tracer = Tracer()
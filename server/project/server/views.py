@@ -1,19 +1,25 @@
 from functools import wraps
-from flask import g, request, make_response, jsonify
+from flask import g, request, make_response, jsonify, json, Response, stream_with_context
 from flask.views import MethodView
 
 from project.server import app, db
 from project.server import models as m
 from project.server.auth.views import login_required
+from project.server.tracing import tracer
+from project.server.cursors import encode_cursor, decode_cursor, timestamp, uuid_string, number
 
 
 # These methods could be in a BaseView(MethodView) and inherited, but hunch() & score() below are floaters
 # which need these.
 
-def send(data, code=200):
-    if 400 > code >= 200:
-        return make_response(jsonify(dict(status='success', data=data))), code
-    return make_response(jsonify(dict(status='fail', message=data))), code
+def send(data, code=200, **meta):
+    """
+    :param meta: extra top-level keys for a successful response, eg pagination's `next`
+    """
+    with tracer.span('serialize'):
+        if 400 > code >= 200:
+            return make_response(jsonify(dict(status='success', data=data, **meta))), code
+        return make_response(jsonify(dict(status='fail', message=data))), code
 
 
 def not_implemented():
@@ -27,11 +33,20 @@ def comparison_404():
 class ComparisonAPI(MethodView):
     def get(self, id):
         """Get this user's comparison(s)"""
-        # Comparison list
+        # Comparison list: a page of summaries (?limit=&after=), or ?view=full for every full document
         if id is None:
-            return send([join.comparison.to_json() for join in g.user.comparisons])
-
-        comp = g.user.get_comparison(id)
+            if request.args.get('view') == 'full':
+                return send([comp.to_json() for comp in g.user.list_comparisons()])
+            try:
+                after = request.args.get('after')
+                after = decode_cursor(after, (timestamp, uuid_string)) if after else None
+                limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+            except ValueError:
+                return send('Invalid pagination parameters', code=400)
+            summaries, last = g.user.comparison_summaries(limit=limit, after=after)
+            return send(summaries, next=encode_cursor(last) if last else None)
+
+        comp = g.user.get_comparison(id, eager=True)
         if not comp: return comparison_404()
         return send(comp.to_json())
 
@@ -53,17 +68,18 @@ class ComparisonAPI(MethodView):
         # Stash this away so no key argument error
         body = request.get_json()
         share = body.pop('share')
+        if share and g.user.permission_on(comp.id) != m.PermissionEnum.owner:
+            return send('Only the owner of a comparison can share it', code=403)
 
         # Have to update on query, not model
         comp_q = db.session.query(m.Comparison).filter_by(id=id)
         comp_q.update(request.get_json())
-        db.session.commit()
 
-        # Send shares
+        # Send shares, committing along with the update
         if share:
-            for email in share.split():
-                g.user.share_comparison(comparison_id=comp.id, friend_email=email)
-
+            shared = g.user.share_comparison_many(comp.id, share.split())
+            return send(comp_q.first().to_json(), shares=shared)
+        db.session.commit()
         return send(comp_q.first().to_json())
 
 
@@ -95,6 +111,9 @@ class FeatureAPI(MethodView):
         if not feature:
             return send('Feature not found', code=404)
         db.session.delete(feature)
+        # Its scores cascade away with it, so candidates' totals change
+        m.CandidateStats.refresh(comparison_id=cid)
+        m.Comparison.bump_version(cid)
         db.session.commit()
         return send(feature.to_json())
 
@@ -104,7 +123,11 @@ class FeatureAPI(MethodView):
         feature = db.session.query(m.Feature).filter_by(id=id)
         if not feature.first():
             return send('Feature not found', code=404)
-        feature.update(request.get_json())
+        body = request.get_json()
+        feature.update(body)
+        if 'weight' in body:
+            m.CandidateStats.refresh(comparison_id=cid)
+            m.Comparison.bump_version(cid)
         db.session.commit()
         return send(feature.first().to_json())
 
@@ -115,6 +138,7 @@ class CandidateAPI(MethodView):
         if not comp: return comparison_404()
         candidate = m.Candidate(comparison_id=cid, **request.get_json())
         db.session.add(candidate)
+        m.Comparison.bump_version(cid)
         db.session.commit()
         return send(candidate.to_json())
 
@@ -123,6 +147,9 @@ class CandidateAPI(MethodView):
         if not comp: return comparison_404()
 
         if id is None:
+            # Large comparisons: ?format=ndjson|json and/or ?limit=&after= stream off a server-side cursor
+            if any(request.args.get(k) for k in ('format', 'limit', 'after')):
+                return self.stream(comp)
             return send(comp.get_candidates(user_id=g.user.id))
 
         candidate = db.session.query(m.Candidate).filter_by(id=id).first()
@@ -130,6 +157,46 @@ class CandidateAPI(MethodView):
             return send('Candidate not found', code=404)
         return send(candidate.to_json())
 
+    def stream(self, comp):
+        """
+        Ranked candidates, written as they're read. ?format=json (default) is the usual envelope, with `next` at
+        the end; ?format=ndjson is one candidate per line, then {"next": ...} if there's another page.
+        """
+        ndjson = request.args.get('format') == 'ndjson'
+        try:
+            after = request.args.get('after')
+            after = decode_cursor(after, (number, uuid_string)) if after else None
+            limit = int(request.args['limit']) if request.args.get('limit') else None
+            assert limit is None or limit > 0
+        except (ValueError, AssertionError):
+            return send('Invalid pagination parameters', code=400)
+
+        # One extra row tells us whether there's a next page
+        rows = comp.iter_candidates(user_id=g.user.id, limit=limit and limit + 1, after=after)
+
+        def generate():
+            next_cursor, last_key = None, None
+            if not ndjson: yield '{"status": "success", "data": ['
+            try:
+                for i, (key, row) in enumerate(rows):
+                    if limit and i == limit:
+                        next_cursor = encode_cursor(last_key)
+                        break
+                    if ndjson:
+                        yield json.dumps(row) + '\n'
+                    else:
+                        yield (',' if i else '') + json.dumps(row)
+                    last_key = key
+            finally:
+                rows.close()  # Releases the cursor's connection if we stopped early
+            if ndjson:
+                if next_cursor: yield json.dumps(dict(next=next_cursor)) + '\n'
+            else:
+                yield '], "next": {}}}'.format(json.dumps(next_cursor))
+
+        mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+
     def delete(self, cid, id):
         comp = g.user.get_comparison(cid)
         if not comp: return comparison_404()
@@ -137,6 +204,7 @@ class CandidateAPI(MethodView):
         if not candidate:
             return send('Candidate not found', code=404)
         db.session.delete(candidate)
+        m.Comparison.bump_version(cid)
         db.session.commit()
         return send(candidate.to_json())
 
@@ -147,10 +215,44 @@ class CandidateAPI(MethodView):
         if not candidate.first():
             return send('Candidate not found', code=404)
         candidate.update(request.get_json())
+        m.Comparison.bump_version(cid)
         db.session.commit()
         return send(candidate.first().to_json())
 
 
+@app.route('/comparisons/<cid>/shares', methods=['POST'])
+@login_required
+def share(cid):
+    """
+    Share a comparison with many people at once. Body: {emails: [...], permission: 'add_feature' (default)}
+    :return: which emails were shared, already had access, or don't belong to a user
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return send('Expected a JSON object', code=400)
+    try:
+        permission = m.PermissionEnum[body.get('permission', 'add_feature')]
+    except (KeyError, TypeError):
+        return send('Unknown permission', code=400)
+    if permission == m.PermissionEnum.owner:
+        return send('There can only be one owner', code=400)
+    emails = body.get('emails')
+    if not isinstance(emails, list) or not all(isinstance(e, str) for e in emails):
+        return send('emails must be a list of email addresses', code=400)
+    granted = g.user.permission_on(cid)
+    if not granted: return comparison_404()
+    if granted != m.PermissionEnum.owner:
+        return send('Only the owner of a comparison can share it', code=403)
+    return send(g.user.share_comparison_many(cid, emails, permission=permission))
+
+
+@app.route('/cache/stats', methods=['GET'])
+@login_required
+def cache_stats():
+    """Hit/miss/eviction counters for this worker's in-process caches, for sizing them"""
+    return send(dict(rankings=m.rankings_cache.stats(), tokens=m.token_cache.stats()))
+
+
 @app.route('/score/<candidate_id>/<feature_id>/<score>', methods=['POST'])
 @login_required
 def score(candidate_id, feature_id, score):
@@ -158,6 +260,26 @@ def score(candidate_id, feature_id, score):
     return jsonify({})
 
 
+@app.route('/scores', methods=['POST'])
+@login_required
+def score_many():
+    """Bulk scoring. Body is a list of {candidate_id, feature_id, score}, written in one transaction"""
+    body = request.get_json(silent=True)
+    invalid = 'Expected a list of {candidate_id, feature_id, score (an integer)}'
+    if not isinstance(body, list): return send(invalid, code=400)
+    try:
+        scores = [(uuid_string(s['candidate_id']), uuid_string(s['feature_id']), s['score']) for s in body]
+    except (KeyError, TypeError, ValueError):
+        return send(invalid, code=400)
+    if not all(isinstance(score, int) and not isinstance(score, bool) for _, _, score in scores):
+        return send(invalid, code=400)
+    try:
+        count = g.user.score_many(scores)
+    except ValueError as e:  # Out of range, or a feature from another comparison
+        return send(str(e), code=400)
+    return send(dict(count=count))
+
+
 @app.route('/hunch/<candidate_id>/<score>', methods=['POST'])
 @login_required
 def hunch(candidate_id, score):
@@ -1,9 +1,11 @@
 # project/tests/base.py
 
 import json
+from contextlib import contextmanager
 from flask_testing import TestCase
 
 from project.server import app, db
+from project.tests.helpers import count_queries
 
 
 class BaseTestCase(TestCase):
@@ -21,6 +23,16 @@ class BaseTestCase(TestCase):
         db.session.remove()
         db.drop_all()
 
+    @contextmanager
+    def assertQueries(self, num):
+        """Fail unless exactly `num` SQL statements run within the block"""
+        with count_queries() as counter:
+            yield counter
+        self.assertEqual(
+            counter.count, num,
+            '%d queries run, %d expected:\n%s' % (counter.count, num, '\n'.join(counter.statements))
+        )
+
     def _build_req_kwargs(self, **kwargs):
         obj = dict(content_type='application/json')
         if kwargs.get('token', None):
@@ -1 +1,31 @@
 # project/tests/helpers.py
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from project.server import db
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries():
+    """Record every SQL statement sent to the database within the block"""
+    counter = QueryCounter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
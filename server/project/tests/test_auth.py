@@ -104,6 +104,22 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(data['message'] == 'Successfully logged out.')
             self.assertEqual(response.status_code, 200)
 
+    def test_logout_invalidates_cached_token(self):
+        """ Test a token verified (and cached) before logout is rejected right after """
+        with self.client:
+            data_register, _ = self.register_user('joe@gmail.com', '123456')
+            token = data_register['auth_token']
+            data, response = self.client_get('/auth/status', token=token)
+            self.assertEqual(response.status_code, 200)
+            data, response = self.client_get('/auth/status', token=token)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['data']['email'] == 'joe@gmail.com')
+            data, response = self.client_post('/auth/logout', token=token)
+            self.assertEqual(response.status_code, 200)
+            data, response = self.client_get('/auth/status', token=token)
+            self.assertTrue(data['message'] == 'Token blacklisted. Please log in again.')
+            self.assertEqual(response.status_code, 401)
+
     def test_invalid_logout(self):
         """ Testing logout after the token expires """
         with self.client:
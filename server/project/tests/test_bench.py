@@ -0,0 +1,88 @@
+# project/tests/test_bench.py
+
+
+import unittest
+
+from sqlalchemy import text
+
+from project.bench import rankings, micro, load
+from project.server import db
+from project.server.models import User
+from project.tests.base import BaseTestCase
+
+
+class TestRankingsBench(BaseTestCase):
+
+    def test_matches_legacy_query(self):
+        # run() asserts the current & legacy ranking output match, but for the accepted rounding change
+        results = rankings.run(sizes=(25,), n_features=3, repeat=1)
+        assert results[0]['candidates'] == 25
+
+    def test_rounding_change(self):
+        # Accepted change: ties round half away from zero, as the query's ROUND does, where round() went to even
+        cases = [  # (value, legacy round(), current)
+            (0.25, 0.2, 0.3), (2.25, 2.2, 2.3), (-0.25, -0.2, -0.3), (0.35, 0.3, 0.4), (1.15, 1.1, 1.2),
+            (0.75, 0.8, 0.8), (2.24, 2.2, 2.2), (2.26, 2.3, 2.3), (3.0, 3.0, 3.0)
+        ]
+        for value, legacy, current in cases:
+            self.assertEqual(round(value, 1), legacy, value)
+            self.assertEqual(rankings.pg_round(value), current, value)
+            pg = db.session.execute(text('SELECT ROUND(CAST(:value AS FLOAT)::numeric, 1)::float'), dict(value=value))
+            self.assertEqual(pg.scalar(), current, value)
+
+        # Only those differences pass the legacy check
+        def rows(value, **extra):
+            return [dict(dict.fromkeys(rankings.ROUNDED, value), id='a', features=[], **extra)]
+        rankings.assert_same(rows(2.2, unrounded=dict.fromkeys(rankings.ROUNDED, 2.25)), rows(2.3))
+        with self.assertRaises(AssertionError):
+            rankings.assert_same(rows(2.2, unrounded=dict.fromkeys(rankings.ROUNDED, 2.2)), rows(2.3))
+
+
+class TestMicroBench(BaseTestCase):
+
+    def test_run_and_compare(self):
+        results = micro.run(sizes=('20x3x2x10',), repeat=2, warmup=0)
+        self.assertEqual([r['scenario'] for r in results['results']], list(micro.SCENARIOS))
+        self.assertTrue(all(r['n'] == 2 and r['median_ms'] > 0 for r in results['results']))
+        self.assertEqual((results['results'][0]['n_users'], results['results'][0]['n_hunches']), (2, 10))
+        self.assertEqual(db.session.query(User).count(), 0, 'Seeded users are deleted')
+
+        comparisons = micro.compare(results, results)
+        self.assertEqual(len(comparisons), len(micro.SCENARIOS))
+        self.assertFalse(any(c['regressed'] for c in comparisons))
+        slower = dict(results, results=[dict(r, median_ms=r['median_ms'] * 2) for r in results['results']])
+        self.assertTrue(all(c['regressed'] for c in micro.compare(slower, results)))
+
+    def test_parse_size(self):
+        self.assertEqual(micro.parse_size('small'), micro.SIZES['small'])
+        self.assertEqual(micro.parse_size('10x2x3x4'), dict(n_candidates=10, n_features=2, n_users=3, n_hunches=4))
+        with self.assertRaises(ValueError):
+            micro.parse_size('10x2')
+        with self.assertRaises(ValueError):
+            micro.parse_size('10x2x3x31')  # More hunches than user & candidate pairs
+
+
+class TestLoadHarness(BaseTestCase):
+
+    def test_report(self):
+        recorder = load.Recorder()
+        for ms in range(1, 101):
+            recorder.record('GET /comparisons/', ms)
+        recorder.record('POST /hunch/<candidate_id>/<score>', 5, error=500)
+        report = recorder.report(seconds=10)
+        self.assertEqual(list(report), ['GET /comparisons/', 'POST /hunch/<candidate_id>/<score>', 'total'])
+        listing = report['GET /comparisons/']
+        self.assertEqual((listing['p50_ms'], listing['p95_ms'], listing['p99_ms']), (50, 95, 99))
+        self.assertEqual(listing['rps'], 10)
+        self.assertEqual(report['POST /hunch/<candidate_id>/<score>']['error_kinds'], {500: 1})
+        self.assertEqual((report['total']['requests'], report['total']['errors']), (101, 1))
+
+    def test_cleanup(self):
+        self.register_user('load-abc-0@example.com', '123456')
+        self.register_user('joe@gmail.com', '123456')
+        load.cleanup('load-abc-')
+        self.assertEqual([u.email for u in db.session.query(User).all()], ['joe@gmail.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# project/tests/test_cache.py
+
+
+import time
+import unittest
+
+from project.server.cache import LRUCache, TTLCache, BloomFilter
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 1, 1))
+
+    def test_max_bytes(self):
+        cache = LRUCache(max_entries=100, max_bytes=1000, sizeof=len)
+        cache.set('a', 'x' * 600)
+        cache.set('b', 'x' * 600)
+        self.assertIsNone(cache.get('a'))
+        cache.set('c', 'x' * 2000)
+        self.assertIsNone(cache.get('c'), "Values bigger than the cache aren't stored")
+        self.assertEqual(cache.stats()['bytes'], 600)
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_expiry(self):
+        cache = TTLCache(ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, expires_at=time.time() - 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'), "Explicit expiry caps the ttl")
+
+    def test_discard_where(self):
+        cache = TTLCache(ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.discard_where(lambda v: v == 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [str(i) for i in range(1000)]
+        for k in keys:
+            bloom.add(k)
+        self.assertTrue(all(k in bloom for k in keys))
+        false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
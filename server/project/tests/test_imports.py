@@ -0,0 +1,46 @@
+# project/tests/test_imports.py
+
+
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+# Web workers & manage.py commands import the app; these must only load when training or scaling needs them
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'sklearn', 'tensorflow']
+# Generous for slow CI boxes; the ML stack alone used to take several seconds
+IMPORT_TIME_BUDGET = float(os.getenv('IMPORT_TIME_BUDGET', 1.0))
+
+SCRIPT = """
+import sys, time, json
+start = time.time()
+import project.server
+print(json.dumps(dict(seconds=time.time() - start, modules=sorted(sys.modules))))
+"""
+
+
+def import_app():
+    """Import the app in a fresh interpreter, like a newly started worker"""
+    server_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+    env = dict(os.environ, APP_SETTINGS='project.server.config.TestingConfig')
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=server_dir, env=env)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+class TestImportTime(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.result = import_app()
+
+    def test_ml_stack_is_lazy(self):
+        loaded = [m for m in HEAVY_MODULES if m in self.result['modules']]
+        self.assertEqual(loaded, [], "Imported at startup: %s" % loaded)
+
+    def test_import_time(self):
+        self.assertLess(self.result['seconds'], IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# project/tests/test_indexes.py
+
+
+import unittest
+
+from sqlalchemy import text
+
+from project.server import db
+from project.server import models as m
+from project.bench.generate import seed_comparison
+from project.tests.base import BaseTestCase
+
+
+class TestIndexes(BaseTestCase):
+    """
+    Hot queries must be answerable from an index. Seed data is too small for the planner to prefer one on its own,
+    so sequential scans are priced out: if one still shows up in a plan, no usable index exists.
+    """
+
+    def setUp(self):
+        super(TestIndexes, self).setUp()
+        self.user, self.comparison = seed_comparison(50, n_features=3, hunch_ratio=0.5)
+        self.candidate = self.comparison.candidates[0]
+        self.params = dict(
+            user_id=self.user.id,
+            comparison_id=self.comparison.id,
+            candidate_id=self.candidate.id,
+            feature_id=self.comparison.features[0].id
+        )
+
+    def assertIndexed(self, query):
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = '\n'.join(r[0] for r in db.session.execute(text('EXPLAIN ' + query), self.params))
+        db.session.rollback()
+        self.assertNotIn('Seq Scan', plan, 'Sequential scan in plan for:\n%s\n%s' % (query, plan))
+
+    def test_scores_by_candidate_feature(self):
+        self.assertIndexed("SELECT * FROM scores WHERE candidate_id=:candidate_id AND feature_id=:feature_id")
+
+    def test_hunches_by_candidate(self):
+        self.assertIndexed("SELECT * FROM hunches WHERE candidate_id=:candidate_id")
+
+    def test_recent_hunch(self):
+        self.assertIndexed("""SELECT * FROM hunches WHERE user_id=:user_id AND candidate_id=:candidate_id
+          AND timestamp > now() at time zone 'utc' - interval '1 hours'""")
+
+    def test_by_comparison(self):
+        for table in ['candidates', 'features', 'users_comparisons', 'candidate_stats']:
+            self.assertIndexed("SELECT * FROM {} WHERE comparison_id=:comparison_id".format(table))
+
+    def test_rankings(self):
+        self.assertIndexed(m.Comparison.RANKINGS_QUERY.format(where_after='', order_by=''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# project/tests/test_ingest.py
+
+
+import os
+import datetime
+import tempfile
+import unittest
+
+from project.server.ingest import HunchBuffer, _encode
+
+
+def _hunch(score):
+    return dict(user_id='u', candidate_id='c', comparison_id='x', score=score, timestamp=datetime.datetime.utcnow())
+
+
+class TestHunchBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def apply(self, hunches):
+        self.batches.append([h['score'] for h in hunches])
+
+    def test_sync_applies_immediately(self):
+        buffer = HunchBuffer(self.apply, durability='sync')
+        buffer.add(_hunch(1))
+        buffer.add(_hunch(2))
+        self.assertEqual(self.batches, [[1], [2]])
+
+    def test_batches_until_flush(self):
+        buffer = HunchBuffer(self.apply, durability='memory', max_delay=60)
+        for score in range(3):
+            buffer.add(_hunch(score))
+        self.assertEqual(self.batches, [])
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(self.batches, [[0, 1, 2]])
+        self.assertEqual(buffer.stats()['batches'], 1)
+
+    def test_failed_batch_is_retried(self):
+        buffer = HunchBuffer(self.apply, durability='memory', max_delay=60)
+        buffer.add(_hunch(1))
+        buffer.apply = lambda hunches: 1/0
+        self.assertRaises(ZeroDivisionError, buffer.flush)
+        buffer.apply = self.apply
+        buffer.add(_hunch(2))
+        buffer.flush()
+        self.assertEqual(self.batches, [[1, 2]])
+
+    def test_journal(self):
+        with tempfile.TemporaryDirectory() as journal_dir:
+            buffer = HunchBuffer(self.apply, durability='journal', max_delay=60, journal_dir=journal_dir)
+            buffer.add(_hunch(1))
+            self.assertEqual(len(os.listdir(journal_dir)), 1, "Journaled before add() returns")
+            buffer.flush()
+            self.assertEqual(os.listdir(journal_dir), [], "Dropped once applied")
+
+    def test_recover(self):
+        with tempfile.TemporaryDirectory() as journal_dir:
+            journal = lambda: HunchBuffer(self.apply, durability='journal', journal_dir=journal_dir)._open_segment()
+            # A writer which died before flushing. Its pid is ours (as a reused one would be), but its lock is gone
+            dead = journal()
+            dead.write(_encode(_hunch(4)) + '\n' + '{"torn')
+            dead.close()
+            alive = journal()
+            alive.write(_encode(_hunch(5)) + '\n')
+            alive.flush()
+
+            buffer = HunchBuffer(self.apply, durability='journal', journal_dir=journal_dir)
+            self.assertEqual(buffer.recover(), 1, "Only the dead writer's journal, though both are in our pid")
+            self.assertEqual(self.batches, [[4]])
+            self.assertEqual(len(os.listdir(journal_dir)), 1)
+
+            alive.close()
+            self.assertEqual(buffer.recover(), 1)
+            self.assertEqual(self.batches, [[4], [5]])
+            self.assertEqual(os.listdir(journal_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# project/tests/test_jobs.py
+
+
+import time
+import unittest
+
+from project.server.jobs import TrainingQueue, resource
+
+MEMORY_LIMIT_MB = 256
+
+
+def _sleep(comparison_id, deep):
+    time.sleep(60)
+
+
+def _allocate(comparison_id, deep):
+    bytearray(2 * MEMORY_LIMIT_MB * 1024 * 1024)
+
+
+class TestTrainingQueue(unittest.TestCase):
+
+    def test_coalesces_pending_jobs(self):
+        queue = TrainingQueue(workers=0)  # Nothing gets started, so jobs stay pending
+        queue.submit('comparison-1')
+        queue.submit('comparison-1', deep=True)
+        queue.submit('comparison-2')
+        stats = queue.stats()
+        self.assertEqual(stats['pending'], 2)
+        self.assertEqual(stats['coalesced'], 1)
+        self.assertEqual(queue.pending['comparison-1'], dict(deep=True), "Latest submission wins")
+
+    def _run(self, **kwargs):
+        outcomes = []
+        queue = TrainingQueue(workers=1, on_done=lambda outcome, seconds, deep: outcomes.append(outcome), **kwargs)
+        queue.submit('comparison-1')
+        deadline = time.time() + 60
+        while not outcomes and time.time() < deadline:
+            time.sleep(.1)
+        return queue, outcomes
+
+    def test_kills_jobs_past_timeout(self):
+        queue, outcomes = self._run(timeout=1, job=_sleep)
+        self.assertEqual(outcomes, ['timed_out'])
+        self.assertEqual(queue.stats()['timed_out'], 1)
+        self.assertEqual(queue.stats()['running'], 0)
+
+    @unittest.skipUnless(resource, "No memory limits on this platform")
+    def test_caps_worker_memory(self):
+        queue, outcomes = self._run(job=_allocate)
+        self.assertEqual(outcomes, ['completed'])
+        queue, outcomes = self._run(memory_limit_mb=MEMORY_LIMIT_MB, job=_allocate)
+        self.assertEqual(outcomes, ['failed'], "The allocation raises MemoryError, failing the job")
+        self.assertEqual(queue.stats()['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
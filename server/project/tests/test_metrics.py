@@ -0,0 +1,63 @@
+# project/tests/test_metrics.py
+
+
+import unittest
+
+from project.server import app
+from project.server.metrics import Histogram, metrics
+from project.tests.base import BaseTestCase
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_render(self):
+        histogram = Histogram('h', 'Test', buckets=(1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, route='/a')
+        self.assertEqual(histogram.render(), [
+            '# HELP h Test',
+            '# TYPE h histogram',
+            'h_bucket{route="/a",le="1"} 2',  # Bounds are inclusive
+            'h_bucket{route="/a",le="5"} 3',
+            'h_bucket{route="/a",le="+Inf"} 4',
+            'h_sum{route="/a"} 14.5',
+            'h_count{route="/a"} 4',
+        ])
+
+
+class TestMetrics(BaseTestCase):
+
+    def tearDown(self):
+        app.config['METRICS_ENABLED'] = True
+        super(TestMetrics, self).tearDown()
+
+    def observations(self, histogram, **labels):
+        # Metrics are per-process, so other tests' requests are in there too
+        series = histogram._series.get(tuple(sorted(labels.items())))
+        return series[-1] if series else 0
+
+    def test_request_metrics(self):
+        token = self.auth_user()
+        labels = dict(method='POST', route='/comparisons/', status=200)
+        before = self.observations(metrics.request_seconds, **labels)
+        statements = metrics.request_statements._series.get((('route', '/comparisons/'),), [0, 0])[-2]
+        self.client_post('/comparisons/', data=dict(title='Jobs'), token=token)
+        self.assertEqual(self.observations(metrics.request_seconds, **labels), before + 1)
+        self.assertGreater(metrics.request_statements._series[(('route', '/comparisons/'),)][-2], statements)
+
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        body = resp.data.decode()
+        self.assertIn(
+            'decisions_http_request_duration_seconds_count{method="POST",route="/comparisons/",status="200"}', body)
+        self.assertIn('decisions_sql_statement_duration_seconds_count', body)
+        self.assertIn('decisions_rankings_cache_hits', body)
+        self.assertIn('decisions_hunch_buffer_accepted', body)
+
+    def test_disabled(self):
+        app.config['METRICS_ENABLED'] = False
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
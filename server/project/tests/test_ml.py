@@ -0,0 +1,54 @@
+# project/tests/test_ml.py
+
+
+import unittest
+
+import numpy as np
+
+from project.server.ml import numpy_backend
+from project.server.ml.online import RecursiveLeastSquares
+
+
+class TestNumpyBackend(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.rand(200, 6) * 5
+        self.coef = rng.randn(6)
+        self.y = self.X.dot(self.coef) + 1
+
+    def test_ridge_recovers_coefficients(self):
+        model = numpy_backend.RidgeRegressor(alpha=1e-6).fit(self.X, self.y)
+        np.testing.assert_allclose(model.coef, self.coef, atol=1e-4)
+        np.testing.assert_allclose(model.predict(self.X), self.y, atol=1e-4)
+
+    def test_mlp_fits(self):
+        model = numpy_backend.deep(6).fit(self.X, self.y)
+        baseline = np.abs(self.y - self.y.mean()).mean()
+        self.assertLess(np.abs(model.predict(self.X) - self.y).mean(), baseline / 2)
+
+
+class TestRecursiveLeastSquares(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.rand(50, 4) * 5
+        self.y = self.X.dot(rng.randn(4)) + 1
+
+    def test_updates_match_refit(self):
+        online = RecursiveLeastSquares(4)
+        for x, y in zip(self.X, self.y):
+            online.update(x, y)
+        refit = RecursiveLeastSquares(4).fit(self.X, self.y)
+        np.testing.assert_allclose(online.weights, refit.weights, atol=1e-8)
+        np.testing.assert_allclose(online.predict(self.X), refit.predict(self.X), atol=1e-8)
+
+    def test_downdate_forgets_sample(self):
+        model = RecursiveLeastSquares(4).fit(self.X, self.y)
+        self.assertTrue(model.downdate(self.X[-1], self.y[-1]))
+        refit = RecursiveLeastSquares(4).fit(self.X[:-1], self.y[:-1])
+        np.testing.assert_allclose(model.weights, refit.weights, atol=1e-8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,13 +3,17 @@
 
 
 import unittest
+import datetime
 from unittest.mock import patch, Mock
+import numpy as np
 import pdb
 from pprint import pprint
 
+from sqlalchemy import text
 from project.server import db
 from project.tests.base import BaseTestCase
 from project.server import models as m
+from project.server.ml import get_backend
 
 
 class TestModels(BaseTestCase):
@@ -78,6 +82,38 @@ class TestModels(BaseTestCase):
             .filter_by(candidate_id=candidate_id, feature_id=feature_id, user_id=self.user.id).one(), \
             'Test updated already-created score'
 
+    def test_score_many(self):
+        comparison = self._comparison()
+        scores = [(c.id, f.id, 3) for c in comparison.candidates for f in comparison.features]
+        assert self.user.score_many(scores) == 12
+        assert db.session.query(m.Score).count() == 12
+
+        # Re-scoring upserts in place, and the last duplicate wins
+        candidate_id, feature_id = comparison.candidates[0].id, comparison.features[0].id
+        self.user.score_many([(candidate_id, feature_id, 1), (candidate_id, feature_id, 2)])
+        assert db.session.query(m.Score).count() == 12
+        assert db.session.query(m.Score).get((self.user.id, candidate_id, feature_id)).score == 2
+
+    def test_score_many_permission(self):
+        comparison = self._comparison()
+        scores = [(comparison.candidates[0].id, comparison.features[0].id, 3)]
+        with self.assertRaises(AssertionError):
+            self.friend.score_many(scores)
+        assert db.session.query(m.Score).count() == 0
+
+    def test_permission_resolution(self):
+        comparison = self._comparison()
+        candidate_ids = {c.id for c in comparison.candidates}
+        with self.assertQueries(1):
+            assert self.user._assert_candidates_permission(candidate_ids) == {comparison.id}
+        with self.assertQueries(0):
+            self.user._assert_candidate_permission(comparison.candidates[0].id)  # Memoized
+
+        with self.assertRaises(AssertionError):
+            self.friend._assert_candidates_permission(candidate_ids)
+        self.user.share_comparison(comparison.id, self.friend.id, permission=m.PermissionEnum.score)
+        assert self.friend._assert_candidates_permission(candidate_ids) == {comparison.id}, "Sharing invalidates"
+
     def test_scoreboard_sanity_check(self):
         comparison = self._comparison()
         self._score_some()
@@ -86,6 +122,60 @@ class TestModels(BaseTestCase):
         assert scoreboard[1].title == 'Windows'
         assert scoreboard[2].title == 'Linux'
 
+    def test_score_norm(self):
+        comparison = self._comparison()
+        rows = comparison.get_candidates()
+        assert [r['score_norm'] for r in rows] == [0, 0, 0], "Equal totals normalize to 0, not a division by zero"
+
+        self._score_some()
+        rows = {r['title']: r for r in comparison.get_candidates()}
+        assert rows['Mac']['score_norm'] == 5 and rows['Linux']['score_norm'] == 0
+        assert rows['Windows']['score_norm'] == 2.5
+        assert rows['Mac']['combined_total'] == 5*5*4 / 2
+
+    def test_candidate_stats(self):
+        comparison = self._comparison()
+        self._score_some()
+        mac = comparison.candidates[0]
+        stats = db.session.query(m.CandidateStats).get(mac.id)
+        assert stats.comparison_id == comparison.id
+        assert stats.score_total == 5*5*4, "AVG(score) * weight, summed over 4 features"
+        assert stats.score_count == 4
+        assert len(stats.features) == 4
+        assert stats.features[0]['score'] == 5 and stats.features[0]['score_weighted'] == 25
+
+        self.user.hunch(candidate_id=mac.id, score=4)
+        db.session.refresh(stats)
+        assert stats.hunch_total == 4 and stats.hunch_avg == 4 and stats.hunch_count == 1
+
+    def test_rankings_cache(self):
+        comparison = self._comparison()
+        self._score_some()
+        m.rankings_cache.clear()
+        hits = m.rankings_cache.hits
+        first = comparison.get_candidates()
+        assert comparison.get_candidates() is first, "Unchanged comparison is served from cache"
+        assert m.rankings_cache.hits == hits + 1
+
+        # Any ranking-affecting write bumps the version, so the next read recomputes
+        self.user.score(comparison.candidates[0].id, comparison.features[0].id, 1)
+        assert comparison.get_candidates() is not first
+
+    def test_rankings_cache_last_hunch(self):
+        comparison = self._comparison()
+        self._score_some()
+        mac = comparison.candidates[0]
+        self.user.hunch(candidate_id=mac.id, score=4)
+        by_id = lambda rows: {r['id']: r for r in rows}
+        assert by_id(comparison.get_candidates(user_id=self.user.id))[mac.id]['last_hunch'] == 4
+        assert by_id(comparison.get_candidates(user_id=self.friend.id))[mac.id]['last_hunch'] is None, \
+            "Cached rows are shared across users, last_hunch isn't"
+
+        # The hunch ages out of the revision window without any write bumping the version
+        db.session.execute(text("UPDATE hunches SET timestamp=timestamp - interval '2 hours'"))
+        db.session.commit()
+        assert by_id(comparison.get_candidates(user_id=self.user.id))[mac.id]['last_hunch'] is None
+
     def test_delete_user(self):
         self.user.destroy()
         assert db.session.query(m.User.id).count() == 1, "Only the friend remains"
@@ -105,6 +195,22 @@ class TestModels(BaseTestCase):
         assert db.session.query(m.UserComparison).count() == 0
         assert db.session.query(m.Score).count() == 0
 
+    def test_chunked_purge(self):
+        comparison = self._comparison()
+        self._score_some()
+        # Tombstoned, but the purge "interrupted" before it started
+        with patch.object(m.purge_worker, 'submit'):
+            comparison.destroy()
+        assert self.user.list_comparisons() == [], "Hidden as soon as it's tombstoned"
+        assert db.session.query(m.Score).count() == 12
+
+        progress = []
+        m.Comparison.purge_deleted(batch_size=5, progress=lambda *args: progress.append(args[1:]))
+        assert [p for p in progress if p[0] == 'scores'] == [('scores', 5), ('scores', 10), ('scores', 12)]
+        assert progress[-1] == (None, 0)
+        assert db.session.query(m.Comparison.id).count() == 0
+        assert db.session.query(m.Score).count() == 0
+
     def test_share_comparison(self):
         comparison = self._comparison()
         self.user.share_comparison(comparison.id, self.friend.id)
@@ -143,61 +249,152 @@ class TestModels(BaseTestCase):
         else:
             self.user.hunch(candidate_id=comparison.candidates[i].id, score=5-i)
 
-    @patch('project.server.models.LinearRegressor')
-    @patch('project.server.models.DNNRegressor')
-    def test_hunches(self, DNNRegressor, LinearRegressor):
+    def test_hunches(self):
         comparison = self._comparison()
         self._score_some()
         for i in range(3):
             self._hunch(i)
         assert db.session.query(m.Hunch).count() == 3
         results = comparison.get_candidates()
-        assert results[0].title == 'Mac'
-        assert results[0].hunch == 5
-        assert results[1].title == 'Windows'
-        assert results[1].hunch == 4
-        assert results[2].title == 'Linux'
-        assert results[2].hunch == 3
-        LinearRegressor.assert_not_called()
-        DNNRegressor.assert_not_called()
+        assert results[0]['title'] == 'Mac'
+        assert results[0]['hunch'] == 5
+        assert results[1]['title'] == 'Windows'
+        assert results[1]['hunch'] == 4
+        assert results[2]['title'] == 'Linux'
+        assert results[2]['hunch'] == 3
 
-        i = 0
-        while db.session.query(m.Hunch).count() < 20:
-            self._hunch(i)
+        backend = get_backend()
+        with patch.object(backend, 'linear', wraps=backend.linear) as linear, \
+                patch.object(backend, 'deep', wraps=backend.deep) as deep, \
+                patch.dict(self.app.config, HUNCH_ONLINE_LEARNER=False):
+            # Still using AVG below 20
+            i = 3
+            while db.session.query(m.Hunch).count() < 19:
+                self._hunch(i, create_manually=True)
+                i = i+1
+            comparison.update_hunches()
+            linear.assert_not_called()
+            deep.assert_not_called()
+
+            # Now tip us over 20 hunches, then the linear model should get trained
+            self._hunch(i, create_manually=True)
             i = i+1
+            comparison.update_hunches()
+            linear.assert_called_once()
+            deep.assert_not_called()
+            hunches = {c.title: c.hunch for c in self._comparison().candidates}
+            assert hunches['Mac'] > hunches['Windows'] > hunches['Linux'], "Predictions are published"
+            linear.reset_mock()
 
-        # Results shouldn't have changed (still using AVG)
-        results = comparison.get_candidates()
-        assert results[0].title == 'Mac'
-        assert results[0].hunch == 5
-        assert results[1].title == 'Windows'
-        assert results[1].hunch == 4
-        assert results[2].title == 'Linux'
-        assert results[2].hunch == 3
-        LinearRegressor.assert_not_called()
-        DNNRegressor.assert_not_called()
-
-        def predict(*args, **kwargs):
-            pdb.set_trace()
-            return self._comparison().get_candidates()
-        LinearRegressor.predict = predict
-        DNNRegressor.predict = predict
-
-        # Now tip us over 20 hunches, then LinearRegressor should get called
-        self.user.hunch(candidate_id=comparison.candidates[0].id, score=5)
-        assert db.session.query(m.Hunch).count() == 20
-        LinearRegressor.assert_called_once()
-        DNNRegressor.assert_not_called()
-        LinearRegressor.reset_mock()
-        DNNRegressor.reset_mock()
-
-        # Tip over 100, DNN should be used
-        while db.session.query(m.Hunch).count() < 100:
+            # Tip over 100, DNN should be used
+            while db.session.query(m.Hunch).count() < 100:
+                self._hunch(i, create_manually=True)
+                i = i+1
+            comparison.update_hunches()
+            linear.assert_not_called()
+            deep.assert_called_once()
+
+    def test_record_many(self):
+        comparison = self._comparison()
+        mac, windows = comparison.candidates[0].id, comparison.candidates[1].id
+        now = datetime.datetime.utcnow()
+        hunch = lambda candidate_id, score, ago: dict(user_id=self.user.id, candidate_id=candidate_id,
+            comparison_id=comparison.id, score=score, timestamp=now - datetime.timedelta(minutes=ago))
+        m.Hunch.record_many([hunch(mac, 1, 120), hunch(windows, 2, 10)])
+        version = comparison.version
+
+        # Mac's last hunch is too old to revise; Windows' is revised (twice, in one batch: the latest wins)
+        m.Hunch.record_many([hunch(mac, 5, 0), hunch(windows, 3, 5), hunch(windows, 4, 0)])
+        scores = sorted((h.candidate_id == mac, h.score) for h in db.session.query(m.Hunch))
+        assert scores == [(False, 4), (True, 1), (True, 5)]
+        assert db.session.query(m.CandidateStats).get(windows).hunch_total == 4
+        assert comparison.version == version + 1, "One bump per comparison per batch"
+        hunches = {c.title: c.hunch for c in self._comparison().candidates}
+        assert hunches == {'Mac': 3, 'Windows': 4, 'Linux': None}
+
+    def test_record_many_revision_windows(self):
+        comparison = self._comparison()
+        mac, windows = comparison.candidates[0].id, comparison.candidates[1].id
+        now = datetime.datetime.utcnow()
+        hunch = lambda candidate_id, score, ago: dict(user_id=self.user.id, candidate_id=candidate_id,
+            comparison_id=comparison.id, score=score, timestamp=now - datetime.timedelta(minutes=ago))
+        m.Hunch.record_many([hunch(windows, 1, 70)])
+
+        # As if written one at a time: Mac's 2 revises its 1, but 3 is over an hour after the row they're in. Windows'
+        # 2 revises the existing hunch, which 3 is too late for, though it's within the hour of 2
+        written = m.Hunch.record_many([
+            hunch(mac, 1, 90), hunch(mac, 2, 80), hunch(mac, 3, 10),
+            hunch(windows, 2, 20), hunch(windows, 3, 0)
+        ])
+        assert written == 4
+        rows = db.session.query(m.Hunch).order_by(m.Hunch.timestamp)
+        scores = [(h.candidate_id == mac, h.score) for h in rows]
+        assert scores == [(True, 2), (False, 2), (True, 3), (False, 3)]
+        stats = db.session.query(m.CandidateStats).get(mac)
+        assert stats.hunch_total == 5 and stats.hunch_count == 2
+
+    def test_hunch_running_sums(self):
+        comparison = self._comparison()
+        mac = comparison.candidates[0].id
+        now = datetime.datetime.utcnow()
+        hunch = lambda score, ago: dict(user_id=self.user.id, candidate_id=mac, comparison_id=comparison.id,
+            score=score, timestamp=now - datetime.timedelta(hours=ago))
+        with patch.dict(self.app.config, HUNCH_HALF_LIFE=3600):
+            m.Hunch.record_many([hunch(4, 3)])
+            m.Hunch.record_many([hunch(2, 2.5)])  # Revises the last one, within the hour
+            m.Hunch.record_many([hunch(0, 0)])
+            stats = db.session.query(m.CandidateStats).get(mac)
+            incremental = (stats.hunch_total, stats.hunch_count, stats.hunch_decayed_sum / stats.hunch_decayed_weight)
+            assert incremental[:2] == (2, 2)
+            # Weights 1/8 (3 half-lives old) & 1 (new): (2/8 + 0) / (1/8 + 1)
+            self.assertAlmostEqual(incremental[2], 2/9)
+            self.assertAlmostEqual(self._comparison().candidates[0].hunch, 2/9)
+
+            m.CandidateStats.refresh(candidate_ids=[mac])
+            db.session.refresh(stats)
+            rebuilt = (stats.hunch_total, stats.hunch_count, stats.hunch_decayed_sum / stats.hunch_decayed_weight)
+            np.testing.assert_allclose(incremental, rebuilt, rtol=1e-4)
+
+    def test_predict(self):
+        comparison = self._comparison()
+        self._score_some()
+        model = Mock()
+        model.predict.side_effect = lambda X: X.sum(axis=1)
+        ranking = comparison._predict(model)
+        db.session.commit()
+        titles = {c.id: c.title for c in comparison.candidates}
+        assert [(titles[cid], prediction) for cid, prediction in ranking] == \
+            [('Mac', 20), ('Windows', 16), ('Linux', 12)]
+        hunches = {c.title: c.hunch for c in self._comparison().candidates}
+        assert hunches == {'Mac': 20, 'Windows': 16, 'Linux': 12}, "Predictions are written to candidate.hunch"
+
+    def test_online_hunch_learner(self):
+        comparison = self._comparison()
+        self._score_some()
+        i = 0
+        while db.session.query(m.Hunch).count() < 19:
             self._hunch(i, create_manually=True)
             i = i+1
-        self.user.hunch(candidate_id=comparison.candidates[0].id, score=5)
-        LinearRegressor.assert_not_called()
-        DNNRegressor.assert_called_once()
+        self.user.share_comparison(comparison.id, self.friend.id)
+        mac, windows = comparison.candidates[0].id, comparison.candidates[1].id
+
+        # 20th hunch: learner is fit from scratch
+        self.friend.hunch(candidate_id=mac, score=5)
+        learner = db.session.query(m.HunchLearner).get(comparison.id)
+        assert learner.n_samples == 20 and learner.n_updates == 0
+
+        # Then updated incrementally, including revisions of a recent hunch
+        self.friend.hunch(candidate_id=windows, score=4)
+        self.friend.hunch(candidate_id=windows, score=3)
+        db.session.refresh(learner)
+        assert learner.n_samples == 21 and learner.n_updates == 2
+        hunches = {c.title: c.hunch for c in self._comparison().candidates}
+        assert hunches['Mac'] > hunches['Windows'] > hunches['Linux'], "Predictions are published"
+
+        # ... to the same state a full refit gets to
+        weights = list(learner.weights)
+        comparison.refit_learner()
+        np.testing.assert_allclose(learner.weights, weights)
 
     def test_participant_hunches_are_weighted(self): pass
     def test_participant_scores_are_weighted(self): pass
@@ -0,0 +1,83 @@
+# project/tests/test_tracing.py
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from project.server import app, db
+from project.server.models import Comparison
+from project.server.tracing import tracer
+from project.tests.base import BaseTestCase
+
+
+class TestTracing(BaseTestCase):
+
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.defaults = {k: app.config[k] for k in (
+            'METRICS_ENABLED', 'TRACING_ENABLED', 'TRACE_SAMPLE_RATE', 'TRACE_FILE', 'SLOW_QUERY_MS', 'SLOW_QUERY_EXPLAIN_RATE',
+            'SLOW_QUERY_EXPLAIN_INTERVAL')}
+        app.config.update(
+            TRACING_ENABLED=True, TRACE_SAMPLE_RATE=1, TRACE_FILE=os.path.join(self.dir, 'traces.jsonl'),
+            SLOW_QUERY_MS=0, SLOW_QUERY_EXPLAIN_RATE=1, SLOW_QUERY_EXPLAIN_INTERVAL=0
+        )
+
+    def tearDown(self):
+        app.config.update(self.defaults)
+        shutil.rmtree(self.dir)
+        super(TestTracing, self).tearDown()
+
+    def traces(self):
+        with open(app.config['TRACE_FILE']) as f:
+            return [json.loads(line) for line in f]
+
+    def test_request_spans(self):
+        token = self.auth_user()
+        self.client_post('/comparisons/', data=dict(title='Jobs'), token=token)
+        trace = [t for t in self.traces() if t['type'] == 'trace' and t['attrs'].get('route') == '/comparisons/'][-1]
+        self.assertEqual((trace['attrs']['method'], trace['attrs']['status']), ('POST', 200))
+        spans = {s['name']: s for s in trace['spans']}
+        self.assertIn('auth', spans)
+        self.assertIn('serialize', spans)
+        sql = [s for s in trace['spans'] if s['name'] == 'sql']
+        self.assertTrue(sql)
+        self.assertTrue(all('duration_ms' in s for s in trace['spans']))
+        select = [s for s in sql if s['attrs']['statement'].startswith('SELECT')][0]
+        self.assertTrue(select['attrs']['slow'])
+        self.assertIn('Plan', select['attrs']['plan'][0], 'Slow statements are EXPLAINed')
+        # Re-running the INSERT for its plan hits its own primary key; the savepoint keeps the request's transaction
+        self.assertEqual(db.session.query(Comparison).count(), 1)
+
+    def test_without_metrics(self):
+        # Statements are timed by metrics' hooks, for the tracer too, even with metrics themselves off
+        app.config.update(METRICS_ENABLED=False)
+        token = self.auth_user()
+        self.client_get('/comparisons/', token=token)
+        trace = [t for t in self.traces() if t['type'] == 'trace' and t['attrs'].get('route') == '/comparisons/'][-1]
+        self.assertEqual(trace['attrs']['status'], 200)
+        self.assertTrue([s for s in trace['spans'] if s['name'] == 'sql'])
+
+    def test_sampling(self):
+        app.config.update(TRACE_SAMPLE_RATE=0, SLOW_QUERY_MS=10 ** 6)
+        token = self.auth_user()
+        self.client_get('/comparisons/', token=token)
+        self.assertFalse(os.path.exists(app.config['TRACE_FILE']))
+
+    def test_background_trace(self):
+        with tracer.trace('job') as trace:
+            with tracer.span('outer'):
+                with tracer.span('inner'):
+                    pass
+        self.assertIsNotNone(trace)
+        written = self.traces()[-1]
+        self.assertEqual(written['name'], 'job')
+        outer, inner = written['spans']
+        self.assertEqual(inner['parent'], outer['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
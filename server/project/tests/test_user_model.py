@@ -2,10 +2,12 @@
 
 
 
+import jwt
+import datetime
 import unittest
 
 from project.server import db
-from project.server.models import User
+from project.server.models import User, BlacklistToken
 from project.tests.base import BaseTestCase
 
 
@@ -34,6 +36,37 @@ class TestUserModel(BaseTestCase):
         # FIXME
         # self.assertTrue(User.decode_auth_token(auth_token.decode("utf-8") ) == 1)
 
+    def test_blacklist_by_jti(self):
+        user = User(
+            email='test@test.com',
+            password='test'
+        )
+        db.session.add(user)
+        db.session.commit()
+        auth_token = user.encode_auth_token(user.id)
+        jti = jwt.decode(auth_token, verify=False)['jti']
+        self.assertTrue(User.decode_auth_token(auth_token) == user.id)
+
+        db.session.add(BlacklistToken(token=auth_token))
+        db.session.commit()
+        self.assertTrue(BlacklistToken.check_blacklist(jti))
+        self.assertTrue(User.decode_auth_token(auth_token) == 'Token blacklisted. Please log in again.')
+
+    def test_prune_blacklist(self):
+        user = User(
+            email='test@test.com',
+            password='test'
+        )
+        db.session.add(user)
+        db.session.commit()
+        live, expired = BlacklistToken(token=user.encode_auth_token(user.id)), \
+            BlacklistToken(token=user.encode_auth_token(user.id))
+        expired.expires_on = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.session.add_all([live, expired])
+        db.session.commit()
+        self.assertEqual(BlacklistToken.prune(), 1)
+        self.assertEqual(db.session.query(BlacklistToken).one().jti, live.jti)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,12 +2,14 @@
 
 
 import time
+import uuid
 import json
 import re
 import unittest
 
 from project.server import db
 from project.server import models as m
+from project.server.cursors import encode_cursor
 from project.tests.base import BaseTestCase
 
 
@@ -145,6 +147,86 @@ class TestComparisons(BaseViewTestCase):
             assert len(data['data']['features']) == i+1
             assert len(data['data']['candidates']) == i+1
 
+    def test_list_query_count(self):
+        token = self.auth_user()
+        for i in range(5):
+            comp, _ = self.client_post('/comparisons/', data=dict(title='Title'), token=token)
+            endpoint = '/comparisons/' + comp['data']['id']
+            self.client_post(endpoint + '/features/', data=dict(title='Feature'), token=token)
+            self.client_post(endpoint + '/candidates/', data=dict(title='Candidate'), token=token)
+
+        # comparisons, then features & candidates for all of them (the token's already verified & cached)
+        with self.assertQueries(3):
+            data, resp = self.client_get('/comparisons/?view=full', token=token)
+        self.assert200(resp)
+        assert len(data['data']) == 5
+        assert all(len(c['features']) == 1 and len(c['candidates']) == 1 for c in data['data'])
+
+
+    def test_list_pagination(self):
+        token = self.auth_user()
+        for i in range(3):
+            comp, _ = self.client_post('/comparisons/', data=dict(title='Title-%d' % i), token=token)
+        endpoint = '/comparisons/' + comp['data']['id']
+        self.client_post(endpoint + '/features/', data=dict(title='Feature'), token=token)
+        self.client_post(endpoint + '/candidates/', data=dict(title='Candidate'), token=token)
+
+        data, resp = self.client_get('/comparisons/?limit=2', token=token)
+        self.assert200(resp)
+        assert [c['title'] for c in data['data']] == ['Title-2', 'Title-1'], 'Newest first'
+        summary = data['data'][0]
+        assert summary['feature_count'] == 1 and summary['candidate_count'] == 1
+        assert 'features' not in summary and 'candidates' not in summary
+        assert data['next']
+
+        data, resp = self.client_get('/comparisons/?limit=2&after=' + data['next'], token=token)
+        assert [c['title'] for c in data['data']] == ['Title-0']
+        assert data['next'] is None
+
+        data, resp = self.client_get('/comparisons/?after=bogus', token=token)
+        self.assert400(resp)
+        # Well-formed cursors holding the wrong kinds of value
+        for values in (['yesterday', str(uuid.uuid4())], ['2017-08-01T12:00:00', 'not-a-uuid'], [1, 2]):
+            data, resp = self.client_get('/comparisons/?after=' + encode_cursor(values), token=token)
+            self.assert400(resp)
+
+    def test_bulk_share(self):
+        token = self.auth_user()
+        comp, _ = self.client_post('/comparisons/', data=dict(title='Title'), token=token)
+        endpoint = '/comparisons/' + comp['data']['id'] + '/shares'
+        for i in range(3):
+            db.session.add(m.User(email='friend%d@x.com' % i, password='123456'))
+        db.session.commit()
+
+        emails = ['friend0@x.com', 'friend1@x.com', 'nobody@x.com']
+        data, resp = self.client_post(endpoint, data=dict(emails=emails), token=token)
+        self.assert200(resp)
+        assert data['data'] == dict(shared=emails[:2], already_shared=[], unknown=['nobody@x.com'])
+
+        emails = ['friend1@x.com', 'friend2@x.com', 'other@x.com']
+        data, resp = self.client_post(endpoint, data=dict(emails=emails, permission='score'), token=token)
+        assert data['data'] == dict(shared=['friend2@x.com', 'other@x.com'], already_shared=['friend1@x.com'],
+                                    unknown=[])
+        assert db.session.query(m.UserComparison).filter_by(comparison_id=comp['data']['id']).count() == 5
+
+        data, resp = self.client_post(endpoint, data=dict(emails=emails, permission='owner'), token=token)
+        self.assert400(resp)
+        data, resp = self.client_post(endpoint, data=dict(emails='friend0@x.com'), token=token)
+        self.assert400(resp)
+        data, resp = self.client_post(endpoint, data=dict(), token=token)
+        self.assert400(resp)
+
+        endpoint = '/comparisons/' + self.inaccessible_comparison.id + '/shares'
+        data, resp = self.client_post(endpoint, data=dict(emails=emails), token=token)
+        self.assert404(resp)
+
+        # Only the owner can share, not someone it's been shared with
+        joe = db.session.query(m.User).filter_by(email='joe@gmail.com').first()
+        self.other_user.share_comparison(self.inaccessible_comparison.id, joe.id, permission=m.PermissionEnum.score)
+        data, resp = self.client_post(endpoint, data=dict(emails=emails, permission='add_feature'), token=token)
+        self.assert403(resp)
+
+
 class TestFeatures(BaseViewTestCase):
     def setUp(self):
         super(TestFeatures, self).setUp()
@@ -168,6 +250,71 @@ class TestCandidates(BaseViewTestCase):
     def test_invalid_perms(self): self.do_test_invalid_perms()
     def test_get_all(self): self.do_test_get_all()
 
+    def test_stream(self):
+        token = self.auth_user()
+        comp, _ = self.client_post('/comparisons/', data=dict(title='Title'), token=token)
+        endpoint = '/comparisons/' + comp['data']['id'] + '/candidates/'
+        feature, _ = self.client_post('/comparisons/' + comp['data']['id'] + '/features/', data=dict(title='Feature'), token=token)
+        scores = []
+        for i in range(5):
+            candidate, _ = self.client_post(endpoint, data=dict(title='Candidate-%d' % i), token=token)
+            # Two ties, which pagination mustn't split or repeat
+            scores.append(dict(candidate_id=candidate['data']['id'], feature_id=feature['data']['id'], score=i // 2))
+        self.client_post('/scores', data=scores, token=token)
+
+        data, resp = self.client_get(endpoint, token=token)
+        expected = sorted(data['data'], key=lambda c: (c['score_total'], c['id']), reverse=True)
+
+        seen, after = [], ''
+        while after is not None:
+            data, resp = self.client_get(endpoint + '?limit=2&after=' + after, token=token)
+            self.assert200(resp)
+            seen += data['data']
+            after = data['next']
+        assert seen == expected
+
+        resp = self.client.get(endpoint + '?format=ndjson&limit=3', **self._build_req_kwargs(token=token))
+        self.assert200(resp)
+        assert resp.mimetype == 'application/x-ndjson'
+        lines = [json.loads(l) for l in resp.data.decode().splitlines()]
+        assert lines[:3] == expected[:3]
+        assert 'next' in lines[3]
+
+        data, resp = self.client_get(endpoint + '?after=bogus', token=token)
+        self.assert400(resp)
+        data, resp = self.client_get(endpoint + '?after=' + encode_cursor(['1.5', str(uuid.uuid4())]), token=token)
+        self.assert400(resp)
+
+
+class TestScores(BaseViewTestCase):
+    def test_score_many(self):
+        token = self.auth_user()
+        comp, _ = self.client_post('/comparisons/', data=dict(title='Title'), token=token)
+        endpoint = '/comparisons/' + comp['data']['id']
+        feature, _ = self.client_post(endpoint + '/features/', data=dict(title='Feature'), token=token)
+        candidate, _ = self.client_post(endpoint + '/candidates/', data=dict(title='Candidate'), token=token)
+
+        body = [dict(candidate_id=candidate['data']['id'], feature_id=feature['data']['id'], score=4)]
+        data, resp = self.client_post('/scores', data=body, token=token)
+        self.assert200(resp)
+        assert data['data']['count'] == 1
+        assert db.session.query(m.Score).one().score == 4
+
+        invalid = [
+            dict(candidate_id=candidate['data']['id'], feature_id=feature['data']['id']),  # No score
+            dict(body[0], score='4'),
+            dict(body[0], score=6),
+            dict(body[0], candidate_id='not-a-uuid'),
+            # A feature from a comparison the candidate isn't in
+            dict(body[0], feature_id=self.inaccessible_comparison.features[0].id),
+        ]
+        for score in invalid:
+            data, resp = self.client_post('/scores', data=[score], token=token)
+            self.assert400(resp)
+        data, resp = self.client_post('/scores', data=body[0], token=token)
+        self.assert400(resp)
+        assert db.session.query(m.Score).one().score == 4, 'Nothing written'
+
 
 if __name__ == '__main__':
     unittest.main()